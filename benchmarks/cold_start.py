@@ -0,0 +1,141 @@
+"""
+Cold-start benchmark for worker boot.
+
+Measures, in a fresh interpreter per run, how long it takes to import the
+WSGI/ASGI entry point and to serve the first request, for each settings
+profile. The first request is an unauthenticated GET /api/rides/, which goes
+through URL resolution, middleware, DRF and JWT authentication without
+touching the database.
+
+Usage:
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --runs 10 --profiles wingz.settings wingz.settings_api
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+PROBE = r'''
+import asyncio
+import io
+import json
+import sys
+import time
+
+entry = sys.argv[1]
+
+start = time.perf_counter()
+if entry == 'wsgi':
+    from wingz.wsgi import application
+else:
+    from wingz.asgi import application
+imported = time.perf_counter()
+
+
+def wsgi_request():
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': '/api/rides/',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+    }
+    statuses = []
+    body = b''.join(application(environ, lambda status, headers: statuses.append(status)))
+    return int(statuses[0].split()[0]), body
+
+
+def asgi_request():
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': '/api/rides/',
+        'raw_path': b'/api/rides/',
+        'query_string': b'',
+        'headers': [(b'host', b'localhost')],
+        'server': ('localhost', 80),
+        'client': ('127.0.0.1', 12345),
+    }
+    messages = []
+    received = []
+
+    async def receive():
+        if received:
+            # Django listens for a disconnect while the view runs
+            await asyncio.Future()
+        received.append(True)
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    return messages[0]['status'], b''.join(m.get('body', b'') for m in messages[1:])
+
+
+status, _ = wsgi_request() if entry == 'wsgi' else asgi_request()
+first_request = time.perf_counter()
+
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'status': status,
+    'modules': len(sys.modules),
+}))
+'''
+
+
+def run_probe(settings_module, entry):
+    env = dict(os.environ)
+    env['DJANGO_SETTINGS_MODULE'] = settings_module
+    env.setdefault('SECRET_KEY', 'cold-start-benchmark')
+    env['PYTHONPATH'] = str(BASE_DIR)
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, entry],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f'{settings_module} {entry} probe failed:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument(
+        '--profiles', nargs='+', default=['wingz.settings', 'wingz.settings_api']
+    )
+    parser.add_argument('--entries', nargs='+', default=['wsgi', 'asgi'])
+    args = parser.parse_args()
+
+    header = f"{'profile':<22} {'entry':<5} {'import ms':>10} {'1st req ms':>11} {'total ms':>9} {'modules':>8} {'status':>6}"
+    print(header)
+    print('-' * len(header))
+    for settings_module in args.profiles:
+        for entry in args.entries:
+            samples = [run_probe(settings_module, entry) for _ in range(args.runs)]
+            import_ms = statistics.median(s['import_ms'] for s in samples)
+            request_ms = statistics.median(s['first_request_ms'] for s in samples)
+            print(
+                f"{settings_module:<22} {entry:<5} {import_ms:>10.1f} {request_ms:>11.1f} "
+                f"{import_ms + request_ms:>9.1f} {samples[-1]['modules']:>8} {samples[-1]['status']:>6}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Login throughput benchmark.
+
+Runs a burst of concurrent logins against /api/token/ while another client
+polls GET /api/rides/, and reports login throughput, shed logins (503) and the
+ride listing latency, for each password hashing mode:
+
+    inline  password checked on the request thread (the default)
+    pool    password checked on the bounded hashing pool
+    async   async token view awaiting the pool, driven through ASGI
+
+Everything runs in-process against a throwaway in-memory test database with
+the project's real password hasher.
+
+Usage:
+    python benchmarks/login_throughput.py
+    python benchmarks/login_throughput.py --duration 10 --logins 16 --workers 2
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wingz.settings')
+os.environ.setdefault('SECRET_KEY', 'login-benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection, connections  # noqa: E402
+from django.test import AsyncClient, Client, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import clear_url_caches  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from rides.models import Ride, User  # noqa: E402
+from rides.serializers import get_tokens_for_user  # noqa: E402
+
+
+EMAIL = 'bench-admin@test.com'
+PASSWORD = 'bench-pass-123'
+RIDES_URL = '/api/rides/?page_size=50'
+
+
+def seed(rides):
+    admin = User.objects.create_user(
+        username=EMAIL, email=EMAIL, password=PASSWORD, role='admin',
+        first_name='Bench', last_name='Admin', phone_number='0'
+    )
+    Ride.objects.bulk_create([
+        Ride(
+            status='pickup', id_rider=admin, id_driver=admin,
+            pickup_latitude=37.7 + i * 1e-4, pickup_longitude=-122.4,
+            dropoff_latitude=37.8, dropoff_longitude=-122.5,
+            pickup_time=timezone.now()
+        )
+        for i in range(rides)
+    ])
+    return get_tokens_for_user(admin)['access']
+
+
+def summarize(latencies):
+    if not latencies:
+        return 'n/a'
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return f"p50 {statistics.median(latencies) * 1000:6.1f}ms  p95 {p95 * 1000:6.1f}ms"
+
+
+def run_threaded(access_token, duration, login_threads):
+    stop = threading.Event()
+    outcomes = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def login_loop():
+        client = Client()
+        while not stop.is_set():
+            response = client.post('/api/token/', {'email': EMAIL, 'password': PASSWORD})
+            with lock:
+                outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+        connections.close_all()
+
+    def rides_loop():
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.get(RIDES_URL)
+            latencies.append(time.perf_counter() - start)
+        connections.close_all()
+
+    threads = [threading.Thread(target=login_loop) for _ in range(login_threads)]
+    threads.append(threading.Thread(target=rides_loop))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return outcomes, latencies
+
+
+def run_async(access_token, duration, logins):
+    outcomes = {}
+    latencies = []
+
+    async def main():
+        deadline = time.perf_counter() + duration
+
+        async def login_loop():
+            client = AsyncClient()
+            while time.perf_counter() < deadline:
+                response = await client.post(
+                    '/api/token/', {'email': EMAIL, 'password': PASSWORD},
+                    content_type='application/json'
+                )
+                outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+
+        async def rides_loop():
+            client = AsyncClient(headers={'Authorization': f'Bearer {access_token}'})
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await client.get(RIDES_URL)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(rides_loop(), *(login_loop() for _ in range(logins)))
+
+    asyncio.run(main())
+    return outcomes, latencies
+
+
+def report(label, outcomes, latencies, duration):
+    ok = outcomes.get(200, 0)
+    shed = outcomes.get(503, 0)
+    other = sum(count for code, count in outcomes.items() if code not in (200, 503))
+    print(
+        f"{label:<9} logins/s {ok / duration:7.1f}  shed {shed:5d}  errors {other:3d}  "
+        f"rides {summarize(latencies)} ({len(latencies)} requests)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per scenario.')
+    parser.add_argument('--logins', type=int, default=16, help='Concurrent login clients.')
+    parser.add_argument('--workers', type=int, default=None, help='Hashing pool workers.')
+    parser.add_argument('--max-pending', type=int, default=64, help='Hashing queue-depth limit.')
+    parser.add_argument('--rides', type=int, default=200, help='Rides to seed.')
+    parser.add_argument('--modes', nargs='+', default=['inline', 'pool', 'async'])
+    args = parser.parse_args()
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    access_token = seed(args.rides)
+
+    _, idle = run_threaded(access_token, min(args.duration, 2.0), login_threads=0)
+    print(f"{'idle':<9} {'':43}rides {summarize(idle)} ({len(idle)} requests)")
+
+    pool_settings = {
+        'PASSWORD_HASHING_WORKERS': args.workers,
+        'PASSWORD_HASHING_MAX_PENDING': args.max_pending,
+    }
+    for mode in args.modes:
+        if mode == 'async':
+            with override_settings(ASYNC_TOKEN_ENDPOINT=True, **pool_settings):
+                # urls.py picks the token view at import time
+                sys.modules.pop('rides.urls', None)
+                sys.modules.pop('wingz.urls', None)
+                clear_url_caches()
+                outcomes, latencies = run_async(access_token, args.duration, args.logins)
+        else:
+            with override_settings(PASSWORD_HASHING_MODE=mode, **pool_settings):
+                outcomes, latencies = run_threaded(access_token, args.duration, args.logins)
+        report(mode, outcomes, latencies, args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,132 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.db import router, transaction
+from django.utils import timezone
+
+from .counters import record_ride_change, ride_counter_key
+from .heatmap import record_pickup_change, ride_pickup_key
 from .models import User, Ride, RideEvent
+from .pagination import EstimatedCount, StrategyPaginator
+
+
+class EstimatedCountPaginator(StrategyPaginator):
+    """
+    Changelist paginator counting with planner estimates on large tables
+    (see RIDE_COUNT_ESTIMATE_THRESHOLD) instead of a full COUNT(*).
+    Smaller counts are cached like the API's (RIDE_COUNT_CACHE_TIMEOUT).
+    """
+    cache_timeout = None
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True):
+        super().__init__(
+            object_list, per_page, orphans, allow_empty_first_page,
+            count_strategy=EstimatedCount(timeout=self.cache_timeout)
+        )
+
+
+class UncachedEstimatedCountPaginator(EstimatedCountPaginator):
+    # Event writes do not invalidate cached counts
+    cache_timeout = 0
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) behind "x of y selected"
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(User)
+class UserAdmin(ScalableAdmin):
+    list_display = ('id', 'email', 'username', 'first_name', 'last_name', 'role', 'is_active')
+    # Exact matches only, so lookups stay on the unique indexes
+    search_fields = ('=email', '=username')
+    ordering = ('-id',)
+
+
+class RecentRideEventInline(admin.TabularInline):
+    """Only the events of the last 24 hours; the full history is in RideEventAdmin."""
+    model = RideEvent
+    fields = ('description', 'created_at')
+    readonly_fields = ('created_at',)
+    ordering = ('-created_at',)
+    extra = 0
+    window = timedelta(hours=24)
+    verbose_name_plural = 'ride events (last 24 hours)'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(created_at__gte=timezone.now() - self.window)
+
+
+@admin.register(Ride)
+class RideAdmin(ScalableAdmin):
+    list_display = (
+        'id_ride', 'status', 'rider_email', 'driver_email', 'pickup_time', 'trip_length_km'
+    )
+    list_select_related = ('id_rider', 'id_driver')
+    # Every filter and the ordering are served by an index on ride
+    list_filter = ('status', ('pickup_time', admin.DateFieldListFilter))
+    ordering = ('-pickup_time',)
+    raw_id_fields = ('id_rider', 'id_driver')
+    readonly_fields = ('trip_length_km', 'created_at', 'updated_at', 'deleted_at')
+    inlines = [RecentRideEventInline]
+
+    def record_write(self, old, new):
+        """
+        Moves a ride between fleet counters and heatmap tiles, as API writes
+        do, inside the transaction that writes it. Soft-deleted rides are in
+        neither.
+        """
+        old, new = [ride if ride is not None and ride.deleted_at is None else None for ride in (old, new)]
+        record_ride_change(
+            ride_counter_key(old) if old else None, ride_counter_key(new) if new else None
+        )
+        record_pickup_change(
+            ride_pickup_key(old) if old else None, ride_pickup_key(new) if new else None
+        )
+
+    def save_model(self, request, obj, form, change):
+        using = router.db_for_write(Ride, instance=obj)
+        with transaction.atomic(), transaction.atomic(using=using):
+            old = None
+            if change:
+                old = Ride.objects.using(using).select_for_update().filter(pk=obj.pk).first()
+            super().save_model(request, obj, form, change)
+            self.record_write(old, obj)
+
+    def delete_model(self, request, obj):
+        using = router.db_for_write(Ride, instance=obj)
+        with transaction.atomic(), transaction.atomic(using=using):
+            old = Ride.objects.using(using).select_for_update().filter(pk=obj.pk).first()
+            self.record_write(old, None)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic(), transaction.atomic(using=queryset.db):
+            for ride in queryset.select_for_update():
+                self.record_write(ride, None)
+            super().delete_queryset(request, queryset)
+
+    @admin.display(description='Rider', ordering='id_rider__email')
+    def rider_email(self, ride):
+        return ride.id_rider.email
+
+    @admin.display(description='Driver', ordering='id_driver__email')
+    def driver_email(self, ride):
+        return ride.id_driver.email
+
+
+@admin.register(RideEvent)
+class RideEventAdmin(ScalableAdmin):
+    paginator = UncachedEstimatedCountPaginator
+    list_display = ('id_ride_event', 'ride', 'description', 'created_at')
+    list_filter = (('created_at', admin.DateFieldListFilter),)
+    ordering = ('-created_at',)
+    raw_id_fields = ('id_ride',)
+    readonly_fields = ('created_at',)
 
-admin.site.register(User)
-admin.site.register(Ride)
-admin.site.register(RideEvent)
\ No newline at end of file
+    @admin.display(description='Ride', ordering='id_ride')
+    def ride(self, event):
+        # The id alone, without joining ride
+        return event.id_ride_id
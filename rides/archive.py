@@ -0,0 +1,135 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from .models import ArchiveCheckpoint, RideEvent, RideEventArchive
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_NAME = 'ride_event'
+
+HISTORY_FIELDS = ('id_ride_event', 'description', 'created_at')
+
+
+def get_retention_cutoff(older_than_days=None):
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'RIDE_EVENT_RETENTION_DAYS', 90)
+    return timezone.now() - timedelta(days=older_than_days)
+
+
+def checkpoint_name(using=DEFAULT_DB_ALIAS):
+    # One checkpoint per ride shard; event ids are only unique within a shard
+    if using == DEFAULT_DB_ALIAS:
+        return CHECKPOINT_NAME
+    return f'{CHECKPOINT_NAME}:{using}'
+
+
+def get_checkpoint(cutoff, restart=False, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the checkpoint to continue from.
+    An unfinished run keeps its original cutoff so resuming never changes
+    which events qualify; a finished run (or `restart`) starts over.
+    Checkpoints always live on the default database.
+    """
+    checkpoint, created = ArchiveCheckpoint.objects.get_or_create(
+        name=checkpoint_name(using),
+        defaults={'cutoff': cutoff}
+    )
+    if not created and (restart or checkpoint.completed_at is not None):
+        checkpoint.cutoff = cutoff
+        checkpoint.last_id = 0
+        checkpoint.archived_count = 0
+        checkpoint.started_at = timezone.now()
+        checkpoint.completed_at = None
+        checkpoint.save()
+    return checkpoint
+
+
+def archive_batch(checkpoint, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Moves one batch of events older than the checkpoint cutoff into the
+    archive table of the `using` database. Insert, delete and checkpoint
+    update share a transaction (two, when events are on a shard).
+    Returns the number of events moved.
+    """
+    with transaction.atomic(), transaction.atomic(using=using):
+        events = list(
+            RideEvent.objects.using(using)
+            .filter(created_at__lt=checkpoint.cutoff, pk__gt=checkpoint.last_id)
+            .order_by('pk')
+            .values('id_ride_event', 'id_ride_id', 'description', 'created_at')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        RideEventArchive.objects.using(using).bulk_create([
+            RideEventArchive(
+                id_ride_event=event['id_ride_event'],
+                id_ride_id=event['id_ride_id'],
+                description=event['description'],
+                created_at=event['created_at'],
+                archive_month=event['created_at'].date().replace(day=1),
+            )
+            for event in events
+        ], ignore_conflicts=True)
+
+        ids = [event['id_ride_event'] for event in events]
+        RideEvent.objects.using(using).filter(pk__in=ids).delete()
+
+        checkpoint.last_id = ids[-1]
+        checkpoint.archived_count += len(ids)
+        checkpoint.save(update_fields=['last_id', 'archived_count', 'updated_at'])
+
+    return len(ids)
+
+
+def archive_ride_events(older_than_days=None, batch_size=None, sleep=None,
+                        max_batches=None, restart=False, using=DEFAULT_DB_ALIAS):
+    """
+    Moves ride events older than the retention period into ride_event_archive
+    in throttled batches, on the `using` database (a ride shard when rides
+    are sharded). Safe to interrupt and run again.
+    Returns the checkpoint.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'RIDE_EVENT_ARCHIVE_BATCH_SIZE', 1000)
+    if sleep is None:
+        sleep = getattr(settings, 'RIDE_EVENT_ARCHIVE_SLEEP', 0.1)
+
+    checkpoint = get_checkpoint(
+        get_retention_cutoff(older_than_days), restart=restart, using=using
+    )
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(checkpoint, batch_size, using=using)
+        if not moved:
+            checkpoint.completed_at = timezone.now()
+            checkpoint.save(update_fields=['completed_at', 'updated_at'])
+            break
+        batches += 1
+        logger.info(
+            f"Archived {moved} ride events (total {checkpoint.archived_count}, "
+            f"last id {checkpoint.last_id})"
+        )
+        if sleep:
+            time.sleep(sleep)
+
+    return checkpoint
+
+
+def ride_event_history(ride, include_archive=False):
+    """
+    Events of a ride ordered by creation time.
+    With `include_archive`, archived events are merged in with a UNION ALL.
+    """
+    # Related managers read from the ride's own database (its shard)
+    events = ride.ride_events.values(*HISTORY_FIELDS)
+    if include_archive:
+        archived = ride.archived_ride_events.values(*HISTORY_FIELDS)
+        events = events.union(archived, all=True)
+    return events.order_by('created_at', 'id_ride_event')
@@ -0,0 +1,92 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import RideChange, RideEvent
+from .sharding import each_shard
+
+
+USERS_VERSION_KEY = 'rides:users:version'
+
+
+def get_users_version():
+    """Bumped on every user write; rider and driver details are part of the payload."""
+    return cache.get_or_set(USERS_VERSION_KEY, 0, None)
+
+
+def bump_users_version():
+    try:
+        cache.incr(USERS_VERSION_KEY)
+    except ValueError:
+        cache.set(USERS_VERSION_KEY, 1, None)
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest())
+
+
+def ride_validators(ride, since, variant=''):
+    """
+    ETag for a single ride: its updated_at, its latest event, the number of
+    events still inside the recent window (events age out of
+    `todays_ride_events`) and the rider/driver details. No Last-Modified:
+    user edits and events leaving the window change the payload without
+    moving any timestamp.
+    """
+    events = ride.ride_events.aggregate(
+        latest=Max('created_at'),
+        recent=Count('pk', filter=Q(created_at__gte=since)),
+    )
+    users = [
+        (user.pk, user.email, user.username, user.first_name, user.last_name,
+         user.phone_number, user.role)
+        for user in (ride.id_rider, ride.id_driver)
+    ]
+    return make_etag(
+        ride.pk, ride.updated_at, events['latest'], events['recent'], users, variant
+    )
+
+
+def list_validators(since, variant=''):
+    """
+    ETag for ride lists from state that is cheap to read whatever the
+    number of rides: the last entry of the change feed (every ride write,
+    delete and new event adds one), the oldest event still in the recent
+    window (it moves as events age out) and the users version. Any write
+    changes the ETag of every list, filtered or not.
+    """
+    latest_change = RideChange.objects.aggregate(seq=Max('seq'))['seq']
+    window = [
+        events.filter(created_at__gte=since).aggregate(first=Min('created_at'))['first']
+        for events in each_shard(RideEvent.objects.all())
+    ]
+    return make_etag(latest_change, window, get_users_version(), variant)
+
+
+def _etag_matches(etag, if_none_match):
+    etags = parse_etags(if_none_match)
+    if '*' in etags:
+        return True
+    # If-None-Match uses weak comparison
+    strip = lambda value: value[2:] if value.startswith('W/') else value  # noqa: E731
+    return strip(etag) in {strip(value) for value in etags}
+
+
+def not_modified_response(request, etag):
+    """Returns a 304 response when the request's If-None-Match still matches, else None."""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match or not _etag_matches(etag, if_none_match):
+        return None
+    return set_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+
+def set_validators(response, etag):
+    response['ETag'] = etag
+    # Clients may keep the payload but must revalidate it
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Authorization'
+    return response
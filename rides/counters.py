@@ -0,0 +1,101 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+
+from .models import FleetCounter, Ride
+from .sharding import each_shard
+
+
+def _bump(status, driver_id, delta):
+    """Adds `delta` to the fleet total and the driver's counter for `status`."""
+    for counter_driver_id in (None, driver_id):
+        counters = FleetCounter.objects.filter(status=status, id_driver_id=counter_driver_id)
+        if counters.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                FleetCounter.objects.create(
+                    status=status, id_driver_id=counter_driver_id, count=delta
+                )
+        except IntegrityError:
+            # Created concurrently between the UPDATE and the INSERT
+            counters.update(count=F('count') + delta)
+
+
+def ride_counter_key(ride):
+    return (ride.status, ride.id_driver_id)
+
+
+def record_ride_change(old=None, new=None):
+    """
+    Moves one ride between counters. `old` and `new` are (status, driver_id)
+    pairs, None for a created or deleted ride. Call inside the transaction
+    that writes the ride.
+    """
+    if old == new:
+        return
+    if old is not None:
+        _bump(*old, -1)
+    if new is not None:
+        _bump(*new, 1)
+
+
+def record_rides_deleted(rides):
+    """
+    Takes rides deleted in bulk, outside the views (e.g. cascading from
+    their user), out of the counters: one bump per status and driver.
+    Call inside the deleting transaction, before the rides are gone.
+    """
+    for shard_rides in each_shard(rides):
+        groups = shard_rides.order_by().values('status', 'id_driver').annotate(rides=Count('pk'))
+        for group in groups:
+            _bump(group['status'], group['id_driver'], -group['rides'])
+
+
+def get_fleet_counters(driver_ids=None):
+    """
+    Fleet totals per status, plus per-status counts for the given drivers.
+    A single indexed query whatever the number of rides.
+    """
+    statuses = dict(Ride.RIDE_STATUS_CHOICES)
+    totals = dict.fromkeys(statuses, 0)
+    drivers = {driver_id: dict.fromkeys(statuses, 0) for driver_id in driver_ids or []}
+
+    counters = FleetCounter.objects.filter(
+        Q(id_driver__isnull=True) | Q(id_driver__in=list(drivers))
+    )
+
+    for status, driver_id, count in counters.values_list('status', 'id_driver_id', 'count'):
+        if driver_id is None:
+            totals[status] = count
+        else:
+            drivers[driver_id][status] = count
+
+    return {'totals': totals, 'drivers': drivers}
+
+
+def rebuild_fleet_counters():
+    """
+    Recomputes every counter from the ride table (of every shard).
+    Returns rows written.
+    """
+    per_driver = {}
+    totals = {}
+    for rides in each_shard(Ride.objects.active()):
+        rows = rides.order_by().values('status', 'id_driver').annotate(total=Count('id_ride'))
+        for row in rows:
+            key = (row['status'], row['id_driver'])
+            per_driver[key] = per_driver.get(key, 0) + row['total']
+            totals[row['status']] = totals.get(row['status'], 0) + row['total']
+    counters = [
+        FleetCounter(status=status, id_driver_id=driver_id, count=count)
+        for (status, driver_id), count in per_driver.items()
+    ]
+    counters.extend(
+        FleetCounter(status=status, id_driver=None, count=count)
+        for status, count in totals.items()
+    )
+
+    with transaction.atomic():
+        FleetCounter.objects.all().delete()
+        FleetCounter.objects.bulk_create(counters, batch_size=1000)
+    return len(counters)
@@ -0,0 +1,134 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Ride
+
+
+class Filter:
+    """
+    A query parameter applied as a single ORM lookup.
+    `parse` turns the raw string into the lookup value and raises ValueError
+    with the message returned to the client.
+    """
+
+    def __init__(self, lookup, parse=str, many=False):
+        self.lookup = lookup
+        self.parse = parse
+        self.many = many
+
+    def values(self, params, name):
+        if not self.many:
+            return params.get(name)
+        # Both ?status=a,b and ?status=a&status=b
+        values = [
+            value.strip() for raw in params.getlist(name) for value in raw.split(',')
+        ]
+        return [value for value in values if value] or None
+
+    def clean(self, raw):
+        if self.many:
+            return [self.parse(value) for value in raw]
+        return self.parse(raw)
+
+    def apply(self, queryset, params, name):
+        raw = self.values(params, name)
+        if not raw:
+            return queryset
+        try:
+            value = self.clean(raw)
+        except ValueError as e:
+            raise ValidationError({name: str(e)})
+        return self.filter(queryset, value)
+
+    def filter(self, queryset, value):
+        return queryset.filter(**{self.lookup: value})
+
+
+class BoundingBoxFilter(Filter):
+    """`min_lat,min_lon,max_lat,max_lon` around the pickup point."""
+
+    def __init__(self, latitude, longitude):
+        super().__init__(None, parse=parse_bbox)
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def filter(self, queryset, value):
+        min_lat, min_lon, max_lat, max_lon = value
+        return queryset.filter(**{
+            f'{self.latitude}__range': (min_lat, max_lat),
+            f'{self.longitude}__range': (min_lon, max_lon),
+        })
+
+
+def parse_status(value):
+    if value not in dict(Ride.RIDE_STATUS_CHOICES):
+        raise ValueError(
+            f'Invalid status. Must be one of: {", ".join(dict(Ride.RIDE_STATUS_CHOICES).keys())}'
+        )
+    return value
+
+
+def parse_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError('Must be a number of kilometers')
+
+
+def parse_timestamp(value):
+    """ISO 8601 datetime, or a date meaning its midnight; naive values use TIME_ZONE."""
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is not None:
+                parsed = datetime.combine(date, time.min)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError('Must be an ISO 8601 date or datetime')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_bbox(value):
+    try:
+        min_lat, min_lon, max_lat, max_lon = map(float, value.split(','))
+    except ValueError:
+        raise ValueError('Must be min_lat,min_lon,max_lat,max_lon')
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+        raise ValueError('Invalid bounding box')
+    return min_lat, min_lon, max_lat, max_lon
+
+
+class RideFilterSet:
+    """
+    Query parameters of the rides list. Every filter is backed by an index
+    on `ride` (see Ride.Meta.indexes), alone or with the default ordering;
+    trip length ranges only with sort_by=trip_length.
+    """
+
+    filters = {
+        'status': Filter('status__in', parse=parse_status, many=True),
+        'rider_email': Filter('id_rider__email'),
+        'driver_email': Filter('id_driver__email'),
+        'pickup_from': Filter('pickup_time__gte', parse=parse_timestamp),
+        'pickup_to': Filter('pickup_time__lt', parse=parse_timestamp),
+        'created_from': Filter('created_at__gte', parse=parse_timestamp),
+        'created_to': Filter('created_at__lt', parse=parse_timestamp),
+        'min_trip_km': Filter('trip_length_km__gte', parse=parse_number),
+        'max_trip_km': Filter('trip_length_km__lte', parse=parse_number),
+        'bbox': BoundingBoxFilter('pickup_latitude', 'pickup_longitude'),
+    }
+
+    def __init__(self, params):
+        self.params = params
+
+    def filter_queryset(self, queryset):
+        for name, ride_filter in self.filters.items():
+            queryset = ride_filter.apply(queryset, self.params, name)
+        return queryset
@@ -0,0 +1,146 @@
+import math
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from .models import HeatmapTile, Ride
+from .sharding import each_shard
+
+
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.0511287798
+
+
+def get_zoom_levels():
+    return sorted(set(getattr(settings, 'HEATMAP_ZOOM_LEVELS', [6, 8, 10, 12, 14, 16])))
+
+
+def tile_for(latitude, longitude, zoom):
+    """Slippy-map (x, y) of the tile holding the point at `zoom`."""
+    n = 2 ** zoom
+    latitude = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude)))
+    x = int((longitude + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(latitude)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def bucket_for(timestamp):
+    """Start of the UTC hour holding `timestamp`."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(dt_timezone.utc)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def tiles_for(latitude, longitude, zooms=None):
+    return [(zoom, *tile_for(latitude, longitude, zoom)) for zoom in zooms or get_zoom_levels()]
+
+
+def _bump_tile(zoom, bucket, x, y, delta):
+    tiles = HeatmapTile.objects.filter(zoom=zoom, bucket=bucket, x=x, y=y)
+    if tiles.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            HeatmapTile.objects.create(zoom=zoom, bucket=bucket, x=x, y=y, count=delta)
+    except IntegrityError:
+        # Created concurrently between the UPDATE and the INSERT
+        tiles.update(count=F('count') + delta)
+
+
+def _bump(bucket, latitude, longitude, delta):
+    """Adds `delta` to the pickup count of the point's tile at every zoom level."""
+    for zoom, x, y in tiles_for(latitude, longitude):
+        _bump_tile(zoom, bucket, x, y, delta)
+
+
+def ride_pickup_key(ride):
+    return (bucket_for(ride.pickup_time), ride.pickup_latitude, ride.pickup_longitude)
+
+
+def record_pickup_change(old=None, new=None):
+    """
+    Moves one pickup between tiles. `old` and `new` are ride_pickup_key()
+    values, None for a created or deleted ride. Call inside the transaction
+    that writes the ride.
+    """
+    if old == new:
+        return
+    if old is not None:
+        _bump(*old, -1)
+    if new is not None:
+        _bump(*new, 1)
+
+
+def record_pickups_deleted(rides):
+    """
+    Takes rides deleted in bulk, outside the views (e.g. cascading from
+    their user), out of the tiles: one bump per tile and hour.
+    Call inside the deleting transaction, before the rides are gone.
+    """
+    zooms = get_zoom_levels()
+    counts = Counter()
+    for shard_rides in each_shard(rides):
+        points = shard_rides.values_list('pickup_latitude', 'pickup_longitude', 'pickup_time')
+        for latitude, longitude, pickup_time in points.iterator():
+            bucket = bucket_for(pickup_time)
+            for zoom, x, y in tiles_for(latitude, longitude, zooms):
+                counts[(zoom, bucket, x, y)] += 1
+    for (zoom, bucket, x, y), count in counts.items():
+        _bump_tile(zoom, bucket, x, y, -count)
+
+
+def get_heatmap(zoom, start=None, end=None, bbox=None):
+    """
+    Pickup counts per tile at `zoom`, summed over the hours overlapping
+    [start, end) and limited to the tiles touching `bbox`
+    (min_lat, min_lon, max_lat, max_lon). Reads the tiles only.
+    """
+    if zoom not in get_zoom_levels():
+        raise ValueError(f'Must be one of: {", ".join(map(str, get_zoom_levels()))}')
+
+    tiles = HeatmapTile.objects.filter(zoom=zoom)
+    if start is not None:
+        tiles = tiles.filter(bucket__gte=bucket_for(start))
+    if end is not None:
+        tiles = tiles.filter(bucket__lt=end)
+    if bbox is not None:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        min_x, min_y = tile_for(max_lat, min_lon, zoom)
+        max_x, max_y = tile_for(min_lat, max_lon, zoom)
+        tiles = tiles.filter(x__range=(min_x, max_x), y__range=(min_y, max_y))
+
+    rows = (
+        tiles.values('x', 'y')
+        .annotate(pickups=Sum('count'))
+        .filter(pickups__gt=0)
+        .order_by('x', 'y')
+    )
+    tiles = [{'x': row['x'], 'y': row['y'], 'count': row['pickups']} for row in rows]
+    return {'zoom': zoom, 'tiles': tiles, 'total': sum(tile['count'] for tile in tiles)}
+
+
+def rebuild_heatmap(chunk_size=2000):
+    """
+    Recomputes every tile from the ride table (of every shard).
+    Returns rows written.
+    """
+    zooms = get_zoom_levels()
+    counts = Counter()
+    for rides in each_shard(Ride.objects.active()):
+        points = rides.values_list('pickup_latitude', 'pickup_longitude', 'pickup_time')
+        for latitude, longitude, pickup_time in points.iterator(chunk_size=chunk_size):
+            bucket = bucket_for(pickup_time)
+            for zoom, x, y in tiles_for(latitude, longitude, zooms):
+                counts[(zoom, bucket, x, y)] += 1
+    tiles = [
+        HeatmapTile(zoom=zoom, bucket=bucket, x=x, y=y, count=count)
+        for (zoom, bucket, x, y), count in counts.items()
+    ]
+
+    with transaction.atomic():
+        HeatmapTile.objects.all().delete()
+        HeatmapTile.objects.bulk_create(tiles, batch_size=1000)
+    return len(tiles)
@@ -0,0 +1,135 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def _lock_timeout():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_LOCK_SECONDS', 60))
+
+
+def _to_json(data):
+    return json.loads(json.dumps(data, cls=JSONEncoder))
+
+
+def request_hash(request):
+    payload = json.dumps(
+        [request.method, request.get_full_path(), request.data],
+        cls=JSONEncoder, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """
+    Inserts the key as in progress. Returns (record, claimed); a record that
+    is not claimed belongs to an earlier request with the same key.
+    """
+    now = timezone.now()
+    # Expired keys, and claims abandoned by a crashed worker, are free again
+    IdempotencyKey.objects.filter(id_user=user, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                id_user=user,
+                key=key,
+                request_hash=fingerprint,
+                expires_at=now + _lock_timeout()
+            )
+        return record, True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(id_user=user, key=key).first(), False
+
+
+def _store(record, response):
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status_code=response.status_code,
+        response_body=_to_json(response.data),
+        expires_at=timezone.now() + _ttl()
+    )
+
+
+def _replay(record, fingerprint):
+    if record is None or record.status_code is None:
+        response = Response(
+            {'error': 'A request with this Idempotency-Key is still in progress'},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['Retry-After'] = '1'
+        return response
+    if record.request_hash != fingerprint:
+        return Response(
+            {'error': 'This Idempotency-Key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(record.response_body, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Makes a write action safe to retry. With an Idempotency-Key header, the
+    first response is stored for IDEMPOTENCY_KEY_TTL seconds, and retries
+    with the same key get it back without running the action again. Server
+    errors are not stored, so those requests can be retried for real.
+    Requests without the header are not affected.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        max_length = IdempotencyKey._meta.get_field('key').max_length
+        if len(key) > max_length:
+            return Response(
+                {'error': f'{HEADER} must be at most {max_length} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_hash(request)
+        record, claimed = _claim(request.user, key, fingerprint)
+        if not claimed:
+            return _replay(record, fingerprint)
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+        else:
+            _store(record, response)
+        return response
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000):
+    """Deletes expired keys in batches. Returns the number deleted."""
+    deleted = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        IdempotencyKey.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
@@ -0,0 +1,470 @@
+import csv
+import io
+import itertools
+import json
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .conditional import bump_users_version
+from .counters import rebuild_fleet_counters
+from .heatmap import rebuild_heatmap
+from .models import LoadCheckpoint, LoadIdMap, Ride, RideChange, RideEvent, User, haversine_km
+from .pagination import bump_count_generation
+from .sharding import sharding_enabled
+
+
+logger = logging.getLogger(__name__)
+
+# Load order: rides refer to users, events refer to rides
+ENTITIES = ('users', 'rides', 'events')
+ENTITY_MODELS = {'users': User, 'rides': Ride, 'events': RideEvent}
+
+USER_COLUMNS = (
+    'username', 'email', 'first_name', 'last_name', 'phone_number', 'role',
+    'is_active', 'date_joined'
+)
+RIDE_COLUMNS = (
+    'status', 'pickup_latitude', 'pickup_longitude', 'dropoff_latitude',
+    'dropoff_longitude', 'pickup_time', 'created_at', 'updated_at'
+)
+EVENT_COLUMNS = ('description', 'created_at')
+
+
+def read_rows(path):
+    """Streams rows from a CSV file (with header) or NDJSON, one dict at a time."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _chunked(rows, size):
+    rows = iter(rows)
+    return iter(lambda: list(itertools.islice(rows, size)), [])
+
+
+def _default(field):
+    if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+        return timezone.now()
+    return field.get_default()
+
+
+def _clean(model, row, names):
+    """
+    Converts raw file values with the model fields' own validation.
+    Timestamps from the file are kept, even for auto_now fields.
+    """
+    values = {}
+    for name in names:
+        field = model._meta.get_field(name)
+        raw = row.get(name)
+        optional = (
+            field.has_default() or field.null
+            or getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+        )
+        if (raw is None or raw == '') and optional:
+            values[field.attname] = _default(field)
+            continue
+        value = field.clean(raw, None)
+        if isinstance(value, datetime) and timezone.is_naive(value):
+            value = timezone.make_aware(value, dt_timezone.utc)
+        values[field.attname] = value
+    return values
+
+
+def _source_id(id_map, row, column):
+    source_id = str(row[column])
+    if source_id in id_map:
+        raise ValidationError(f"Already loaded {column} {source_id!r}")
+    return source_id
+
+
+def _lookup(id_map, row, column):
+    try:
+        return id_map[str(row[column])]
+    except KeyError:
+        raise ValidationError(f"Unknown {column} {row.get(column)!r}")
+
+
+def _prepare_user(row, id_maps):
+    values = _clean(User, row, USER_COLUMNS)
+    # Passwords come from the old system already hashed
+    values['password'] = row.get('password') or make_password(None)
+    return _source_id(id_maps['users'], row, 'id'), values
+
+
+def _prepare_ride(row, id_maps):
+    values = _clean(Ride, row, RIDE_COLUMNS)
+    values['id_rider_id'] = _lookup(id_maps['users'], row, 'id_rider')
+    values['id_driver_id'] = _lookup(id_maps['users'], row, 'id_driver')
+    values['trip_length_km'] = haversine_km(
+        values['pickup_latitude'], values['pickup_longitude'],
+        values['dropoff_latitude'], values['dropoff_longitude']
+    )
+    return _source_id(id_maps['rides'], row, 'id_ride'), values
+
+
+def _prepare_event(row, id_maps):
+    values = _clean(RideEvent, row, EVENT_COLUMNS)
+    values['id_ride_id'] = _lookup(id_maps['rides'], row, 'id_ride')
+    return None, values
+
+
+PREPARERS = {'users': _prepare_user, 'rides': _prepare_ride, 'events': _prepare_event}
+
+
+def _match_existing_users(records):
+    """
+    Users whose email already exists are mapped to that account instead of
+    being inserted; rows clashing on username, or repeating an email or id
+    within the chunk, are skipped. One query per chunk.
+    """
+    if not records:
+        return [], [], 0
+    existing = User.objects.filter(
+        Q(email__in=[values['email'] for _, _, values in records])
+        | Q(username__in=[values['username'] for _, _, values in records])
+    ).values_list('email', 'username', 'id')
+    existing_emails = {email: pk for email, _, pk in existing}
+    taken_usernames = {username for _, username, _ in existing}
+    seen_sources, seen_emails = set(), set()
+
+    accepted, mapped, skipped = [], [], 0
+    for index, source_id, values in records:
+        if source_id in seen_sources:
+            error = f"Duplicate id {source_id!r}"
+        elif values['email'] in existing_emails:
+            mapped.append((source_id, existing_emails[values['email']]))
+            seen_sources.add(source_id)
+            continue
+        elif values['email'] in seen_emails:
+            error = f"Duplicate email {values['email']!r}"
+        elif values['username'] in taken_usernames:
+            error = f"Username {values['username']!r} is taken"
+        else:
+            accepted.append((index, source_id, values))
+            seen_sources.add(source_id)
+            seen_emails.add(values['email'])
+            taken_usernames.add(values['username'])
+            continue
+        logger.warning(f"Skipping users row {index}: {error}")
+        skipped += 1
+    return accepted, mapped, skipped
+
+
+def _prepare(entity, chunk, id_maps, offset):
+    """
+    Prepares a chunk row by row so a bad row is skipped and logged instead of
+    failing the whole chunk. Returns (records, mapped, skipped).
+    """
+    records, mapped, skipped = [], [], 0
+    for index, row in enumerate(chunk, start=offset + 1):
+        try:
+            records.append((index, *PREPARERS[entity](row, id_maps)))
+        except (KeyError, ValueError, ValidationError) as e:
+            logger.warning(f"Skipping {entity} row {index}: {e}")
+            skipped += 1
+    if entity == 'users':
+        records, mapped, duplicates = _match_existing_users(records)
+        skipped += duplicates
+    elif entity == 'rides':
+        # Repeated source ids within the chunk
+        seen = set()
+        unique = []
+        for record in records:
+            if record[1] in seen:
+                logger.warning(f"Skipping rides row {record[0]}: Duplicate id_ride {record[1]!r}")
+                skipped += 1
+                continue
+            seen.add(record[1])
+            unique.append(record)
+        records = unique
+    return [(source_id, values) for _, source_id, values in records], mapped, skipped
+
+
+def _allocate_ids(model, count):
+    """
+    Reserves primary keys up front, so rows can be inserted without
+    RETURNING (COPY has none) and still be recorded in the id map.
+    Outside PostgreSQL this assumes the loader is the only writer.
+    Ids of deleted rows are never handed out again: purges and delta sync
+    tombstones refer to rides by id.
+    """
+    if not count:
+        return []
+    pk = model._meta.pk
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                [model._meta.db_table, pk.column, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"SELECT MAX({qn(pk.column)}) FROM {qn(model._meta.db_table)}")
+        start = (cursor.fetchone()[0] or 0) + 1
+        if connection.vendor == 'sqlite':
+            # AUTOINCREMENT keeps the highest id ever used, deleted rows included
+            table = model._meta.db_table
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            start = max(start, (row[0] if row else 0) + 1)
+            if row:
+                cursor.execute(
+                    "UPDATE sqlite_sequence SET seq = %s WHERE name = %s",
+                    [start + count - 1, table]
+                )
+            else:
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)",
+                    [table, start + count - 1]
+                )
+    return list(range(start, start + count))
+
+
+def _copy_text(value):
+    if value is None:
+        return '\\N'
+    return (
+        str(value).replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+def _copy(cursor, table, columns, rows):
+    qn = connection.ops.quote_name
+    sql = f"COPY {qn(table)} ({', '.join(qn(column) for column in columns)}) FROM STDIN"
+    raw = cursor.cursor
+    if hasattr(raw, 'copy'):
+        # psycopg 3
+        with raw.copy(sql) as copy:
+            for row in rows:
+                copy.write_row(row)
+        return
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_text(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    raw.copy_expert(sql, buffer)
+
+
+def _insert(model, fields, rows):
+    """
+    Inserts prepared rows with COPY on PostgreSQL, and with multi-row
+    INSERT statements, as large as the backend's parameter limit allows,
+    elsewhere.
+    """
+    if not rows:
+        return
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            _copy(cursor, table, [field.column for field in fields], rows)
+            return
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(field.column) for field in fields)
+        batch_size = connection.ops.bulk_batch_size(fields, rows)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            values_sql = connection.ops.bulk_insert_sql(
+                fields, [['%s'] * len(fields)] * len(batch)
+            )
+            cursor.execute(
+                f"INSERT INTO {qn(table)} ({columns}) {values_sql}",
+                [value for row in batch for value in row]
+            )
+
+
+def _insert_records(model, records, with_pk):
+    fields = [
+        field for field in model._meta.concrete_fields
+        if with_pk or not field.primary_key
+    ]
+    # The connection itself rather than the proxy, which is costly per value
+    db = connections[DEFAULT_DB_ALIAS]
+    _insert(model, fields, [
+        [
+            field.get_db_prep_save(
+                values[field.attname] if field.attname in values else _default(field),
+                db
+            )
+            for field in fields
+        ]
+        for values in records
+    ])
+
+
+def _change_records(entity, records):
+    """Delta sync entries for loaded rides and events; raw inserts skip the signals."""
+    if entity == 'rides':
+        return [{'id_ride': values['id_ride'], 'kind': RideChange.KIND_RIDE} for values in records]
+    if entity == 'events':
+        return [
+            {'id_ride': values['id_ride_id'], 'id_ride_event': values['id_ride_event'],
+             'kind': RideChange.KIND_EVENT}
+            for values in records
+        ]
+    return []
+
+
+def load_id_map(entity):
+    return dict(LoadIdMap.objects.filter(entity=entity).values_list('source_id', 'target_id'))
+
+
+def _load_chunk(entity, chunk, id_maps, checkpoint):
+    model = ENTITY_MODELS[entity]
+    records, mapped, skipped = _prepare(entity, chunk, id_maps, checkpoint.rows_read)
+    keep_ids = entity in id_maps
+
+    with transaction.atomic():
+        # Ids are needed for the id map and for the change log alike
+        ids = _allocate_ids(model, len(records))
+        for (source_id, values), pk in zip(records, ids):
+            values[model._meta.pk.attname] = pk
+            if keep_ids:
+                mapped.append((source_id, pk))
+        loaded = [values for _, values in records]
+        _insert_records(model, loaded, with_pk=True)
+        if mapped:
+            _insert_records(LoadIdMap, [
+                {'entity': entity, 'source_id': source_id, 'target_id': target_id}
+                for source_id, target_id in mapped
+            ], with_pk=False)
+        changes = _change_records(entity, loaded)
+        if changes:
+            _insert_records(RideChange, changes, with_pk=False)
+
+        checkpoint.rows_read += len(chunk)
+        checkpoint.loaded_count += len(records)
+        checkpoint.skipped_count += skipped
+        checkpoint.save()
+
+    if keep_ids:
+        id_maps[entity].update(mapped)
+
+
+def get_checkpoint(entity, path, restart=False):
+    name = f"{entity}:{path}"
+    if restart:
+        LoadCheckpoint.objects.filter(name=name).delete()
+    checkpoint, _ = LoadCheckpoint.objects.get_or_create(name=name)
+    return checkpoint
+
+
+def load_file(entity, path, id_maps, chunk_size=None, max_chunks=None, restart=False,
+              progress=None):
+    """
+    Loads one file in chunks, each inserted in its own transaction together
+    with its id map rows, its delta sync changes and the checkpoint, so an
+    interrupted load resumes after the last committed chunk. `progress(checkpoint, rows_per_second)`
+    is called after every chunk.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'HISTORY_LOAD_CHUNK_SIZE', 5000)
+    checkpoint = get_checkpoint(entity, path, restart)
+    if checkpoint.completed_at:
+        return checkpoint
+
+    rows = itertools.islice(read_rows(path), checkpoint.rows_read, None)
+    start = time.perf_counter()
+    rows_read = 0
+    for chunks, chunk in enumerate(_chunked(rows, chunk_size)):
+        if max_chunks is not None and chunks >= max_chunks:
+            return checkpoint
+        _load_chunk(entity, chunk, id_maps, checkpoint)
+        rows_read += len(chunk)
+        if progress:
+            progress(checkpoint, rows_read / (time.perf_counter() - start))
+
+    checkpoint.completed_at = timezone.now()
+    checkpoint.save(update_fields=['completed_at', 'updated_at'])
+    return checkpoint
+
+
+def _existing_index_names(model):
+    with connection.cursor() as cursor:
+        return set(connection.introspection.get_constraints(cursor, model._meta.db_table))
+
+
+def restore_indexes(models):
+    """Creates any Meta index that is missing, e.g. after an interrupted load."""
+    if not models:
+        return
+    with connection.schema_editor() as editor:
+        for model in models:
+            existing = _existing_index_names(model)
+            for index in model._meta.indexes:
+                if index.name not in existing:
+                    editor.add_index(model, index)
+
+
+@contextmanager
+def deferred_indexes(models):
+    """
+    Drops the models' secondary (Meta) indexes for the duration of a load
+    and rebuilds them afterwards. Primary keys, foreign key indexes and
+    unique constraints are left alone, so lookups and integrity checks
+    during the load still work.
+    """
+    if not models:
+        yield
+        return
+    with connection.schema_editor() as editor:
+        for model in models:
+            existing = _existing_index_names(model)
+            for index in model._meta.indexes:
+                if index.name in existing:
+                    editor.remove_index(model, index)
+    try:
+        yield
+    finally:
+        restore_indexes(models)
+
+
+def load_history(paths, chunk_size=None, max_chunks=None, defer_indexes=False,
+                 restart=False, progress=None):
+    """
+    Loads users, rides and events from `paths` ({entity: path}), in that
+    order, and stops at the first file that is not finished. Counters, heatmap
+    tiles and cached counts are rebuilt afterwards since raw inserts bypass signals.
+    Returns the checkpoints of the files processed.
+    """
+    if sharding_enabled():
+        raise ValueError('Historical loads write to the default database; disable RIDE_SHARDS')
+    entities = [entity for entity in ENTITIES if paths.get(entity)]
+    id_maps = {entity: load_id_map(entity) for entity in ('users', 'rides')}
+    models = [ENTITY_MODELS[entity] for entity in entities if entity != 'users']
+
+    checkpoints = []
+    with deferred_indexes(models if defer_indexes else []):
+        for entity in entities:
+            checkpoint = load_file(
+                entity, paths[entity], id_maps, chunk_size=chunk_size,
+                max_chunks=max_chunks, restart=restart, progress=progress
+            )
+            checkpoints.append(checkpoint)
+            if not checkpoint.completed_at:
+                break
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for entity in entities:
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(ENTITY_MODELS[entity]._meta.db_table)}")
+    bump_count_generation()
+    bump_users_version()
+    rebuild_fleet_counters()
+    rebuild_heatmap()
+    return checkpoints
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from django.db import DEFAULT_DB_ALIAS
+
+from rides.archive import archive_ride_events
+from rides.sharding import shard_aliases, sharding_enabled
+
+
+class Command(BaseCommand):
+    help = (
+        'Move ride events older than the retention period into '
+        'ride_event_archive in throttled, resumable batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=None,
+            help='Retention period in days (default: RIDE_EVENT_RETENTION_DAYS).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Events moved per transaction (default: RIDE_EVENT_ARCHIVE_BATCH_SIZE).'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=None,
+            help='Seconds to pause between batches (default: RIDE_EVENT_ARCHIVE_SLEEP).'
+        )
+        parser.add_argument(
+            '--max-batches', type=int, default=None,
+            help='Stop after this many batches; the next run resumes from the checkpoint.'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Discard an unfinished checkpoint and start with a fresh cutoff.'
+        )
+
+    def handle(self, *args, **options):
+        aliases = shard_aliases() if sharding_enabled() else [DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            checkpoint = archive_ride_events(
+                older_than_days=options['older_than_days'],
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+                max_batches=options['max_batches'],
+                restart=options['restart'],
+                using=alias,
+            )
+            state = 'complete' if checkpoint.completed_at else 'paused'
+            where = f" on {alias}" if alias != DEFAULT_DB_ALIAS else ''
+            self.stdout.write(self.style.SUCCESS(
+                f"Archive {state}{where}: {checkpoint.archived_count} events moved "
+                f"(cutoff {checkpoint.cutoff.isoformat()}, last id {checkpoint.last_id})"
+            ))
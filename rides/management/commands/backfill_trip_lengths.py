@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from rides.trips import backfill_trip_lengths
+
+
+class Command(BaseCommand):
+    help = 'Store the pickup to dropoff length of rides that do not have one yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rides updated per query.')
+        parser.add_argument('--sleep', type=float, default=0, help='Seconds to pause between batches.')
+        parser.add_argument(
+            '--max-batches', type=int, default=None,
+            help='Stop after this many batches; run again to continue.'
+        )
+
+    def handle(self, *args, **options):
+        updated = backfill_trip_lengths(
+            batch_size=options['batch_size'],
+            sleep=options['sleep'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Stored the trip length of {updated} rides"))
@@ -0,0 +1,52 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.provisioning import get_worker_count, provision_users
+
+
+def read_rows(path):
+    """Reads users from a CSV file (with header), a JSON array or NDJSON."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            return list(csv.DictReader(f))
+        if path.endswith('.json'):
+            return json.load(f)
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-create users from a CSV, JSON or NDJSON file. Passwords are '
+        'hashed in a process pool and users are inserted in chunks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with username, first_name, last_name, '
+                                         'email, phone_number, role and password columns.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='Users per uniqueness check and insert (default: USER_PROVISIONING_CHUNK_SIZE).'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Password hashing processes (default: USER_PROVISIONING_WORKERS or all cores).'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            rows = read_rows(options['path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+
+        workers = get_worker_count(options['workers'])
+        self.stdout.write(f"Provisioning {len(rows)} users with {workers} hashing workers...")
+        result = provision_users(rows, chunk_size=options['chunk_size'], workers=workers)
+
+        for rejected in result['rejected']:
+            self.stderr.write(f"Row {rejected['index']}: {json.dumps(rejected['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} users, rejected {len(result['rejected'])} "
+            f"in {result['seconds']}s ({result['users_per_second']} users/s)"
+        ))
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rides.loader import load_history
+
+
+class Command(BaseCommand):
+    help = (
+        'Load historical users, rides and events from CSV or NDJSON files in '
+        'large, resumable chunks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', help='Users file: id, username, email, first_name, '
+                                            'last_name, phone_number, role, password (hashed).')
+        parser.add_argument('--rides', help='Rides file: id_ride, id_rider, id_driver, status, '
+                                            'coordinates, pickup_time, created_at.')
+        parser.add_argument('--events', help='Events file: id_ride, description, created_at.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=None,
+            help='Rows per transaction (default: HISTORY_LOAD_CHUNK_SIZE).'
+        )
+        parser.add_argument(
+            '--max-chunks', type=int, default=None,
+            help='Stop after this many chunks per file; the next run resumes from the checkpoint.'
+        )
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='Drop secondary ride and event indexes during the load and rebuild them after. '
+                 'Only use while nothing else queries those tables.'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore existing checkpoints and read the files from the start.'
+        )
+
+    def progress(self, checkpoint, rows_per_second):
+        self.stdout.write(
+            f"{checkpoint.name}: {checkpoint.rows_read} rows read, "
+            f"{checkpoint.loaded_count} loaded, {checkpoint.skipped_count} skipped "
+            f"({rows_per_second:.1f} rows/s)"
+        )
+
+    def handle(self, *args, **options):
+        paths = {entity: options[entity] for entity in ('users', 'rides', 'events')}
+        if not any(paths.values()):
+            raise CommandError('Pass at least one of --users, --rides or --events.')
+
+        try:
+            checkpoints = load_history(
+                paths,
+                chunk_size=options['chunk_size'],
+                max_chunks=options['max_chunks'],
+                defer_indexes=options['defer_indexes'],
+                restart=options['restart'],
+                progress=self.progress,
+            )
+        except OSError as e:
+            raise CommandError(f"Could not read input: {e}")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for checkpoint in checkpoints:
+            state = 'complete' if checkpoint.completed_at else 'paused'
+            self.stdout.write(self.style.SUCCESS(
+                f"{checkpoint.name} {state}: {checkpoint.loaded_count} loaded, "
+                f"{checkpoint.skipped_count} skipped"
+            ))
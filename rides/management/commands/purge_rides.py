@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rides.purge import run_pending_purges
+
+
+class Command(BaseCommand):
+    help = 'Remove soft-deleted rides and their events in bounded batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Events deleted per transaction (default: RIDE_PURGE_BATCH_SIZE).'
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=None,
+            help='Seconds to pause between batches (default: RIDE_PURGE_SLEEP).'
+        )
+        parser.add_argument('--limit', type=int, default=None, help='Rides to purge per pass.')
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep running, polling for new purges every --interval seconds.'
+        )
+        parser.add_argument('--interval', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        while True:
+            purged = run_pending_purges(
+                limit=options['limit'],
+                batch_size=options['batch_size'],
+                sleep=options['sleep'],
+            )
+            if purged or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Purged {purged} rides"))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rides.heatmap import rebuild_heatmap
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the pickup heatmap tiles from the ride table.'
+
+    def handle(self, *args, **options):
+        rows = rebuild_heatmap()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} heatmap tiles"))
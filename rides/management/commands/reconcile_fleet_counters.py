@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rides.counters import rebuild_fleet_counters
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the live fleet counters from the ride table.'
+
+    def handle(self, *args, **options):
+        rows = rebuild_fleet_counters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} fleet counters"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from rides.tasks import default_worker_id, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (ride purges, counter rebuilds, archiving).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=None,
+            help='Tasks claimed at a time (default: TASK_BATCH_SIZE).'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to wait before polling again when no task is due.'
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once no task is due.')
+        parser.add_argument('--max-tasks', type=int, default=None, help='Exit after this many tasks.')
+        parser.add_argument('--worker-id', default=None, help='Name recorded on claimed tasks.')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+        processed = run_worker(
+            worker_id=worker_id,
+            batch_size=options['batch_size'],
+            interval=options['interval'],
+            once=options['once'],
+            max_tasks=options['max_tasks'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker_id} ran {processed} tasks"))
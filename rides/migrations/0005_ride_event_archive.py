@@ -0,0 +1,45 @@
+# Generated by Django 5.1.3 on 2026-10-19 08:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0004_remove_ride_distance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('cutoff', models.DateTimeField()),
+                ('last_id', models.IntegerField(default=0)),
+                ('archived_count', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'archive_checkpoint',
+            },
+        ),
+        migrations.CreateModel(
+            name='RideEventArchive',
+            fields=[
+                ('id_ride_event', models.IntegerField(primary_key=True, serialize=False)),
+                ('description', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField()),
+                ('archive_month', models.DateField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('id_ride', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_ride_events', to='rides.ride')),
+            ],
+            options={
+                'db_table': 'ride_event_archive',
+                'indexes': [models.Index(fields=['id_ride', 'created_at'], name='ride_event__id_ride_4d0a7a_idx'), models.Index(fields=['archive_month'], name='ride_event__archive_63246c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0005_ride_event_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FleetCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('en-route', 'En Route'), ('pickup', 'Pickup'), ('dropoff', 'Dropoff')], max_length=20)),
+                ('count', models.BigIntegerField(default=0)),
+                ('id_driver', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fleet_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'fleet_counter',
+                'constraints': [models.UniqueConstraint(fields=('status', 'id_driver'), name='fleet_counter_status_driver_uniq'), models.UniqueConstraint(condition=models.Q(('id_driver__isnull', True)), fields=('status',), name='fleet_counter_status_total_uniq')],
+            },
+        ),
+    ]
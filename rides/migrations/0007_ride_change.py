@@ -0,0 +1,26 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0006_fleet_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('id_ride', models.IntegerField(db_index=True)),
+                ('id_ride_event', models.IntegerField(blank=True, null=True)),
+                ('kind', models.CharField(choices=[('ride', 'Ride created or updated'), ('event', 'Ride event created'), ('delete', 'Ride deleted')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'ride_change',
+            },
+        ),
+    ]
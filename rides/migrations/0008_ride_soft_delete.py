@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0007_ride_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RidePurge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_ride', models.IntegerField(unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('events_deleted', models.BigIntegerField(default=0)),
+                ('batches', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'ride_purge',
+                'indexes': [models.Index(fields=['status', 'requested_at'], name='ride_purge_status_9e4e87_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0008_ride_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('rows_read', models.BigIntegerField(default=0)),
+                ('loaded_count', models.BigIntegerField(default=0)),
+                ('skipped_count', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'load_checkpoint',
+            },
+        ),
+        migrations.CreateModel(
+            name='LoadIdMap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(max_length=20)),
+                ('source_id', models.CharField(max_length=64)),
+                ('target_id', models.BigIntegerField()),
+            ],
+            options={
+                'db_table': 'load_id_map',
+                'constraints': [models.UniqueConstraint(fields=('entity', 'source_id'), name='load_id_map_entity_source_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0009_history_load'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RideDirectory',
+            fields=[
+                ('id_ride', models.AutoField(primary_key=True, serialize=False)),
+                ('region', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'ride_directory',
+            },
+        ),
+    ]
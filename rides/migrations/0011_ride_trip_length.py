@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0010_ride_directory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ride',
+            name='trip_length_km',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0011_ride_trip_length'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ride',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='id_driver',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rides_as_driver', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='ride',
+            name='id_rider',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rides_as_rider', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['pickup_time'], name='ride_pickup__112ef2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['status', 'pickup_time'], name='ride_status_03df0b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['id_rider', 'pickup_time'], name='ride_id_ride_a30c83_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['id_driver', 'pickup_time'], name='ride_id_driv_112a1b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['created_at'], name='ride_created_5880d6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(fields=['pickup_latitude', 'pickup_longitude'], name='ride_pickup__22d4cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ride',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='ride_deleted_at_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rides', '0014_task_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'heatmap_tile',
+                'constraints': [models.UniqueConstraint(fields=('zoom', 'bucket', 'x', 'y'), name='heatmap_tile_zoom_bucket_xy_uniq')],
+            },
+        ),
+    ]
@@ -6,6 +6,21 @@ from django.core.validators import EmailValidator
 import math
 
 
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometers between two points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, map(float, (lat1, lon1, lat2, lon2)))
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    return EARTH_RADIUS_KM * c
+
+
 class User(AbstractUser):
     id = models.AutoField(primary_key=True)
     role = models.CharField(max_length=50, default='user')  # 'admin' or other roles
@@ -29,6 +44,12 @@ class User(AbstractUser):
 
 
 
+class RideQuerySet(models.QuerySet):
+    def active(self):
+        """Rides that are not soft-deleted and waiting for the purger."""
+        return self.filter(deleted_at__isnull=True)
+
+
 class Ride(models.Model):
     RIDE_STATUS_CHOICES = [
         ('en-route', 'En Route'),
@@ -38,15 +59,18 @@ class Ride(models.Model):
 
     id_ride = models.AutoField(primary_key=True)
     status = models.CharField(max_length=20, choices=RIDE_STATUS_CHOICES)
+    # Indexed together with pickup_time below
     id_rider = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='rides_as_rider'
+        related_name='rides_as_rider',
+        db_index=False
     )
     id_driver = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='rides_as_driver'
+        related_name='rides_as_driver',
+        db_index=False
     )
     pickup_latitude = models.FloatField()
     pickup_longitude = models.FloatField()
@@ -55,31 +79,64 @@ class Ride(models.Model):
     pickup_time = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Pickup to dropoff, kept in sync on save; null until backfilled
+    trip_length_km = models.FloatField(null=True, blank=True, db_index=True)
+
+    objects = RideQuerySet.as_manager()
 
     class Meta:
         db_table = 'ride'
+        # One per list filter, ending in pickup_time for the default ordering
+        indexes = [
+            models.Index(fields=['pickup_time']),
+            models.Index(fields=['status', 'pickup_time']),
+            models.Index(fields=['id_rider', 'pickup_time']),
+            models.Index(fields=['id_driver', 'pickup_time']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['pickup_latitude', 'pickup_longitude']),
+            # Only soft-deleted rides: a full index would lure the planner away
+            # from the indexes above for every `deleted_at IS NULL` list query
+            models.Index(
+                fields=['deleted_at'],
+                name='ride_deleted_at_idx',
+                condition=models.Q(deleted_at__isnull=False)
+            ),
+        ]
+
+    COORDINATE_FIELDS = {
+        'pickup_latitude', 'pickup_longitude', 'dropoff_latitude', 'dropoff_longitude'
+    }
+
+    def save(self, *args, **kwargs):
+        from .sharding import allocate_ride_id, shard_for_write, sharding_enabled
+
+        self.trip_length_km = self.calculate_trip_length()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.COORDINATE_FIELDS.intersection(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'trip_length_km'}
+
+        if sharding_enabled():
+            if self._state.adding and self.pk is None:
+                # Shards cannot hand out ids on their own without colliding
+                self.pk = allocate_ride_id(self)
+                kwargs['force_insert'] = True
+            kwargs['using'] = shard_for_write(self, kwargs.get('using'))
+        super().save(*args, **kwargs)
 
     def calculate_distance_to_point(self, lat, lon):
         """
         Calculate the distance between ride pickup location and given coordinates
         using the Haversine formula.
         """
-        R = 6371  # Earth's radius in kilometers
-
-        lat1 = math.radians(self.pickup_latitude)
-        lon1 = math.radians(self.pickup_longitude)
-        lat2 = math.radians(float(lat))
-        lon2 = math.radians(float(lon))
-
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
+        return haversine_km(self.pickup_latitude, self.pickup_longitude, lat, lon)
 
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        distance = R * c
-
-        return distance
+    def calculate_trip_length(self):
+        """Distance in kilometers from pickup to dropoff."""
+        return haversine_km(
+            self.pickup_latitude, self.pickup_longitude,
+            self.dropoff_latitude, self.dropoff_longitude
+        )
 
 class RideEvent(models.Model):
     id_ride_event = models.AutoField(primary_key=True)
@@ -95,4 +152,259 @@ class RideEvent(models.Model):
         db_table = 'ride_event'
         indexes = [
             models.Index(fields=['created_at']),  # Add index for filtering by date
-        ]
\ No newline at end of file
+        ]
+
+    def save(self, *args, **kwargs):
+        from .sharding import shard_for_write, sharding_enabled
+
+        if sharding_enabled():
+            kwargs['using'] = shard_for_write(self, kwargs.get('using'))
+        super().save(*args, **kwargs)
+
+class RideEventArchive(models.Model):
+    """
+    Ride events moved out of ride_event by the retention job.
+    Keeps the original primary key so history can be merged with live events.
+    """
+    id_ride_event = models.IntegerField(primary_key=True)
+    id_ride = models.ForeignKey(
+        Ride,
+        on_delete=models.CASCADE,
+        related_name='archived_ride_events'
+    )
+    description = models.CharField(max_length=255)
+    created_at = models.DateTimeField()
+    archive_month = models.DateField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ride_event_archive'
+        indexes = [
+            models.Index(fields=['id_ride', 'created_at']),
+            models.Index(fields=['archive_month']),
+        ]
+
+
+class ArchiveCheckpoint(models.Model):
+    """Progress of a resumable archive run."""
+    name = models.CharField(max_length=100, unique=True)
+    cutoff = models.DateTimeField()
+    last_id = models.IntegerField(default=0)
+    archived_count = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'archive_checkpoint'
+
+
+class FleetCounter(models.Model):
+    """
+    Number of rides per status, maintained as rides are written.
+    Rows with no driver hold the fleet-wide totals.
+    """
+    status = models.CharField(max_length=20, choices=Ride.RIDE_STATUS_CHOICES)
+    id_driver = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='fleet_counters'
+    )
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'fleet_counter'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['status', 'id_driver'],
+                name='fleet_counter_status_driver_uniq'
+            ),
+            models.UniqueConstraint(
+                fields=['status'],
+                condition=models.Q(id_driver__isnull=True),
+                name='fleet_counter_status_total_uniq'
+            ),
+        ]
+
+
+class HeatmapTile(models.Model):
+    """
+    Number of pickups per slippy-map tile and hour, at each zoom level of
+    HEATMAP_ZOOM_LEVELS, maintained as rides are written (see rides.heatmap).
+    """
+    zoom = models.PositiveSmallIntegerField()
+    bucket = models.DateTimeField()
+    x = models.IntegerField()
+    y = models.IntegerField()
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'heatmap_tile'
+        constraints = [
+            # Also the index of heatmap reads: one zoom over a range of hours
+            models.UniqueConstraint(
+                fields=['zoom', 'bucket', 'x', 'y'],
+                name='heatmap_tile_zoom_bucket_xy_uniq'
+            ),
+        ]
+
+
+class RideChange(models.Model):
+    """
+    Append-only change log behind the delta sync feed.
+    `seq` is the monotonic cursor clients resume from; deletions are kept
+    as tombstones.
+    """
+    KIND_RIDE = 'ride'
+    KIND_EVENT = 'event'
+    KIND_DELETE = 'delete'
+    KIND_CHOICES = [
+        (KIND_RIDE, 'Ride created or updated'),
+        (KIND_EVENT, 'Ride event created'),
+        (KIND_DELETE, 'Ride deleted'),
+    ]
+
+    seq = models.BigAutoField(primary_key=True)
+    id_ride = models.IntegerField(db_index=True)
+    id_ride_event = models.IntegerField(null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'ride_change'
+
+
+class RidePurge(models.Model):
+    """Background removal of a soft-deleted ride and its events."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id_ride = models.IntegerField(unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    events_deleted = models.BigIntegerField(default=0)
+    batches = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    requested_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ride_purge'
+        indexes = [
+            models.Index(fields=['status', 'requested_at']),
+        ]
+
+
+class LoadCheckpoint(models.Model):
+    """Progress of a resumable historical data load, one per input file."""
+    name = models.CharField(max_length=255, unique=True)
+    rows_read = models.BigIntegerField(default=0)
+    loaded_count = models.BigIntegerField(default=0)
+    skipped_count = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'load_checkpoint'
+
+
+class LoadIdMap(models.Model):
+    """
+    Source system id to local primary key, for users and rides loaded from
+    history files. Lets later files, and resumed loads, resolve foreign keys.
+    """
+    entity = models.CharField(max_length=20)
+    source_id = models.CharField(max_length=64)
+    target_id = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'load_id_map'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['entity', 'source_id'],
+                name='load_id_map_entity_source_uniq'
+            ),
+        ]
+
+
+class RideDirectory(models.Model):
+    """
+    Region of every ride when rides are sharded (RIDE_SHARDS).
+    Lives on the default database and hands out ride ids, so ids are unique
+    across shards and any id can be routed to its shard.
+    """
+    id_ride = models.AutoField(primary_key=True)
+    region = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ride_directory'
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client's Idempotency-Key for a ride write, and the response it got.
+    `status_code` is null while the first request is still running.
+    """
+    id_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # sha256 of method, path and body: a key only replays the request it was sent with
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_key'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['id_user', 'key'],
+                name='idempotency_key_user_key_uniq'
+            ),
+        ]
+
+
+class Task(models.Model):
+    """Deferred work for the `run_tasks` worker (see rides.tasks)."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    task_type = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField()
+    run_at = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'task'
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['task_type', 'status']),
+        ]
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.paginator import Paginator
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+
+logger = logging.getLogger(__name__)
+
+COUNT_GENERATION_KEY = 'rides:count:generation'
+
+
+def get_count_generation():
+    """Current generation of cached counts. Bumped on every relevant write."""
+    return cache.get_or_set(COUNT_GENERATION_KEY, 0, None)
+
+
+def bump_count_generation():
+    """
+    Invalidate every cached count at once by moving to a new generation.
+    Old entries are never read again and simply expire.
+    """
+    try:
+        cache.incr(COUNT_GENERATION_KEY)
+    except ValueError:
+        cache.set(COUNT_GENERATION_KEY, 1, None)
+
+
+def cache_is_shared():
+    """
+    Whether every worker sees the same cache. Per-process caches miss the
+    invalidations made by other workers' writes.
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def _plain_count(object_list):
+    count = getattr(object_list, 'count', None)
+    if callable(count) and hasattr(object_list, 'query'):
+        return count()
+    return len(object_list)
+
+
+class ExactCount:
+    """Always runs SELECT COUNT(*) against the filtered queryset."""
+
+    def count(self, queryset):
+        return _plain_count(queryset), True
+
+
+class CachedCount(ExactCount):
+    """
+    Exact count cached per filter set.
+    The cache key is derived from the count SQL, so each distinct combination
+    of filters gets its own entry. Writes invalidate all entries at once, but
+    only in caches every worker shares: counts read back from a per-process
+    cache may miss other workers' writes and are reported as not exact.
+    """
+
+    def __init__(self, timeout=None):
+        if timeout is None:
+            timeout = getattr(settings, 'RIDE_COUNT_CACHE_TIMEOUT', 60)
+        self.timeout = timeout
+
+    def cache_key(self, queryset):
+        if not hasattr(queryset, 'query'):
+            return None
+        # Ordering never changes the number of rows
+        query = queryset.order_by().query
+        try:
+            sql, params = query.sql_with_params()
+        except EmptyResultSet:
+            return None
+        digest = hashlib.sha256(
+            f'{queryset.db}:{sql}:{params!r}'.encode()
+        ).hexdigest()
+        return f'rides:count:{get_count_generation()}:{digest}'
+
+    def count(self, queryset):
+        key = self.cache_key(queryset)
+        if key is None:
+            return super().count(queryset)
+
+        value = cache.get(key)
+        if value is not None:
+            return value, cache_is_shared()
+        value = _plain_count(queryset)
+        cache.set(key, value, self.timeout)
+        return value, True
+
+
+class EstimatedCount(CachedCount):
+    """
+    Uses PostgreSQL planner statistics when the result set is large.
+    Below the threshold, or on other databases, falls back to a cached
+    exact count.
+    """
+
+    def __init__(self, timeout=None, threshold=None):
+        super().__init__(timeout)
+        if threshold is None:
+            threshold = getattr(settings, 'RIDE_COUNT_ESTIMATE_THRESHOLD', 100000)
+        self.threshold = threshold
+
+    def estimate(self, queryset):
+        if not hasattr(queryset, 'query'):
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        query = queryset.order_by().query
+        try:
+            sql, params = query.sql_with_params()
+        except EmptyResultSet:
+            return None
+
+        with connection.cursor() as cursor:
+            if not query.where:
+                # Unfiltered: the table statistics are as good as it gets
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+                # reltuples is -1 for tables that were never analyzed
+                if row and row[0] >= 0:
+                    return int(row[0])
+
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+
+    def count(self, queryset):
+        try:
+            estimate = self.estimate(queryset)
+        except Exception as e:
+            logger.warning(f"Count estimate failed, using exact count: {str(e)}")
+            estimate = None
+
+        if estimate is not None and estimate >= self.threshold:
+            return estimate, False
+        return super().count(queryset)
+
+
+COUNT_STRATEGIES = {
+    'exact': ExactCount,
+    'cached': CachedCount,
+    'estimated': EstimatedCount,
+}
+
+
+def get_count_strategy(name=None):
+    """
+    Build the count strategy named by `name` or the RIDE_COUNT_STRATEGY setting.
+    """
+    name = name or getattr(settings, 'RIDE_COUNT_STRATEGY', 'exact')
+    try:
+        return COUNT_STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(
+            f'Unknown count strategy "{name}". '
+            f'Must be one of: {", ".join(COUNT_STRATEGIES)}'
+        )
+
+
+class StrategyPaginator(Paginator):
+    """
+    Django paginator whose `count` is delegated to a count strategy.
+    `count_is_exact` tells whether the last count came from planner estimates.
+    Sharded ride lists are counted shard by shard with the same strategy.
+    """
+
+    def __init__(self, object_list, per_page, orphans=0,
+                 allow_empty_first_page=True, count_strategy=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.count_strategy = count_strategy or get_count_strategy()
+        self.count_is_exact = True
+
+    @cached_property
+    def count(self):
+        shard_querysets = getattr(self.object_list, 'shard_querysets', None)
+        if shard_querysets is None:
+            count, self.count_is_exact = self.count_strategy.count(self.object_list)
+            return count
+        counts = [self.count_strategy.count(queryset) for queryset in shard_querysets()]
+        self.count_is_exact = all(exact for _, exact in counts)
+        return sum(count for count, _ in counts)
+
+
+class CustomPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    django_paginator_class = StrategyPaginator
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_exact': self.page.paginator.count_is_exact,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count_is_exact'] = {
+            'type': 'boolean',
+            'example': True,
+        }
+        return response_schema
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashingOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many concurrent logins, please retry shortly.'
+    default_code = 'password_hashing_overloaded'
+
+
+class PasswordHasherPool:
+    """
+    Bounded pool for password hashing and verification.
+
+    PBKDF2 (hashlib) and argon2 release the GIL, so threads are enough to run
+    hashes in parallel. The pool caps how many hashes run at once, so a login
+    burst cannot take every core away from other requests, and rejects work
+    once `max_pending` calls are queued or running.
+    """
+
+    def __init__(self, workers, max_pending, name='password-hasher', overloaded_detail=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.overloaded_detail = overloaded_detail
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix=name
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PasswordHashingOverloaded(self.overloaded_detail)
+            self._pending += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_hashing_mode():
+    return getattr(settings, 'PASSWORD_HASHING_MODE', 'inline')
+
+
+def _shared_pool(name, workers, max_pending, overloaded_detail=None):
+    """Process-wide pool per name, rebuilt if its settings change."""
+    with _pool_lock:
+        pool = _pools.get(name)
+        if pool is None or (pool.workers, pool.max_pending) != (workers, max_pending):
+            if pool is not None:
+                pool.executor.shutdown(wait=False)
+            pool = _pools[name] = PasswordHasherPool(workers, max_pending, name, overloaded_detail)
+        return pool
+
+
+def get_pool():
+    """Pool for login password checks."""
+    workers = getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or max(1, (os.cpu_count() or 2) // 2)
+    max_pending = getattr(settings, 'PASSWORD_HASHING_MAX_PENDING', 64)
+    return _shared_pool('password-hasher', workers, max_pending)
+
+
+def get_provisioning_pool():
+    """
+    Pool for passwords of bulk provisioning requests. It is separate from
+    the login pool, so logins never queue behind a provisioning request.
+    """
+    workers = getattr(settings, 'USER_PROVISIONING_THREADS', None) or max(1, (os.cpu_count() or 4) // 4)
+    max_pending = getattr(settings, 'USER_PROVISIONING_MAX_PENDING', 400)
+    return _shared_pool(
+        'user-provisioning', workers, max_pending,
+        'Too many users being provisioned, please retry shortly.'
+    )
+
+
+def _needs_upgrade(encoded):
+    """Same test Django applies before re-hashing on login."""
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != get_hasher().algorithm or hasher.must_update(encoded)
+
+
+def verify_password(user, raw_password):
+    """
+    Checks `raw_password` against `user`, like `user.check_password`.
+    In 'pool' mode the hash runs on the bounded pool; the caller waits for it,
+    but concurrent hashing is capped and excess logins are shed with a 503.
+    """
+    if get_hashing_mode() != 'pool':
+        return user.check_password(raw_password)
+
+    pool = get_pool()
+    valid = pool.submit(check_password, raw_password, user.password).result()
+    if valid and _needs_upgrade(user.password):
+        user.password = pool.submit(make_password, raw_password).result()
+        user.save(update_fields=['password'])
+    return valid
+
+
+async def averify_password(user, raw_password):
+    """
+    Async variant for the ASGI path: the event loop awaits the pool instead
+    of blocking, so other requests keep being served during the hash.
+    Always uses the pool, whatever PASSWORD_HASHING_MODE says.
+    """
+    pool = get_pool()
+    valid = await asyncio.wrap_future(pool.submit(check_password, raw_password, user.password))
+    if valid and _needs_upgrade(user.password):
+        user.password = await asyncio.wrap_future(pool.submit(make_password, raw_password))
+        await user.asave(update_fields=['password'])
+    return valid
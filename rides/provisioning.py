@@ -0,0 +1,195 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .models import User
+from .passwords import PasswordHashingOverloaded, get_provisioning_pool
+from .serializers import BulkUserSerializer
+from .sharding import replicate_users
+from .usercache import invalidate_users
+
+
+logger = logging.getLogger(__name__)
+
+USER_FIELDS = ('username', 'first_name', 'last_name', 'email', 'phone_number', 'role')
+
+
+def _init_worker(settings_module):
+    # Needed where workers are spawned rather than forked
+    if settings_module:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def get_worker_count(workers=None):
+    if workers is None:
+        workers = getattr(settings, 'USER_PROVISIONING_WORKERS', None)
+    return workers or os.cpu_count() or 1
+
+
+def _hash_passwords(passwords):
+    return [make_password(password) for password in passwords]
+
+
+@contextmanager
+def password_hasher(workers=None, processes=True):
+    """
+    Yields a function that hashes a list of raw passwords.
+    With more than one worker, PBKDF2 runs in a process pool that lives for
+    the whole import, so each chunk does not pay the pool start-up cost.
+
+    Without `processes` (inside web requests, where forking the worker is
+    unsafe), passwords are hashed one per call on the bounded provisioning
+    thread pool instead: PBKDF2 releases the GIL, so threads run in
+    parallel, and concurrent requests interleave rather than queue behind
+    each other's whole batch.
+    """
+    if not processes:
+        pool = get_provisioning_pool()
+
+        def hash_on_pool(passwords):
+            futures = []
+            try:
+                for password in passwords:
+                    futures.append(pool.submit(make_password, password))
+            except PasswordHashingOverloaded:
+                for future in futures:
+                    future.cancel()
+                raise
+            return [future.result() for future in futures]
+        yield hash_on_pool
+        return
+
+    workers = get_worker_count(workers)
+    if workers <= 1:
+        yield _hash_passwords
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE'),)
+    ) as pool:
+        def hash_many(passwords):
+            chunksize = max(1, len(passwords) // (workers * 4))
+            return list(pool.map(make_password, passwords, chunksize=chunksize))
+        yield hash_many
+
+
+def _chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield start, rows[start:start + size]
+
+
+def _validate(chunk, offset, rejected):
+    valid = []
+    for index, row in enumerate(chunk, start=offset):
+        serializer = BulkUserSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            rejected.append({'index': index, 'errors': serializer.errors})
+    return valid
+
+
+def _reject_duplicates(rows, seen_emails, seen_usernames, rejected):
+    """
+    Drops rows whose email or username already exists, in the database or
+    earlier in the import. The database check is a single query per chunk.
+    """
+    if not rows:
+        return []
+    emails = [row['email'] for _, row in rows]
+    usernames = [row['username'] for _, row in rows]
+    existing = User.objects.filter(
+        Q(email__in=emails) | Q(username__in=usernames)
+    ).values_list('email', 'username')
+    taken_emails = seen_emails | {email for email, _ in existing}
+    taken_usernames = seen_usernames | {username for _, username in existing}
+
+    accepted = []
+    for index, row in rows:
+        errors = {}
+        if row['email'] in taken_emails:
+            errors['email'] = ['user with this email already exists.']
+        if row['username'] in taken_usernames:
+            errors['username'] = ['A user with that username already exists.']
+        if errors:
+            rejected.append({'index': index, 'errors': errors})
+            continue
+        taken_emails.add(row['email'])
+        taken_usernames.add(row['username'])
+        accepted.append((index, row))
+
+    seen_emails.update(row['email'] for _, row in accepted)
+    seen_usernames.update(row['username'] for _, row in accepted)
+    return accepted
+
+
+def provision_users(rows, chunk_size=None, workers=None, processes=True):
+    """
+    Creates users from a list of dicts with the UserSerializer fields and a
+    raw `password`.
+
+    Rows are validated like /api/register/ except for uniqueness, which is
+    checked with one query per chunk. Passwords are hashed in parallel (see
+    password_hasher) and each chunk is inserted with a single bulk_create.
+    Returns a summary with the number created, the rejected rows (by index)
+    and the throughput in users per second.
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'USER_PROVISIONING_CHUNK_SIZE', 1000)
+    # A pool only pays off with at least a couple of passwords per worker
+    workers = max(1, min(get_worker_count(workers), len(rows) // 2))
+    rejected = []
+    seen_emails, seen_usernames = set(), set()
+    created = 0
+    start = time.perf_counter()
+
+    with password_hasher(workers, processes) as hash_many:
+        for offset, chunk in _chunks(rows, chunk_size):
+            accepted = _reject_duplicates(
+                _validate(chunk, offset, rejected),
+                seen_emails, seen_usernames, rejected
+            )
+            if not accepted:
+                continue
+
+            hashes = hash_many([row.get('password') for _, row in accepted])
+            users = [
+                User(password=encoded, **{field: row[field] for field in USER_FIELDS if field in row})
+                for (_, row), encoded in zip(accepted, hashes)
+            ]
+
+            try:
+                with transaction.atomic():
+                    User.objects.bulk_create(users, batch_size=chunk_size)
+            except IntegrityError as e:
+                # Lost a race with a concurrent signup; report the whole chunk
+                logger.warning(f"Bulk user insert failed at row {offset}: {str(e)}")
+                rejected.extend(
+                    {'index': index, 'errors': {'non_field_errors': [str(e)]}}
+                    for index, _ in accepted
+                )
+                continue
+            # bulk_create skips post_save, which copies users to the ride shards
+            # and drops cached lookups of their ids
+            replicate_users(users)
+            invalidate_users([user.pk for user in users])
+            created += len(users)
+
+    seconds = time.perf_counter() - start
+    return {
+        'created': created,
+        'rejected': sorted(rejected, key=lambda r: r['index']),
+        'seconds': round(seconds, 3),
+        'users_per_second': round(created / seconds, 1) if seconds else None,
+    }
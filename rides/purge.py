@@ -0,0 +1,115 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Ride, RideEvent, RideEventArchive, RidePurge
+from .sharding import alias_for_ride, sharding_enabled
+
+
+logger = logging.getLogger(__name__)
+
+
+def soft_delete_ride(ride):
+    """
+    Hides a ride immediately and queues its removal.
+    Call inside the transaction that deletes the ride. Returns the purge.
+    """
+    ride.deleted_at = timezone.now()
+    ride.save(update_fields=['deleted_at', 'updated_at'])
+    purge, _ = RidePurge.objects.get_or_create(id_ride=ride.pk)
+    return purge
+
+
+def _delete_batch(model, id_ride, batch_size, using=DEFAULT_DB_ALIAS):
+    ids = list(
+        model.objects.using(using).filter(id_ride=id_ride)
+        .order_by('pk')
+        .values_list('pk', flat=True)[:batch_size]
+    )
+    if ids:
+        model.objects.using(using).filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def purge_ride(purge, batch_size=None, sleep=None):
+    """
+    Deletes a soft-deleted ride's events in bounded batches, recording
+    progress after each one, then the ride itself. Each batch is its own
+    short transaction, so locks are never held for the whole history.
+    Returns None, without purging, when another process claimed it first.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'RIDE_PURGE_BATCH_SIZE', 1000)
+    if sleep is None:
+        sleep = getattr(settings, 'RIDE_PURGE_SLEEP', 0)
+
+    using = alias_for_ride(purge.id_ride) if sharding_enabled() else DEFAULT_DB_ALIAS
+    # Only one of the processes picking up waiting purges (purge_rides,
+    # run_tasks) may run a given one
+    claimed = RidePurge.objects.filter(
+        pk=purge.pk, status__in=[RidePurge.STATUS_PENDING, RidePurge.STATUS_FAILED]
+    ).update(
+        status=RidePurge.STATUS_RUNNING,
+        started_at=purge.started_at or timezone.now(),
+        updated_at=timezone.now()
+    )
+    if not claimed:
+        return None
+    try:
+        for model in (RideEvent, RideEventArchive):
+            while True:
+                with transaction.atomic(), transaction.atomic(using=using):
+                    deleted = _delete_batch(model, purge.id_ride, batch_size, using)
+                    if not deleted:
+                        break
+                    RidePurge.objects.filter(pk=purge.pk).update(
+                        events_deleted=F('events_deleted') + deleted,
+                        batches=F('batches') + 1,
+                        updated_at=timezone.now()
+                    )
+                if sleep:
+                    time.sleep(sleep)
+
+        with transaction.atomic(), transaction.atomic(using=using):
+            # Only rides that are still soft-deleted; never a live ride
+            Ride.objects.using(using).filter(pk=purge.id_ride, deleted_at__isnull=False).delete()
+            RidePurge.objects.filter(pk=purge.pk).update(
+                status=RidePurge.STATUS_DONE,
+                finished_at=timezone.now(),
+                updated_at=timezone.now()
+            )
+    except Exception as e:
+        logger.error(f"Error purging ride {purge.id_ride}: {str(e)}")
+        RidePurge.objects.filter(pk=purge.pk).update(
+            status=RidePurge.STATUS_FAILED,
+            last_error=str(e),
+            updated_at=timezone.now()
+        )
+        raise
+    finally:
+        purge.refresh_from_db()
+
+    return purge
+
+
+def run_pending_purges(limit=None, batch_size=None, sleep=None):
+    """Purges waiting rides, oldest request first. Returns the number purged."""
+    purges = RidePurge.objects.filter(
+        status__in=[RidePurge.STATUS_PENDING, RidePurge.STATUS_FAILED]
+    ).order_by('requested_at')
+    if limit:
+        purges = purges[:limit]
+
+    purged = 0
+    for purge in purges:
+        try:
+            if purge_ride(purge, batch_size=batch_size, sleep=sleep) is None:
+                continue
+        except Exception:
+            continue
+        purged += 1
+    return purged
@@ -0,0 +1,51 @@
+from .models import Ride, RideEvent, RideEventArchive, User
+from .sharding import alias_for_point, alias_for_ride, sharding_enabled
+
+
+SHARDED_MODELS = (Ride, RideEvent, RideEventArchive)
+
+
+class RideShardRouter:
+    """
+    Sends rides and their events to the shard of the ride's region when
+    RIDE_SHARDS is set; everything else stays on the default database.
+
+    Only writes and related-object access carry enough hints to be routed.
+    Querysets that are not tied to an instance must pick a shard with
+    `.using()` (see rides.sharding).
+    """
+
+    def _db_for_instance(self, model, instance):
+        if not sharding_enabled() or not issubclass(model, SHARDED_MODELS):
+            return None
+        if not isinstance(instance, SHARDED_MODELS):
+            # No instance, or a user: rides of a user span every shard
+            return None
+        if instance._state.db and not instance._state.adding:
+            return instance._state.db
+        # New instances may carry the default alias from assigning their
+        # rider or driver, so they are routed by their own data instead
+        if isinstance(instance, Ride):
+            if instance.pk is not None:
+                return alias_for_ride(instance.pk)
+            return alias_for_point(instance.pickup_latitude, instance.pickup_longitude)
+        if isinstance(instance, (RideEvent, RideEventArchive)):
+            ride = instance._state.fields_cache.get('id_ride')
+            if ride is not None and ride._state.db:
+                return ride._state.db
+            return alias_for_ride(instance.id_ride_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users are replicated to every shard, so rides may point at them
+        if sharding_enabled() and all(
+            isinstance(obj, SHARDED_MODELS + (User,)) for obj in (obj1, obj2)
+        ):
+            return True
+        return None
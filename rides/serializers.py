@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import User, Ride, RideEvent
+from .models import User, Ride, RideEvent, RidePurge
 
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
@@ -7,11 +7,28 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
+from django.contrib.auth.validators import UnicodeUsernameValidator
 import logging
+from .passwords import verify_password
+from .usercache import get_user_cache
 
 
 logger = logging.getLogger(__name__)
 
+def get_tokens_for_user(user):
+    refresh = RefreshToken.for_user(user)
+
+    # Add custom claims
+    refresh['email'] = user.email
+    refresh['role'] = user.role
+    refresh['user_id'] = user.id
+
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+    }
+
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     username_field = 'email'
 
@@ -27,21 +44,11 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         User = get_user_model()
         try:
             user = User.objects.get(email=credentials['email'])
-            if user.check_password(credentials['password']):
+            if verify_password(user, credentials['password']):
                 if not user.is_active:
                     raise AuthenticationFailed('User account is disabled.')
                 
-                refresh = RefreshToken.for_user(user)
-                
-                # Add custom claims
-                refresh['email'] = user.email
-                refresh['role'] = user.role
-                refresh['user_id'] = user.id
-                
-                return {
-                    'refresh': str(refresh),
-                    'access': str(refresh.access_token),
-                }
+                return get_tokens_for_user(user)
             else:
                 raise AuthenticationFailed('No active account found with the given credentials')
         except User.DoesNotExist:
@@ -67,16 +74,28 @@ class UserSerializer(serializers.ModelSerializer):
         # Remove the password from validated_data
         password = validated_data.pop('password')
         
-        # Create the user instance
-        user = User.objects.create(**validated_data)
-        
-        # Set the password
+        # Hash before the first save so registration is a single INSERT
+        user = User(**validated_data)
         user.set_password(password)
         user.save()
         
         return user
 
 
+class BulkUserSerializer(UserSerializer):
+    """
+    Row serializer for bulk provisioning.
+    Email and username uniqueness is checked once per chunk by
+    rides.provisioning instead of one query per row.
+    """
+
+    class Meta(UserSerializer.Meta):
+        extra_kwargs = {
+            'email': {'validators': []},
+            'username': {'validators': [UnicodeUsernameValidator()]},
+        }
+
+
 class RideEventSerializer(serializers.ModelSerializer):
     class Meta:
         model = RideEvent
@@ -85,13 +104,40 @@ class RideEventSerializer(serializers.ModelSerializer):
 
 
 
+class RideEventChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RideEvent
+        fields = ['id_ride_event', 'id_ride', 'description', 'created_at']
+        read_only_fields = fields
+
+
+class CachedUserRelatedField(serializers.PrimaryKeyRelatedField):
+    """User foreign key validated through the process-wide user cache."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('queryset', User.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        user = get_user_cache().get(pk)
+        if user is None:
+            self.fail('does_not_exist', pk_value=data)
+        return user
+
+
 class RideSerializer(serializers.ModelSerializer):
     rider = UserSerializer(source='id_rider', read_only=True)
     driver = UserSerializer(source='id_driver', read_only=True)
     todays_ride_events = serializers.SerializerMethodField()
     distance_to_pickup = serializers.SerializerMethodField()
-    id_rider = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
-    id_driver = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    id_rider = CachedUserRelatedField()
+    id_driver = CachedUserRelatedField()
 
     class Meta:
         model = Ride
@@ -101,9 +147,9 @@ class RideSerializer(serializers.ModelSerializer):
             'pickup_latitude', 'pickup_longitude',
             'dropoff_latitude', 'dropoff_longitude',
             'pickup_time', 'todays_ride_events',
-            'distance_to_pickup'
+            'distance_to_pickup', 'trip_length_km'
         ]
-        read_only_fields = ['id_ride', 'distance_to_pickup']
+        read_only_fields = ['id_ride', 'distance_to_pickup', 'trip_length_km']
 
     def get_todays_ride_events(self, obj):
         recent_events = getattr(obj, 'recent_events', None)
@@ -123,6 +169,7 @@ class RideSerializer(serializers.ModelSerializer):
         return None
 
     def validate(self, data):
+        get_user_cache().record_write()
         if 'status' in data and data['status'] not in dict(Ride.RIDE_STATUS_CHOICES):
             raise serializers.ValidationError({'status': 'Invalid ride status'})
         
@@ -136,3 +183,15 @@ class RideSerializer(serializers.ModelSerializer):
                     raise serializers.ValidationError({coord: 'Longitude must be between -180 and 180'})
         
         return data
+
+
+class RidePurgeSerializer(serializers.ModelSerializer):
+    status_url = serializers.HyperlinkedIdentityField(view_name='ride-purge-detail')
+
+    class Meta:
+        model = RidePurge
+        fields = [
+            'id', 'id_ride', 'status', 'events_deleted', 'batches', 'last_error',
+            'requested_at', 'started_at', 'finished_at', 'status_url'
+        ]
+        read_only_fields = fields
@@ -0,0 +1,282 @@
+import heapq
+import itertools
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models import F, OrderBy
+
+from .models import EARTH_RADIUS_KM, RideDirectory, User
+
+
+def get_shards():
+    """
+    RIDE_SHARDS: {region: {'database': alias, 'bbox': [min_lat, min_lon, max_lat, max_lon]}}.
+    Empty when rides are not sharded.
+    """
+    return getattr(settings, 'RIDE_SHARDS', None) or {}
+
+
+def sharding_enabled():
+    return bool(get_shards())
+
+
+def shard_aliases():
+    return [shard['database'] for shard in get_shards().values()]
+
+
+def _fallback_region():
+    """Region for pickups outside every bbox: the one without a bbox, else the first."""
+    shards = get_shards()
+    for region, shard in shards.items():
+        if not shard.get('bbox'):
+            return region
+    return next(iter(shards))
+
+
+def _in_bbox(bbox, lat, lon):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+
+def region_for_point(lat, lon):
+    for region, shard in get_shards().items():
+        if shard.get('bbox') and _in_bbox(shard['bbox'], lat, lon):
+            return region
+    return _fallback_region()
+
+
+def alias_for_point(lat, lon):
+    return get_shards()[region_for_point(lat, lon)]['database']
+
+
+def _directory_key(id_ride):
+    return f'rides:shard:{id_ride}'
+
+
+def allocate_ride_id(ride):
+    """
+    Ride ids come from the directory on the default database, so they stay
+    unique across shards and each id can be routed back to its shard.
+    """
+    region = region_for_point(ride.pickup_latitude, ride.pickup_longitude)
+    entry = RideDirectory.objects.create(region=region)
+    # A rolled back id can be handed out again (SQLite), maybe in another region
+    transaction.on_commit(lambda: cache.set(_directory_key(entry.pk), region, None))
+    return entry.pk
+
+
+def shard_for_write(instance, using=None):
+    """
+    Database a ride or event is saved to. Managers pass the default alias
+    explicitly (`objects.create()` cannot know the ride's region), so the
+    default alias is overridden with the instance's shard.
+    """
+    if using and using != DEFAULT_DB_ALIAS:
+        return using
+    return router.db_for_write(type(instance), instance=instance)
+
+
+def alias_for_ride(id_ride):
+    """Database alias holding a ride, or None for an unknown id."""
+    try:
+        id_ride = int(id_ride)
+    except (TypeError, ValueError):
+        return None
+    key = _directory_key(id_ride)
+    region = cache.get(key)
+    if region is None:
+        region = (
+            RideDirectory.objects.filter(pk=id_ride)
+            .values_list('region', flat=True).first()
+        )
+        if region is None:
+            return None
+        # Rides never move, so entries never go stale
+        cache.set(key, region, None)
+    shard = get_shards().get(region)
+    return shard['database'] if shard else None
+
+
+def group_by_alias(ride_ids):
+    """{alias: [ride ids]} for rides that are in the directory."""
+    groups = {}
+    for id_ride in ride_ids:
+        alias = alias_for_ride(id_ride)
+        if alias is not None:
+            groups.setdefault(alias, []).append(id_ride)
+    return groups
+
+
+def each_shard(queryset):
+    """The queryset on every shard, or just the queryset itself when unsharded."""
+    if not sharding_enabled():
+        return [queryset]
+    return [queryset.using(alias) for alias in shard_aliases()]
+
+
+def replicate_users(users):
+    """
+    Copies users to every shard, so rides there can join and refer to
+    their rider and driver. Users stay owned by the default database.
+    """
+    users = list(users)
+    if not users or not sharding_enabled():
+        return
+    fields = [field for field in User._meta.concrete_fields if not field.primary_key]
+    for alias in shard_aliases():
+        # Fresh instances: bulk_create would move the originals to the shard
+        copies = [
+            User(**{field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields})
+            for user in users
+        ]
+        User.objects.using(alias).bulk_create(
+            copies,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=[field.name for field in fields],
+        )
+
+
+def delete_replicated_users(user_ids):
+    for alias in shard_aliases():
+        User.objects.using(alias).filter(pk__in=user_ids).delete()
+
+
+def min_distance_km(bbox, lat, lon):
+    """
+    Lower bound of the great-circle distance from a point to anything in
+    `bbox`, from the haversine terms for the latitude and longitude gaps.
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    dlat = max(0.0, min_lat - lat, lat - max_lat)
+    if min_lon <= lon <= max_lon:
+        dlon = 0.0
+    else:
+        dlon = min(
+            (min_lon - lon) % 360, (lon - max_lon) % 360,
+        )
+        dlon = min(dlon, 360 - dlon)
+    # The farthest latitude from the equator minimises cos(lat) in the box
+    cos_box = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    h = (
+        math.sin(math.radians(dlat) / 2) ** 2
+        + math.cos(math.radians(lat)) * cos_box * math.sin(math.radians(dlon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, h)))
+
+
+class _Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _ordering_fields(queryset):
+    fields = []
+    for item in queryset.query.order_by:
+        if isinstance(item, str):
+            fields.append((item.lstrip('-'), item.startswith('-')))
+        elif isinstance(item, OrderBy) and isinstance(item.expression, F):
+            fields.append((item.expression.name, item.descending))
+        else:
+            raise ValueError(f"Cannot merge shards ordered by {item!r}")
+    return fields
+
+
+def _sort_key(queryset):
+    fields = _ordering_fields(queryset)
+
+    def key(obj):
+        values = []
+        for name, descending in fields:
+            value = getattr(obj, name)
+            # Nulls sort last, as on PostgreSQL
+            value = (value is None, value)
+            values.append(_Descending(value) if descending else value)
+        return tuple(values)
+    return key
+
+
+class ShardedQuerySet:
+    """
+    A ride queryset evaluated on every shard and merged in its ordering.
+
+    Supports what the list view and the paginator need: count(), slicing
+    and iteration. A slice fetches at most `stop` rows from each shard.
+    With `point` (distance ordering), shards are visited nearest first and
+    a shard is skipped once its bounding box is farther away than the last
+    row of the slice.
+    """
+
+    ordered = True
+
+    def __init__(self, queryset, point=None):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.point = point
+        self._key = _sort_key(queryset)
+        self._result_cache = None
+
+    def shard_querysets(self):
+        return each_shard(self.queryset)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.shard_querysets())
+
+    def __len__(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        return self.count()
+
+    def __iter__(self):
+        if self._result_cache is None:
+            self._result_cache = self._fetch(None)
+        return iter(self._result_cache)
+
+    def __getitem__(self, k):
+        if isinstance(k, int):
+            return self[k:k + 1][0]
+        if k.step is not None:
+            raise ValueError('Sharded querysets do not support slice steps')
+        start = k.start or 0
+        if self._result_cache is not None:
+            return self._result_cache[k]
+        return self._fetch(k.stop)[start:]
+
+    def _shards_nearest_first(self):
+        lat, lon = self.point
+        fallback = _fallback_region()
+        shards = []
+        for region, shard in get_shards().items():
+            bbox = shard.get('bbox')
+            # The fallback region also holds pickups outside every bbox
+            bound = 0.0 if region == fallback or not bbox else min_distance_km(bbox, lat, lon)
+            shards.append((bound, shard['database']))
+        return sorted(shards)
+
+    def _fetch(self, stop):
+        def rows(queryset):
+            return list(queryset[:stop]) if stop is not None else list(queryset)
+
+        if self.point is None or stop is None:
+            merged = heapq.merge(*map(rows, self.shard_querysets()), key=self._key)
+            return list(itertools.islice(merged, stop))
+
+        results = []
+        for bound, alias in self._shards_nearest_first():
+            if len(results) >= stop and bound > results[stop - 1].distance:
+                break
+            results = list(itertools.islice(
+                heapq.merge(results, rows(self.queryset.using(alias)), key=self._key),
+                stop
+            ))
+        return results
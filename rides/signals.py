@@ -0,0 +1,88 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Ride, RideChange, RideEvent, User
+from .conditional import bump_users_version
+from .counters import record_rides_deleted
+from .heatmap import record_pickups_deleted
+from .pagination import bump_count_generation
+from .sharding import delete_replicated_users, replicate_users, sharding_enabled
+from .usercache import invalidate_users
+
+
+@receiver(post_save, sender=Ride)
+@receiver(post_delete, sender=Ride)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_counts(sender, **kwargs):
+    """Ride list counts depend on rides and on rider emails."""
+    bump_count_generation()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_ride_list_etags(sender, **kwargs):
+    """Ride payloads embed rider and driver details."""
+    bump_users_version()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Ride writes validate riders and drivers against the user cache."""
+    invalidate_users([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def replicate_user(sender, instance, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Ride shards keep a copy of every user for their foreign keys."""
+    if not raw and using == DEFAULT_DB_ALIAS:
+        replicate_users([instance])
+
+
+@receiver(post_delete, sender=User)
+def delete_replicated_user(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    if using == DEFAULT_DB_ALIAS and sharding_enabled():
+        delete_replicated_users([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def remove_cascaded_rides(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Deleting a user cascades to their rides without going through the
+    views, so their active rides are taken out of the fleet counters and
+    heatmap tiles here.
+    Shard copies of the user cascade too; the rides were counted once.
+    """
+    if using != DEFAULT_DB_ALIAS:
+        return
+    rides = Ride.objects.active().filter(Q(id_rider=instance.pk) | Q(id_driver=instance.pk))
+    record_rides_deleted(rides)
+    record_pickups_deleted(rides)
+
+
+@receiver(post_save, sender=Ride)
+def log_ride_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # A soft delete is a deletion as far as syncing clients are concerned
+    kind = RideChange.KIND_DELETE if instance.deleted_at else RideChange.KIND_RIDE
+    RideChange.objects.create(id_ride=instance.pk, kind=kind)
+
+
+@receiver(post_delete, sender=Ride)
+def log_ride_deleted(sender, instance, **kwargs):
+    if instance.deleted_at is None:
+        RideChange.objects.create(id_ride=instance.pk, kind=RideChange.KIND_DELETE)
+
+
+@receiver(post_save, sender=RideEvent)
+def log_ride_event_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        RideChange.objects.create(
+            id_ride=instance.id_ride_id,
+            id_ride_event=instance.pk,
+            kind=RideChange.KIND_EVENT
+        )
@@ -0,0 +1,107 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Ride, RideChange, RideEvent
+from .sharding import group_by_alias, sharding_enabled
+
+
+def cursor_for_timestamp(updated_since):
+    """
+    Cursor just before the first change recorded at or after `updated_since`,
+    so clients without a cursor can bootstrap from a timestamp.
+    """
+    first = (
+        RideChange.objects
+        .filter(created_at__gte=updated_since)
+        .order_by('seq')
+        .values_list('seq', flat=True)
+        .first()
+    )
+    if first is not None:
+        return first - 1
+    return RideChange.objects.aggregate(latest=Max('seq'))['latest'] or 0
+
+
+def get_changes(cursor, limit=None):
+    """
+    Changes after `cursor`, collapsed per ride.
+
+    Returns the rides to upsert (current state), the events created, the ids
+    of deleted rides, the next cursor and whether more changes are pending.
+    Changes younger than DELTA_SYNC_SETTLE_SECONDS are held back so that a
+    transaction that took a lower seq but commits later is not skipped.
+    """
+    if limit is None:
+        limit = getattr(settings, 'DELTA_SYNC_PAGE_SIZE', 500)
+    settle = getattr(settings, 'DELTA_SYNC_SETTLE_SECONDS', 2)
+    settled_before = timezone.now() - timedelta(seconds=settle)
+
+    changes = list(
+        RideChange.objects
+        .filter(seq__gt=cursor, created_at__lte=settled_before)
+        .order_by('seq')
+        .values_list('seq', 'id_ride', 'id_ride_event', 'kind')[:limit + 1]
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    latest_kind = {}
+    event_ids = []
+    for _, id_ride, id_ride_event, kind in changes:
+        if kind == RideChange.KIND_EVENT:
+            event_ids.append((id_ride, id_ride_event))
+            latest_kind.setdefault(id_ride, RideChange.KIND_RIDE)
+        else:
+            latest_kind[id_ride] = kind
+
+    deleted = sorted(
+        id_ride for id_ride, kind in latest_kind.items() if kind == RideChange.KIND_DELETE
+    )
+    upserted = [
+        id_ride for id_ride, kind in latest_kind.items() if kind != RideChange.KIND_DELETE
+    ]
+    rides = (
+        Ride.objects
+        .active()
+        .select_related('id_rider', 'id_driver')
+        .order_by('pk')
+    )
+    events = RideEvent.objects.exclude(id_ride__in=deleted).order_by('pk')
+    if sharding_enabled():
+        rides, events = _fetch_from_shards(rides, upserted, events, event_ids)
+    else:
+        rides = rides.filter(pk__in=upserted)
+        events = events.filter(pk__in=[id_ride_event for _, id_ride_event in event_ids])
+
+    return {
+        'cursor': changes[-1][0] if changes else cursor,
+        'has_more': has_more,
+        'rides': rides,
+        'events': events,
+        'deleted': deleted,
+    }
+
+
+def _fetch_from_shards(rides, ride_ids, events, event_ids):
+    """
+    Reads rides and events from the shard of each ride. Event ids are only
+    unique within a shard, so events are looked up on their ride's shard.
+    """
+    events_by_ride = {}
+    for id_ride, id_ride_event in event_ids:
+        events_by_ride.setdefault(id_ride, []).append(id_ride_event)
+
+    found_rides, found_events = [], []
+    for alias, ids in group_by_alias(ride_ids).items():
+        found_rides.extend(rides.using(alias).filter(pk__in=ids))
+    for alias, ids in group_by_alias(events_by_ride).items():
+        found_events.extend(events.using(alias).filter(
+            id_ride__in=ids,
+            pk__in=[id_ride_event for id_ride in ids for id_ride_event in events_by_ride[id_ride]]
+        ))
+    found_rides.sort(key=lambda ride: ride.pk)
+    found_events.sort(key=lambda event: (event.id_ride_id, event.pk))
+    return found_rides, found_events
@@ -0,0 +1,314 @@
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+from django.db.models import Count, F, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import LessThan
+from django.utils import timezone
+
+from .archive import archive_ride_events
+from .counters import rebuild_fleet_counters
+from .heatmap import rebuild_heatmap
+from .models import RidePurge, Task
+from .purge import purge_ride
+from .sharding import shard_aliases, sharding_enabled
+from .trips import backfill_trip_lengths
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskType:
+    def __init__(self, name, func, concurrency=None, max_attempts=None):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+
+TASK_TYPES = {}
+
+
+def task(name, concurrency=None, max_attempts=None):
+    """
+    Registers a function as a task type. The payload given to `enqueue` is
+    passed as keyword arguments. `concurrency` caps how many tasks of the
+    type run at once across all workers (TASK_CONCURRENCY overrides it).
+    """
+    def register(func):
+        TASK_TYPES[name] = TaskType(name, func, concurrency, max_attempts)
+        return func
+    return register
+
+
+def get_concurrency(name):
+    overrides = getattr(settings, 'TASK_CONCURRENCY', None) or {}
+    if name in overrides:
+        return overrides[name]
+    task_type = TASK_TYPES.get(name)
+    return task_type.concurrency if task_type else None
+
+
+def enqueue(name, payload=None, delay=0):
+    """
+    Queues a task. Called inside a transaction, the task is only visible to
+    workers once it commits, and is dropped if it rolls back.
+    """
+    task_type = TASK_TYPES.get(name)
+    if task_type is None:
+        raise ValueError(f'Unknown task type "{name}"')
+    return Task.objects.create(
+        task_type=name,
+        payload=payload or {},
+        max_attempts=task_type.max_attempts or getattr(settings, 'TASK_MAX_ATTEMPTS', 5),
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def release_stale_tasks():
+    """
+    Tasks whose worker stopped answering (no heartbeat for TASK_LOCK_TIMEOUT
+    seconds) are queued again, or failed once out of attempts.
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'TASK_LOCK_TIMEOUT', 300))
+    stale = Task.objects.filter(status=Task.STATUS_RUNNING, locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.STATUS_FAILED, last_error='Worker lost', finished_at=timezone.now(),
+        locked_by='', locked_at=None
+    )
+    requeued = stale.update(status=Task.STATUS_PENDING, locked_by='', locked_at=None)
+    return failed + requeued
+
+
+def _running_count(task_type):
+    return Coalesce(Subquery(
+        Task.objects.filter(task_type=task_type, status=Task.STATUS_RUNNING)
+        .order_by().values('task_type').annotate(running=Count('pk')).values('running')
+    ), 0)
+
+
+def _claim_update(tasks, worker_id):
+    now = timezone.now()
+    return tasks.update(
+        status=Task.STATUS_RUNNING,
+        locked_by=worker_id,
+        locked_at=now,
+        attempts=F('attempts') + 1,
+    )
+
+
+def _claim_skip_locked(worker_id, batch_size):
+    """
+    Locks due tasks with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+    workers claim disjoint batches without waiting on each other. Types
+    with a concurrency limit are counted under an advisory lock per type.
+    """
+    with transaction.atomic():
+        candidates = list(
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(status=Task.STATUS_PENDING, run_at__lte=timezone.now())
+            .order_by('run_at')
+            .values_list('pk', 'task_type')[:batch_size]
+        )
+        free = {}
+        for task_type in sorted({task_type for _, task_type in candidates}):
+            limit = get_concurrency(task_type)
+            if limit is None:
+                continue
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_xact_lock(%s)', [zlib.crc32(task_type.encode())])
+            running = Task.objects.filter(task_type=task_type, status=Task.STATUS_RUNNING).count()
+            free[task_type] = limit - running
+
+        claimed = []
+        for pk, task_type in candidates:
+            if task_type in free:
+                if free[task_type] <= 0:
+                    continue
+                free[task_type] -= 1
+            claimed.append(pk)
+        _claim_update(Task.objects.filter(pk__in=claimed), worker_id)
+    return claimed
+
+
+def _claim_polling(worker_id, batch_size):
+    """
+    For databases without SKIP LOCKED (SQLite): each candidate is claimed
+    with a single conditional UPDATE, which also checks the type's
+    concurrency limit. Writes are serialized, so a task and a slot go to
+    exactly one worker; losers move on to the next candidate.
+    """
+    candidates = list(
+        Task.objects.filter(status=Task.STATUS_PENDING, run_at__lte=timezone.now())
+        .order_by('run_at')
+        .values_list('pk', 'task_type')[:batch_size * 4]
+    )
+    claimed = []
+    for pk, task_type in candidates:
+        if len(claimed) >= batch_size:
+            break
+        tasks = Task.objects.filter(pk=pk, status=Task.STATUS_PENDING)
+        limit = get_concurrency(task_type)
+        if limit is not None:
+            tasks = tasks.filter(LessThan(_running_count(task_type), limit))
+        if _claim_update(tasks, worker_id):
+            claimed.append(pk)
+    return claimed
+
+
+def claim_tasks(worker_id, batch_size=None):
+    """Marks up to `batch_size` due tasks as running for `worker_id` and returns them."""
+    if batch_size is None:
+        batch_size = getattr(settings, 'TASK_BATCH_SIZE', 10)
+    if connection.features.has_select_for_update_skip_locked:
+        claimed = _claim_skip_locked(worker_id, batch_size)
+    else:
+        claimed = _claim_polling(worker_id, batch_size)
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_at'))
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refreshes `locked_at` of running tasks every third of TASK_LOCK_TIMEOUT,
+    so release_stale_tasks() only requeues tasks whose worker is gone, not
+    tasks that run long or wait behind long ones in their batch.
+    """
+
+    def __init__(self, tasks):
+        super().__init__(daemon=True)
+        self.tasks = tasks
+        self.interval = getattr(settings, 'TASK_LOCK_TIMEOUT', 300) / 3
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    self.tasks.update(locked_at=timezone.now())
+                except Exception as e:
+                    logger.error(f"Task heartbeat failed: {str(e)}")
+        finally:
+            # The thread's own connection
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _owned(task):
+    """The task's row while it is still running under this claim."""
+    return Task.objects.filter(
+        pk=task.pk, status=Task.STATUS_RUNNING,
+        locked_by=task.locked_by, attempts=task.attempts
+    )
+
+
+def run_task(task):
+    """
+    Runs a claimed task. Failures are retried with exponential backoff
+    (TASK_RETRY_DELAY seconds, doubled per attempt) until max_attempts.
+    A task released while it waited (and maybe claimed by another worker)
+    is skipped. Returns True on success.
+    """
+    mine = _owned(task)
+    if not mine.update(locked_at=timezone.now()):
+        logger.warning(f"Task {task.pk} ({task.task_type}) lost its lock before it ran")
+        return False
+    try:
+        task_type = TASK_TYPES.get(task.task_type)
+        if task_type is None:
+            raise LookupError(f'Unknown task type "{task.task_type}"')
+        task_type.func(**task.payload)
+    except Exception as e:
+        logger.error(f"Task {task.pk} ({task.task_type}) failed: {str(e)}")
+        if task.attempts >= task.max_attempts:
+            mine.update(
+                status=Task.STATUS_FAILED, last_error=str(e), finished_at=timezone.now(),
+                locked_by='', locked_at=None
+            )
+        else:
+            delay = getattr(settings, 'TASK_RETRY_DELAY', 10) * 2 ** (task.attempts - 1)
+            mine.update(
+                status=Task.STATUS_PENDING, last_error=str(e),
+                run_at=timezone.now() + timedelta(seconds=delay),
+                locked_by='', locked_at=None
+            )
+        return False
+
+    if not mine.update(status=Task.STATUS_DONE, finished_at=timezone.now(), locked_by='', locked_at=None):
+        logger.warning(f"Task {task.pk} ({task.task_type}) lost its lock while it ran")
+    return True
+
+
+def run_worker(worker_id=None, batch_size=None, interval=1.0, once=False, max_tasks=None):
+    """
+    Claims and runs tasks until stopped. With `once`, returns when no task
+    is due. Returns the number of tasks run.
+    """
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+    while max_tasks is None or processed < max_tasks:
+        release_stale_tasks()
+        limit = batch_size
+        if max_tasks is not None:
+            limit = min(batch_size or max_tasks, max_tasks - processed)
+        tasks = claim_tasks(worker_id, limit)
+        if tasks:
+            # Covers the whole batch: tasks waiting their turn are not stale
+            heartbeat = Heartbeat(Task.objects.filter(
+                pk__in=[claimed.pk for claimed in tasks],
+                status=Task.STATUS_RUNNING, locked_by=worker_id
+            ))
+            heartbeat.start()
+            try:
+                for claimed in tasks:
+                    run_task(claimed)
+                    processed += 1
+            finally:
+                heartbeat.stop()
+        if not tasks:
+            if once:
+                break
+            time.sleep(interval)
+    return processed
+
+
+@task('rides.purge_ride', concurrency=2)
+def purge_ride_task(purge_id):
+    purge = RidePurge.objects.filter(pk=purge_id).first()
+    if purge is not None and purge.status != RidePurge.STATUS_DONE:
+        purge_ride(purge)
+
+
+@task('rides.rebuild_fleet_counters', concurrency=1)
+def rebuild_fleet_counters_task():
+    rebuild_fleet_counters()
+
+
+@task('rides.rebuild_heatmap', concurrency=1)
+def rebuild_heatmap_task():
+    rebuild_heatmap()
+
+
+@task('rides.archive_ride_events', concurrency=1)
+def archive_ride_events_task(**options):
+    for alias in shard_aliases() if sharding_enabled() else [DEFAULT_DB_ALIAS]:
+        archive_ride_events(using=alias, **options)
+
+
+@task('rides.backfill_trip_lengths', concurrency=1)
+def backfill_trip_lengths_task(**options):
+    backfill_trip_lengths(**options)
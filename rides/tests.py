@@ -6,6 +6,93 @@ from django.utils import timezone
 from datetime import timedelta
 from .models import User, Ride, RideEvent
 from rest_framework_simplejwt.tokens import RefreshToken
+from django.core.cache import cache
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from unittest.mock import patch
+from .pagination import CachedCount, EstimatedCount, ExactCount, get_count_strategy
+from .models import RideEventArchive, RideChange
+from .archive import archive_ride_events
+from django.core.management import call_command
+from io import StringIO
+from django.conf import settings
+import os
+import subprocess
+import sys
+import csv
+import tempfile
+import time
+import json
+import re
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
+from .passwords import verify_password
+from .views import RideViewSet, async_token_obtain_pair
+from .counters import get_fleet_counters, rebuild_fleet_counters
+from .models import RidePurge
+from .purge import purge_ride, run_pending_purges
+from .models import LoadCheckpoint, LoadIdMap
+from .loader import load_history
+from django.test import TransactionTestCase
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import QueryDict
+from .filters import RideFilterSet
+from .models import IdempotencyKey
+from .usercache import UserCache, get_user_cache
+from .conditional import bump_users_version
+from .models import Task
+from .tasks import claim_tasks, enqueue, release_stale_tasks, run_task, run_worker, task
+from .models import HeatmapTile
+from .heatmap import get_heatmap, rebuild_heatmap, tile_for
+from django.db.models import Max
+from .trips import backfill_trip_lengths
+
+class RideFixturesMixin:
+    """Admin user and ride fixtures shared by the ride test cases"""
+
+    def create_admin_user(self):
+        return User.objects.create_user(
+            username='admin@test.com',
+            email='admin@test.com',
+            password='testpass123',
+            role='admin',
+            first_name='Admin',
+            last_name='User',
+            phone_number='1234567890'
+        )
+
+    def make_ride(self, **fields):
+        """Ride written through the ORM, by default picked up in San Francisco now"""
+        defaults = {
+            'status': 'pickup',
+            'id_rider': self.admin_user,
+            'id_driver': self.admin_user,
+            'pickup_latitude': 37.7749,
+            'pickup_longitude': -122.4194,
+            'dropoff_latitude': 37.7750,
+            'dropoff_longitude': -122.4195,
+            'pickup_time': timezone.now(),
+        }
+        return Ride.objects.create(**{**defaults, **fields})
+
+    def ride_payload(self, **fields):
+        """Request body creating the same ride as make_ride() through the API"""
+        payload = {
+            'status': 'pickup',
+            'id_rider': self.admin_user.id,
+            'id_driver': self.admin_user.id,
+            'pickup_latitude': 37.7749,
+            'pickup_longitude': -122.4194,
+            'dropoff_latitude': 37.7750,
+            'dropoff_longitude': -122.4195,
+            'pickup_time': timezone.now().isoformat(),
+        }
+        return {**payload, **fields}
+
+    def post_ride(self, **fields):
+        return self.client.post(reverse('ride-list'), self.ride_payload(**fields), format='json')
+
 
 class RideAPITests(APITestCase):
     def setUp(self):
@@ -209,4 +296,1567 @@ class RideAPITests(APITestCase):
             reverse('ride-detail', kwargs={'pk': self.ride.pk})
         )
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
-        self.assertFalse(Ride.objects.filter(pk=self.ride.pk).exists())
\ No newline at end of file
+        self.assertFalse(Ride.objects.filter(pk=self.ride.pk).exists())
+
+class RideCountStrategyTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin_user = self.create_admin_user()
+        self.ride = self.make_ride()
+        self.client.force_authenticate(self.admin_user)
+
+    @override_settings(RIDE_COUNT_STRATEGY='cached')
+    def test_count_is_cached_per_filter_set(self):
+        """Second request with the same filters reuses the cached count"""
+        url = f"{reverse('ride-list')}?status=pickup"
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], 1)
+        self.assertTrue(response.data['count_is_exact'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.data['count'], 1)
+        self.assertFalse(any('"__count"' in q['sql'] for q in queries.captured_queries))
+        # The test cache is per process: other workers' writes may be missing
+        self.assertFalse(response.data['count_is_exact'])
+
+    def test_cached_count_is_exact_only_from_shared_cache(self):
+        self.assertIsInstance(get_count_strategy(), ExactCount)
+        queryset = Ride.objects.filter(status='pickup')
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                strategy = CachedCount()
+                self.assertEqual(strategy.count(queryset), (1, True))
+                with self.assertNumQueries(0):
+                    self.assertEqual(strategy.count(queryset), (1, True))
+
+    @override_settings(RIDE_COUNT_STRATEGY='cached')
+    def test_cached_count_invalidated_on_write(self):
+        """Writes to rides invalidate cached counts"""
+        url = f"{reverse('ride-list')}?status=pickup"
+        self.assertEqual(self.client.get(url).data['count'], 1)
+
+        self.make_ride()
+        self.assertEqual(self.client.get(url).data['count'], 2)
+
+    @override_settings(RIDE_COUNT_STRATEGY='estimated')
+    def test_estimated_count_flags_inexact(self):
+        """Estimates above the threshold are reported as inexact"""
+        with patch.object(EstimatedCount, 'estimate', return_value=250000):
+            response = self.client.get(reverse('ride-list'))
+        self.assertEqual(response.data['count'], 250000)
+        self.assertFalse(response.data['count_is_exact'])
+
+    @override_settings(RIDE_COUNT_STRATEGY='estimated')
+    def test_estimated_count_falls_back_to_exact(self):
+        """Without planner statistics (SQLite) the exact count is used"""
+        response = self.client.get(reverse('ride-list'))
+        self.assertEqual(response.data['count'], 1)
+        self.assertTrue(response.data['count_is_exact'])
+
+
+class RideEventArchiveTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.ride = self.make_ride()
+        for i in range(3):
+            event = RideEvent.objects.create(id_ride=self.ride, description=f'Old event {i}')
+            # created_at is auto_now_add, so age the rows with an update
+            RideEvent.objects.filter(pk=event.pk).update(
+                created_at=timezone.now() - timedelta(days=200 + i)
+            )
+        self.recent_event = RideEvent.objects.create(id_ride=self.ride, description='Recent event')
+        self.client.force_authenticate(self.admin_user)
+
+    def test_archive_is_resumable(self):
+        """Batches stop at max_batches and the next run resumes with the same cutoff"""
+        checkpoint = archive_ride_events(older_than_days=90, batch_size=2, sleep=0, max_batches=1)
+        self.assertIsNone(checkpoint.completed_at)
+        self.assertEqual(checkpoint.archived_count, 2)
+        cutoff = checkpoint.cutoff
+
+        checkpoint = archive_ride_events(older_than_days=90, batch_size=2, sleep=0)
+        self.assertIsNotNone(checkpoint.completed_at)
+        self.assertEqual(checkpoint.cutoff, cutoff)
+        self.assertEqual(checkpoint.archived_count, 3)
+        self.assertEqual(RideEventArchive.objects.count(), 3)
+        self.assertEqual(list(RideEvent.objects.values_list('pk', flat=True)), [self.recent_event.pk])
+
+    def test_archive_command(self):
+        """Management command moves old events"""
+        out = StringIO()
+        call_command('archive_ride_events', '--sleep', '0', stdout=out)
+        self.assertIn('3 events moved', out.getvalue())
+        self.assertEqual(RideEvent.objects.count(), 1)
+
+    def test_full_history_unions_archive(self):
+        """Detail and export views include archived events when asked"""
+        archive_ride_events(older_than_days=90, sleep=0)
+        url = reverse('ride-detail', kwargs={'pk': self.ride.pk})
+
+        response = self.client.get(url)
+        self.assertNotIn('ride_events', response.data)
+
+        response = self.client.get(f'{url}?history=full')
+        self.assertEqual(len(response.data['ride_events']), 4)
+        self.assertEqual(response.data['ride_events'][-1]['description'], 'Recent event')
+
+        events_url = reverse('ride-events', kwargs={'pk': self.ride.pk})
+        self.assertEqual(self.client.get(events_url).data['count'], 1)
+        self.assertEqual(self.client.get(f'{events_url}?history=full').data['count'], 4)
+
+
+class APIOnlyProfileTests(TestCase):
+    def test_api_profile_boots_without_admin(self):
+        """The API-only settings profile passes system checks and drops the admin"""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='wingz.settings_api')
+        env.setdefault('SECRET_KEY', 'test')
+        result = subprocess.run(
+            [sys.executable, '-c', (
+                'import django; django.setup(); '
+                'from django.apps import apps; '
+                'from django.core.management import call_command; '
+                'call_command("check"); '
+                'import wingz.urls; '
+                'print(apps.is_installed("django.contrib.admin"))'
+            )],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertTrue(result.stdout.strip().endswith('False'))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkUserProvisioningTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+
+    def make_rows(self, count, prefix='driver'):
+        return [
+            {
+                'email': f'{prefix}{i}@test.com',
+                'username': f'{prefix}{i}',
+                'first_name': 'Fleet',
+                'last_name': f'Driver {i}',
+                'phone_number': '5550000',
+                'role': 'driver',
+                'password': 'sturdy-pass-123',
+            }
+            for i in range(count)
+        ]
+
+    def test_bulk_endpoint_reports_rejected_rows(self):
+        """Duplicates and invalid rows are rejected by index, the rest are created"""
+        rows = self.make_rows(3)
+        rows.append(dict(rows[0], username='other'))  # duplicate email in the batch
+        rows.append(dict(self.make_rows(1, 'x')[0], email='admin@test.com'))  # existing email
+        rows.append(dict(self.make_rows(1, 'y')[0], password='123'))  # weak password
+
+        self.client.force_authenticate(self.admin_user)
+        response = self.client.post(reverse('user-bulk-provision'), rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual([r['index'] for r in response.data['rejected']], [3, 4, 5])
+        self.assertIn('users_per_second', response.data)
+
+        user = User.objects.get(email='driver1@test.com')
+        self.assertTrue(user.check_password('sturdy-pass-123'))
+        self.assertEqual(user.role, 'driver')
+
+    def test_bulk_endpoint_hashes_on_thread_pool(self):
+        """Requests never fork the web worker into a process pool"""
+        self.client.force_authenticate(self.admin_user)
+        with patch('rides.provisioning.ProcessPoolExecutor') as process_pool:
+            response = self.client.post(
+                reverse('user-bulk-provision'), self.make_rows(6), format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 6)
+        process_pool.assert_not_called()
+        self.assertTrue(User.objects.get(email='driver5@test.com').check_password('sturdy-pass-123'))
+
+    @override_settings(PASSWORD_HASHING_MAX_PENDING=0)
+    def test_bulk_endpoint_leaves_login_pool_alone(self):
+        """Provisioning hashes on its own pool and sheds load there, not on logins"""
+        self.client.force_authenticate(self.admin_user)
+        response = self.client.post(reverse('user-bulk-provision'), self.make_rows(4), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with override_settings(USER_PROVISIONING_MAX_PENDING=0):
+            response = self.client.post(
+                reverse('user-bulk-provision'), self.make_rows(4, 'late'), format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(User.objects.filter(email__startswith='late').exists())
+
+    def test_bulk_endpoint_requires_admin(self):
+        """Only admins can provision users"""
+        response = self.client.post(reverse('user-bulk-provision'), self.make_rows(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_import_command_hashes_in_process_pool(self):
+        """The import command creates users with passwords hashed by worker processes"""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.make_rows(1)[0]))
+            writer.writeheader()
+            writer.writerows(self.make_rows(8))
+        self.addCleanup(os.remove, f.name)
+
+        out = StringIO()
+        call_command('import_users', f.name, '--workers', '2', '--chunk-size', '3', stdout=out)
+        self.assertIn('Created 8 users', out.getvalue())
+        self.assertTrue(User.objects.get(email='driver7@test.com').check_password('sturdy-pass-123'))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PasswordHashingPoolTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='driver@test.com',
+            email='driver@test.com',
+            password='testpass123',
+            role='user',
+            first_name='Driver',
+            last_name='User',
+            phone_number='1234567890'
+        )
+        self.factory = RequestFactory()
+
+    @override_settings(PASSWORD_HASHING_MODE='pool', PASSWORD_HASHING_WORKERS=2)
+    def test_login_in_pool_mode(self):
+        """Token endpoint verifies passwords on the hashing pool"""
+        url = reverse('token_obtain_pair')
+        response = self.client.post(url, {'email': 'driver@test.com', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+
+        response = self.client.post(url, {'email': 'driver@test.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(PASSWORD_HASHING_MODE='pool', PASSWORD_HASHING_MAX_PENDING=0)
+    def test_login_shed_when_queue_full(self):
+        """Logins beyond the queue-depth limit get a 503"""
+        response = self.client.post(
+            reverse('token_obtain_pair'),
+            {'email': 'driver@test.com', 'password': 'testpass123'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_async_token_view(self):
+        """The async token view issues tokens and rejects bad credentials"""
+        def login(password):
+            request = self.factory.post(
+                '/api/token/',
+                data=json.dumps({'email': 'driver@test.com', 'password': password}),
+                content_type='application/json'
+            )
+            return async_to_sync(async_token_obtain_pair)(request)
+
+        response = login('testpass123')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', json.loads(response.content))
+        self.assertEqual(login('wrong').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_outdated_hash_upgraded_on_login(self):
+        """Passwords stored with an old hasher are re-hashed after a pooled check"""
+        self.assertTrue(self.user.password.startswith('md5$'))
+        with override_settings(
+            PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+                'django.contrib.auth.hashers.MD5PasswordHasher',
+            ],
+            PASSWORD_HASHING_MODE='pool',
+        ):
+            self.assertTrue(verify_password(self.user, 'testpass123'))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha1$'))
+
+
+class FleetCounterTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.driver = User.objects.create_user(
+            username='driver@test.com',
+            email='driver@test.com',
+            password='testpass123',
+            first_name='Driver',
+            last_name='User',
+            phone_number='0987654321'
+        )
+        self.client.force_authenticate(self.admin_user)
+
+    def create_ride(self, ride_status='pickup'):
+        response = self.post_ride(status=ride_status, id_driver=self.driver.id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id_ride']
+
+    def get_counters(self):
+        response = self.client.get(f"{reverse('ride-counters')}?driver={self.driver.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_counters_follow_ride_writes(self):
+        """Create, status change and delete move rides between counters"""
+        first = self.create_ride('pickup')
+        self.create_ride('pickup')
+        counters = self.get_counters()
+        self.assertEqual(counters['totals'], {'en-route': 0, 'pickup': 2, 'dropoff': 0})
+        self.assertEqual(counters['drivers'][self.driver.id]['pickup'], 2)
+
+        self.client.patch(reverse('ride-detail', kwargs={'pk': first}), {'status': 'en-route'})
+        counters = self.get_counters()
+        self.assertEqual(counters['totals'], {'en-route': 1, 'pickup': 1, 'dropoff': 0})
+
+        self.client.delete(reverse('ride-detail', kwargs={'pk': first}))
+        counters = self.get_counters()
+        self.assertEqual(counters['totals'], {'en-route': 0, 'pickup': 1, 'dropoff': 0})
+        self.assertEqual(counters['drivers'][self.driver.id]['en-route'], 0)
+
+    def test_concurrent_updates_move_counters_from_stored_status(self):
+        """Writes re-read the ride under lock instead of trusting a stale copy"""
+        ride_id = self.create_ride('pickup')
+        stale = Ride.objects.get(pk=ride_id)
+        self.client.patch(reverse('ride-detail', kwargs={'pk': ride_id}), {'status': 'en-route'})
+
+        # A second request that loaded the ride before the first one committed
+        with patch.object(RideViewSet, 'get_object', return_value=stale):
+            response = self.client.patch(
+                reverse('ride-detail', kwargs={'pk': ride_id}), {'status': 'dropoff'}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_counters()['totals'], {'en-route': 0, 'pickup': 0, 'dropoff': 1})
+
+        with patch.object(RideViewSet, 'get_object', return_value=stale):
+            self.client.delete(reverse('ride-detail', kwargs={'pk': ride_id}))
+        self.assertEqual(self.get_counters()['totals'], {'en-route': 0, 'pickup': 0, 'dropoff': 0})
+
+    def test_user_delete_takes_cascaded_rides_out(self):
+        """Rides deleted along with their rider or driver leave the counters"""
+        self.create_ride('pickup')
+        self.create_ride('dropoff')
+        response = self.post_ride(id_rider=self.driver.id, id_driver=self.admin_user.id)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_counters()['totals'], {'en-route': 0, 'pickup': 2, 'dropoff': 1})
+
+        self.driver.delete()
+        self.assertFalse(Ride.objects.exists())
+        counters = get_fleet_counters([self.admin_user.id])
+        self.assertEqual(counters['totals'], {'en-route': 0, 'pickup': 0, 'dropoff': 0})
+        self.assertEqual(counters['drivers'][self.admin_user.id]['pickup'], 0)
+
+    def test_counters_read_is_single_query(self):
+        """Reading counters costs one query regardless of ride volume"""
+        self.create_ride()
+        with self.assertNumQueries(1):
+            get_fleet_counters([self.driver.id])
+
+    def test_reconcile_rebuilds_from_rides(self):
+        """Reconcile command recomputes counters written outside the API"""
+        self.make_ride(status='dropoff', id_driver=self.driver)
+        self.assertEqual(self.get_counters()['totals']['dropoff'], 0)
+
+        call_command('reconcile_fleet_counters', stdout=StringIO())
+        counters = self.get_counters()
+        self.assertEqual(counters['totals']['dropoff'], 1)
+        self.assertEqual(counters['drivers'][self.driver.id]['dropoff'], 1)
+
+
+class ConditionalRequestTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.rides = [
+            self.make_ride()
+            for _ in range(2)
+        ]
+        self.client.force_authenticate(self.admin_user)
+
+    def test_detail_not_modified(self):
+        """Detail returns 304 for a matching ETag and a fresh one after changes"""
+        url = reverse('ride-detail', kwargs={'pk': self.rides[0].pk})
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Rider details are part of the payload
+        self.admin_user.first_name = 'Renamed'
+        self.admin_user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rider']['first_name'], 'Renamed')
+        etag = response['ETag']
+
+        RideEvent.objects.create(id_ride=self.rides[0], description='Picked up')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_not_modified_without_serializing(self):
+        """List returns 304 from aggregates only and changes on delete"""
+        url = reverse('ride-list')
+        etag = self.client.get(url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Neither the rides nor their users are read for a 304
+        self.assertFalse(any(
+            '"ride"' in q['sql'] or '"user"' in q['sql'] for q in queries.captured_queries
+        ))
+
+        # Other filters are a different representation
+        self.assertNotEqual(self.client.get(f'{url}?status=pickup')['ETag'], etag)
+
+        self.rides[1].delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+
+
+@override_settings(DELTA_SYNC_SETTLE_SECONDS=0)
+class DeltaSyncTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.ride = self.make_ride()
+        self.client.force_authenticate(self.admin_user)
+        self.url = reverse('ride-changes')
+
+    def test_sync_from_cursor(self):
+        """Only changes after the cursor are returned, deletions as tombstones"""
+        response = self.client.get(f'{self.url}?cursor=0')
+        self.assertEqual([r['id_ride'] for r in response.data['rides']], [self.ride.pk])
+        cursor = response.data['cursor']
+
+        response = self.client.get(f'{self.url}?cursor={cursor}')
+        self.assertEqual(response.data['rides'], [])
+        self.assertEqual(response.data['cursor'], cursor)
+
+        other = self.make_ride()
+        event = RideEvent.objects.create(id_ride=other, description='Driver assigned')
+        deleted_pk = self.ride.pk
+        self.ride.delete()
+
+        response = self.client.get(f'{self.url}?cursor={cursor}')
+        self.assertEqual([r['id_ride'] for r in response.data['rides']], [other.pk])
+        self.assertEqual([e['id_ride_event'] for e in response.data['events']], [event.pk])
+        self.assertEqual(response.data['deleted'], [deleted_pk])
+        self.assertGreater(response.data['cursor'], cursor)
+
+    def test_sync_pages_with_limit(self):
+        """has_more tells clients to keep polling"""
+        self.make_ride()
+        response = self.client.get(f'{self.url}?cursor=0&limit=1')
+        self.assertTrue(response.data['has_more'])
+        response = self.client.get(f"{self.url}?cursor={response.data['cursor']}&limit=1")
+        self.assertFalse(response.data['has_more'])
+        self.assertEqual(len(response.data['rides']), 1)
+
+    def test_sync_from_updated_since(self):
+        """updated_since bootstraps a cursor from the change log timestamps"""
+        RideChange.objects.update(created_at=timezone.now() - timedelta(days=1))
+        since = (timezone.now() - timedelta(hours=1)).isoformat()
+        newer = self.make_ride()
+
+        response = self.client.get(self.url, {'updated_since': since})
+        self.assertEqual([r['id_ride'] for r in response.data['rides']], [newer.pk])
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(RIDE_DELETE_MODE='soft', DELTA_SYNC_SETTLE_SECONDS=0)
+class RidePurgeTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.ride = self.make_ride()
+        RideEvent.objects.bulk_create([
+            RideEvent(id_ride=self.ride, description=f'Event {i}') for i in range(5)
+        ])
+        rebuild_fleet_counters()
+        self.client.force_authenticate(self.admin_user)
+        self.url = reverse('ride-detail', kwargs={'pk': self.ride.pk})
+
+    def test_soft_delete_hides_ride_and_queues_purge(self):
+        """Delete answers 202 at once and leaves the events to the purger"""
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], RidePurge.STATUS_PENDING)
+        self.assertEqual(RideEvent.objects.filter(id_ride=self.ride).count(), 5)
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('ride-list')).data['count'], 0)
+        self.assertEqual(get_fleet_counters()['totals']['pickup'], 0)
+        rebuild_fleet_counters()
+        self.assertEqual(get_fleet_counters()['totals']['pickup'], 0)
+
+        changes = self.client.get(f"{reverse('ride-changes')}?cursor=0")
+        self.assertEqual(changes.data['deleted'], [self.ride.pk])
+
+        status_response = self.client.get(response.data['status_url'])
+        self.assertEqual(status_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(status_response.data['id_ride'], self.ride.pk)
+
+    def test_purge_deletes_in_batches(self):
+        """Events go in bounded batches, with progress recorded, then the ride"""
+        self.client.delete(self.url)
+        purge = RidePurge.objects.get(id_ride=self.ride.pk)
+
+        purge = purge_ride(purge, batch_size=2, sleep=0)
+        self.assertEqual(purge.status, RidePurge.STATUS_DONE)
+        self.assertEqual(purge.events_deleted, 5)
+        self.assertEqual(purge.batches, 3)
+        self.assertFalse(Ride.objects.filter(pk=self.ride.pk).exists())
+        self.assertFalse(RideEvent.objects.exists())
+
+    def test_failed_purge_is_retried(self):
+        """A failing purge is marked failed and picked up by the next run"""
+        self.client.delete(self.url)
+        with patch('rides.purge._delete_batch', side_effect=RuntimeError('lock timeout')):
+            self.assertEqual(run_pending_purges(), 0)
+        purge = RidePurge.objects.get(id_ride=self.ride.pk)
+        self.assertEqual(purge.status, RidePurge.STATUS_FAILED)
+        self.assertEqual(purge.last_error, 'lock timeout')
+
+        out = StringIO()
+        call_command('purge_rides', '--batch-size', '2', stdout=out)
+        self.assertIn('Purged 1 rides', out.getvalue())
+        self.assertFalse(Ride.objects.filter(pk=self.ride.pk).exists())
+
+    def test_running_purge_is_not_claimed_twice(self):
+        """A purge already running in another process is skipped, not run again"""
+        self.client.delete(self.url)
+        purge = RidePurge.objects.get(id_ride=self.ride.pk)
+        RidePurge.objects.filter(pk=purge.pk).update(status=RidePurge.STATUS_RUNNING)
+
+        self.assertIsNone(purge_ride(purge, batch_size=2))
+        self.assertEqual(run_pending_purges(), 0)
+        purge.refresh_from_db()
+        self.assertEqual((purge.events_deleted, purge.batches), (0, 0))
+        self.assertEqual(RideEvent.objects.filter(id_ride=self.ride).count(), 5)
+
+    @override_settings(RIDE_DELETE_MODE='inline')
+    def test_inline_mode_deletes_immediately(self):
+        response = self.client.delete(self.url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Ride.objects.filter(pk=self.ride.pk).exists())
+        self.assertFalse(RidePurge.objects.exists())
+
+
+class HistoryLoaderTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.existing = User.objects.create_user(
+            username='existing', email='existing@test.com', password='testpass123',
+            first_name='Existing', last_name='User', phone_number='1'
+        )
+        self.paths = {
+            'users': self.write_csv('users.csv', [
+                {'id': 'u1', 'username': 'rider', 'email': 'rider@test.com', 'first_name': 'R',
+                 'last_name': 'One', 'phone_number': '2', 'role': 'user', 'password': ''},
+                {'id': 'u2', 'username': 'driver', 'email': 'driver@test.com', 'first_name': 'D',
+                 'last_name': 'Two', 'phone_number': '3', 'role': 'driver', 'password': ''},
+                {'id': 'u3', 'username': 'old', 'email': 'existing@test.com', 'first_name': 'E',
+                 'last_name': 'U', 'phone_number': '1', 'role': 'user', 'password': ''},
+                {'id': 'u4', 'username': 'bad', 'email': 'not-an-email', 'first_name': 'B',
+                 'last_name': 'Ad', 'phone_number': '4', 'role': 'user', 'password': ''},
+            ]),
+            'rides': self.write_ndjson('rides.ndjson', [
+                {'id_ride': 100 + i, 'id_rider': 'u1', 'id_driver': 'u3' if i % 2 else 'u2',
+                 'status': 'dropoff', 'pickup_latitude': 37.7, 'pickup_longitude': -122.4,
+                 'dropoff_latitude': 37.8, 'dropoff_longitude': -122.5,
+                 'pickup_time': '2020-01-01T10:00:00Z', 'created_at': '2020-01-01T09:55:00Z'}
+                for i in range(5)
+            ] + [{'id_ride': 999, 'id_rider': 'missing', 'id_driver': 'u2', 'status': 'dropoff',
+                  'pickup_latitude': 1, 'pickup_longitude': 1, 'dropoff_latitude': 1,
+                  'dropoff_longitude': 1, 'pickup_time': '2020-01-01T10:00:00Z'}]),
+            'events': self.write_csv('events.csv', [
+                {'id_ride': 100 + i % 5, 'description': f'Event {i}',
+                 'created_at': '2020-01-01 10:05:00'}
+                for i in range(7)
+            ]),
+        }
+
+    def write_csv(self, name, rows):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        return path
+
+    def write_ndjson(self, name, rows):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def test_load_resolves_foreign_keys(self):
+        """Source ids map to new keys; known emails map to existing users"""
+        checkpoints = load_history(self.paths, chunk_size=3)
+        self.assertTrue(all(checkpoint.completed_at for checkpoint in checkpoints))
+        self.assertEqual(
+            [(c.loaded_count, c.skipped_count) for c in checkpoints],
+            [(2, 1), (5, 1), (7, 0)]
+        )
+
+        rider = User.objects.get(email='rider@test.com')
+        self.assertFalse(rider.has_usable_password())
+        rides = Ride.objects.order_by('pk')
+        self.assertEqual({ride.id_rider for ride in rides}, {rider})
+        self.assertIn(self.existing, {ride.id_driver for ride in rides})
+        # Historical timestamps are kept
+        self.assertEqual(rides[0].created_at.year, 2020)
+        self.assertEqual(RideEvent.objects.filter(id_ride=rides[0]).count(), 2)
+        self.assertEqual(RideEvent.objects.first().created_at.year, 2020)
+        self.assertEqual(get_fleet_counters()['totals']['dropoff'], 5)
+
+    @override_settings(DELTA_SYNC_SETTLE_SECONDS=0)
+    def test_loaded_rows_reach_delta_sync(self):
+        """Loaded rides and events are in the change feed after the current cursor"""
+        admin = User.objects.create_user(
+            username='sync', email='sync@test.com', password='testpass123',
+            first_name='Sync', last_name='User', phone_number='1', role='admin'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        cursor = self.client.get(f"{reverse('ride-changes')}?cursor=0").data['cursor']
+
+        load_history(self.paths)
+        changes = RideChange.objects.filter(seq__gt=cursor)
+        self.assertEqual(changes.filter(kind=RideChange.KIND_RIDE).count(), 5)
+        self.assertEqual(
+            set(changes.filter(kind=RideChange.KIND_EVENT).values_list('id_ride_event', flat=True)),
+            set(RideEvent.objects.values_list('pk', flat=True))
+        )
+        response = self.client.get(f"{reverse('ride-changes')}?cursor={cursor}")
+        self.assertEqual(
+            sorted(ride['id_ride'] for ride in response.data['rides']),
+            list(Ride.objects.order_by('pk').values_list('pk', flat=True))
+        )
+
+    def test_load_resumes_from_checkpoint(self):
+        """A paused load picks up after the last committed chunk"""
+        load_history(self.paths, chunk_size=2, max_chunks=1)
+        self.assertEqual(User.objects.count(), 3)
+        self.assertFalse(Ride.objects.exists())
+
+        id_map = dict(LoadIdMap.objects.filter(entity='users').values_list('source_id', 'target_id'))
+        self.assertEqual(set(id_map), {'u1', 'u2'})
+
+        out = StringIO()
+        call_command(
+            'load_history', '--users', self.paths['users'], '--rides', self.paths['rides'],
+            '--events', self.paths['events'], '--chunk-size', '2', stdout=out
+        )
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(Ride.objects.count(), 5)
+        self.assertEqual(RideEvent.objects.count(), 7)
+        self.assertEqual(LoadCheckpoint.objects.filter(completed_at__isnull=False).count(), 3)
+
+        # Completed files are not loaded twice
+        load_history(self.paths)
+        self.assertEqual(Ride.objects.count(), 5)
+
+    def test_loaded_rides_never_reuse_purged_ids(self):
+        """Ids of deleted rides stay retired, as purges and tombstones refer to them"""
+        rides = [
+            Ride.objects.create(
+                status='dropoff', id_rider=self.existing, id_driver=self.existing,
+                pickup_latitude=1, pickup_longitude=1, dropoff_latitude=1,
+                dropoff_longitude=1, pickup_time=timezone.now()
+            )
+            for _ in range(2)
+        ]
+        purged_id = rides[-1].pk
+        RidePurge.objects.create(id_ride=purged_id, status=RidePurge.STATUS_DONE)
+        rides[-1].delete()
+
+        load_history(self.paths)
+        loaded = set(Ride.objects.exclude(pk=rides[0].pk).values_list('pk', flat=True))
+        self.assertEqual(len(loaded), 5)
+        self.assertGreater(min(loaded), purged_id)
+
+
+class HistoryLoaderIndexTests(TransactionTestCase):
+    def test_deferred_indexes_are_rebuilt(self):
+        user = User.objects.create_user(
+            username='u', email='u@test.com', password='x', first_name='U',
+            last_name='U', phone_number='1'
+        )
+        LoadIdMap.objects.create(entity='rides', source_id='1', target_id=Ride.objects.create(
+            status='pickup', id_rider=user, id_driver=user, pickup_latitude=0,
+            pickup_longitude=0, dropoff_latitude=0, dropoff_longitude=0,
+            pickup_time=timezone.now()
+        ).pk)
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as f:
+            f.write(json.dumps({'id_ride': 1, 'description': 'Imported'}) + '\n')
+        self.addCleanup(os.remove, f.name)
+
+        index_name = RideEvent._meta.indexes[0].name
+
+        def constraints():
+            with connection.cursor() as cursor:
+                return connection.introspection.get_constraints(cursor, RideEvent._meta.db_table)
+
+        seen = []
+        with patch('rides.loader._load_chunk', side_effect=lambda *args: seen.append(
+                index_name in constraints())):
+            load_history({'events': f.name}, defer_indexes=True)
+        self.assertEqual(seen, [False])
+        self.assertIn(index_name, constraints())
+
+
+RIDE_SHARDS = {
+    'americas': {'database': 'shard_americas', 'bbox': [-60, -170, 75, -30]},
+    'europe': {'database': 'shard_europe', 'bbox': [35, -15, 72, 45]},
+}
+
+
+# Two SQLite files stand in for the regional databases. They are registered
+# here so the test runner creates and destroys them like any test database.
+connections.settings.update(connections.configure_settings({
+    DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+    **{
+        shard['database']: {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.gettempdir(), f"wingz_{shard['database']}.sqlite3"),
+            'TEST': {
+                'NAME': os.path.join(tempfile.gettempdir(), f"test_wingz_{shard['database']}.sqlite3"),
+            },
+        }
+        for shard in RIDE_SHARDS.values()
+    }
+}))
+
+
+@override_settings(RIDE_SHARDS=RIDE_SHARDS, DELTA_SYNC_SETTLE_SECONDS=0)
+class RideShardingTests(RideFixturesMixin, APITestCase):
+    databases = {DEFAULT_DB_ALIAS, 'shard_americas', 'shard_europe'}
+
+    def setUp(self):
+        cache.clear()
+        self.admin_user = self.create_admin_user()
+        self.client.force_authenticate(self.admin_user)
+
+    def create_ride(self, lat, lon, minutes=0):
+        return self.make_ride(
+            pickup_latitude=lat,
+            pickup_longitude=lon,
+            dropoff_latitude=lat,
+            dropoff_longitude=lon,
+            pickup_time=timezone.now() + timedelta(minutes=minutes)
+        )
+
+    def test_rides_are_routed_by_pickup(self):
+        """Rides land on their region's shard with ids unique across shards"""
+        ride_data = {
+            'status': 'pickup',
+            'id_rider': self.admin_user.pk,
+            'id_driver': self.admin_user.pk,
+            'dropoff_latitude': 0,
+            'dropoff_longitude': 0,
+            'pickup_time': timezone.now().isoformat(),
+        }
+        ids = {}
+        for name, lat, lon in [('sf', 37.77, -122.42), ('berlin', 52.52, 13.40),
+                               ('sydney', -33.87, 151.21)]:
+            response = self.client.post(
+                reverse('ride-list'),
+                {**ride_data, 'pickup_latitude': lat, 'pickup_longitude': lon},
+                format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            ids[name] = response.data['id_ride']
+
+        self.assertEqual(len(set(ids.values())), 3)
+        self.assertFalse(Ride.objects.exists())
+        # Sydney is outside every bbox and falls back to the first region
+        self.assertEqual(
+            set(Ride.objects.using('shard_americas').values_list('pk', flat=True)),
+            {ids['sf'], ids['sydney']}
+        )
+        self.assertEqual(
+            list(Ride.objects.using('shard_europe').values_list('pk', flat=True)),
+            [ids['berlin']]
+        )
+
+        berlin = Ride.objects.using('shard_europe').get(pk=ids['berlin'])
+        RideEvent.objects.create(id_ride=berlin, description='Driver assigned')
+        self.assertEqual(RideEvent.objects.using('shard_europe').count(), 1)
+
+        response = self.client.get(reverse('ride-detail', kwargs={'pk': ids['berlin']}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['todays_ride_events']), 1)
+        self.assertEqual(
+            self.client.get(reverse('ride-detail', kwargs={'pk': 999999})).status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+
+    def test_list_merges_shards_in_order(self):
+        """Pages are merged across shards in pickup_time order"""
+        for minutes in range(6):
+            if minutes % 2:
+                self.create_ride(37.77, -122.42, minutes)
+            else:
+                self.create_ride(52.52, 13.40, minutes)
+
+        url = reverse('ride-list')
+        pickup_times = []
+        for page in (1, 2):
+            response = self.client.get(f'{url}?page_size=4&page={page}')
+            self.assertEqual(response.data['count'], 6)
+            pickup_times += [ride['pickup_time'] for ride in response.data['results']]
+        self.assertEqual(len(pickup_times), 6)
+        self.assertEqual(pickup_times, sorted(pickup_times))
+
+        response = self.client.get(f'{url}?page_size=4')
+        response = self.client.get(f'{url}?page_size=4', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_distance_sort_skips_far_shards(self):
+        """Nearest shard first; a farther shard is not scanned once the page is full"""
+        for offset in range(3):
+            self.create_ride(37.77 + offset * 0.01, -122.42)
+        for offset in range(2):
+            self.create_ride(52.52 + offset * 0.01, 13.40)
+
+        url = f"{reverse('ride-list')}?sort_by=distance&latitude=37.77&longitude=-122.42"
+        with CaptureQueriesContext(connections['shard_europe']) as europe:
+            response = self.client.get(f'{url}&page_size=2')
+        self.assertEqual(response.data['count'], 5)
+        distances = [ride['distance_to_pickup'] for ride in response.data['results']]
+        self.assertEqual(distances, sorted(distances))
+        self.assertFalse(any('acos' in query['sql'] for query in europe.captured_queries))
+
+        response = self.client.get(f'{url}&page_size=10')
+        distances = [ride['distance_to_pickup'] for ride in response.data['results']]
+        self.assertEqual(len(distances), 5)
+        self.assertEqual(distances, sorted(distances))
+        self.assertGreater(distances[-1], 8000)
+
+    def test_sync_and_counters_span_shards(self):
+        sf = self.create_ride(37.77, -122.42)
+        berlin = self.create_ride(52.52, 13.40)
+        event = RideEvent.objects.create(id_ride=berlin, description='Driver assigned')
+
+        response = self.client.get(f"{reverse('ride-changes')}?cursor=0")
+        self.assertEqual([ride['id_ride'] for ride in response.data['rides']], [sf.pk, berlin.pk])
+        self.assertEqual(
+            [(e['id_ride'], e['id_ride_event']) for e in response.data['events']],
+            [(berlin.pk, event.pk)]
+        )
+
+        rebuild_fleet_counters()
+        self.assertEqual(get_fleet_counters()['totals']['pickup'], 2)
+
+    @override_settings(RIDE_DELETE_MODE='soft')
+    def test_ride_writes_roll_back_on_both_databases(self):
+        """A failure on the default database also undoes the shard's ride write"""
+        ride_data = {
+            'status': 'pickup',
+            'id_rider': self.admin_user.pk,
+            'id_driver': self.admin_user.pk,
+            'pickup_latitude': 52.52,
+            'pickup_longitude': 13.40,
+            'dropoff_latitude': 0,
+            'dropoff_longitude': 0,
+            'pickup_time': timezone.now().isoformat(),
+        }
+        with patch('rides.views.record_pickup_change', side_effect=RuntimeError('boom')):
+            response = self.client.post(reverse('ride-list'), ride_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(Ride.objects.using('shard_europe').exists())
+        self.assertFalse(RideChange.objects.exists())
+
+        ride = self.create_ride(52.52, 13.40)
+        with patch('rides.views.enqueue', side_effect=RuntimeError('boom')):
+            response = self.client.delete(reverse('ride-detail', kwargs={'pk': ride.pk}))
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        ride = Ride.objects.using('shard_europe').get(pk=ride.pk)
+        self.assertIsNone(ride.deleted_at)
+        self.assertFalse(RidePurge.objects.exists())
+
+    def test_users_are_replicated_to_shards(self):
+        user = User.objects.create_user(
+            username='rider', email='rider@test.com', password='testpass123',
+            first_name='R', last_name='R', phone_number='1'
+        )
+        for shard in RIDE_SHARDS.values():
+            self.assertTrue(User.objects.using(shard['database']).filter(pk=user.pk).exists())
+
+        user.delete()
+        for shard in RIDE_SHARDS.values():
+            self.assertFalse(User.objects.using(shard['database']).filter(pk=user.pk).exists())
+
+
+class RideTripLengthTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.client.force_authenticate(self.admin_user)
+        # Roughly 1, 10 and 100 km trips
+        self.rides = [
+            self.make_ride(
+                pickup_latitude=37.0,
+                pickup_longitude=-122.0,
+                dropoff_latitude=37.0 + degrees,
+                dropoff_longitude=-122.0
+            )
+            for degrees in (0.9, 0.09, 0.009)
+        ]
+
+    def test_trip_length_stored_on_write(self):
+        ride = self.rides[0]
+        self.assertAlmostEqual(ride.trip_length_km, ride.calculate_trip_length())
+        self.assertAlmostEqual(ride.trip_length_km, 100, delta=1)
+
+        url = reverse('ride-detail', kwargs={'pk': ride.pk})
+        response = self.client.patch(url, {'dropoff_latitude': 37.18}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAlmostEqual(response.data['trip_length_km'], 20, delta=0.5)
+
+        ride.refresh_from_db()
+        ride.dropoff_latitude = 37.0
+        ride.save(update_fields=['dropoff_latitude'])
+        ride.refresh_from_db()
+        self.assertEqual(ride.trip_length_km, 0)
+
+    def test_sort_and_range_filters(self):
+        url = reverse('ride-list')
+        response = self.client.get(url, {'sort_by': 'trip_length'})
+        self.assertEqual(
+            [ride['id_ride'] for ride in response.data['results']],
+            [ride.pk for ride in reversed(self.rides)]
+        )
+
+        response = self.client.get(url, {'min_trip_km': 5, 'max_trip_km': 50})
+        self.assertEqual(
+            [ride['id_ride'] for ride in response.data['results']], [self.rides[1].pk]
+        )
+
+        response = self.client.get(url, {'min_trip_km': 'far'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        plan = Ride.objects.filter(trip_length_km__gte=5).order_by('trip_length_km').explain()
+        self.assertRegex(plan, r'INDEX \w*trip_length_km')
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_backfill_command(self):
+        Ride.objects.update(trip_length_km=None)
+        updated_at = {ride.pk: ride.updated_at for ride in Ride.objects.all()}
+        cursor = RideChange.objects.aggregate(seq=Max('seq'))['seq']
+
+        out = StringIO()
+        call_command('backfill_trip_lengths', '--batch-size', '2', stdout=out)
+        self.assertIn('3 rides', out.getvalue())
+
+        for ride in Ride.objects.all():
+            self.assertAlmostEqual(ride.trip_length_km, ride.calculate_trip_length())
+            self.assertGreater(ride.updated_at, updated_at[ride.pk])
+        changes = RideChange.objects.filter(seq__gt=cursor, kind=RideChange.KIND_RIDE)
+        self.assertEqual(sorted(changes.values_list('id_ride', flat=True)), sorted(updated_at))
+
+    def test_backfill_changes_etags(self):
+        """Clients holding a payload without the trip length get the new one"""
+        Ride.objects.update(trip_length_km=None)
+        ride = self.rides[0]
+        urls = [reverse('ride-detail', kwargs={'pk': ride.pk}), reverse('ride-list')]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        backfill_trip_lengths()
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(response.data['results'][0]['trip_length_km'])
+
+
+class RideFilterTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.driver = User.objects.create_user(
+            username='driver@test.com',
+            email='driver@test.com',
+            password='testpass123',
+            first_name='Driver',
+            last_name='User',
+            phone_number='1234567891'
+        )
+        self.client.force_authenticate(self.admin_user)
+        now = timezone.now()
+        self.rides = {
+            name: self.make_ride(
+                status=ride_status,
+                id_driver=driver,
+                pickup_latitude=latitude,
+                pickup_longitude=-122.4,
+                dropoff_latitude=latitude,
+                dropoff_longitude=-122.5,
+                pickup_time=now - timedelta(days=days)
+            )
+            for name, ride_status, driver, latitude, days in (
+                ('old', 'dropoff', self.driver, 37.7, 10),
+                ('recent', 'pickup', self.admin_user, 37.8, 1),
+                ('elsewhere', 'en-route', self.driver, 51.5, 0),
+            )
+        }
+
+    def ride_ids(self, params):
+        response = self.client.get(reverse('ride-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return {ride['id_ride'] for ride in response.data['results']}
+
+    def test_filters(self):
+        rides = self.rides
+        self.assertEqual(
+            self.ride_ids({'status': 'pickup,dropoff'}), {rides['old'].pk, rides['recent'].pk}
+        )
+        self.assertEqual(
+            self.ride_ids({'driver_email': self.driver.email}),
+            {rides['old'].pk, rides['elsewhere'].pk}
+        )
+        self.assertEqual(
+            self.ride_ids({'pickup_from': (timezone.now() - timedelta(days=2)).date().isoformat()}),
+            {rides['recent'].pk, rides['elsewhere'].pk}
+        )
+        self.assertEqual(
+            self.ride_ids({'created_to': (timezone.now() - timedelta(days=1)).isoformat()}), set()
+        )
+        self.assertEqual(
+            self.ride_ids({'bbox': '37,-123,38,-122', 'driver_email': self.driver.email}),
+            {rides['old'].pk}
+        )
+
+        for params in ({'status': 'pickup,lost'}, {'pickup_to': 'yesterday'}, {'bbox': '38,-123,37,-122'}):
+            response = self.client.get(reverse('ride-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(next(iter(params)), response.data)
+
+    def test_filters_use_indexes(self):
+        """Every filter is searched through the index on its own column, never scanned"""
+        combinations = [
+            ({'status': 'pickup'}, 'pickup_time', '(status=?'),
+            ({'status': 'pickup,dropoff'}, 'pickup_time', '(status=?'),
+            ({'rider_email': self.admin_user.email}, 'pickup_time', '(id_rider_id=?'),
+            ({'driver_email': self.driver.email}, 'pickup_time', '(id_driver_id=?'),
+            ({'pickup_from': '2024-01-01', 'pickup_to': '2024-02-01'}, 'pickup_time', '(pickup_time>?'),
+            ({'created_from': '2024-01-01', 'created_to': '2024-02-01'}, 'pickup_time', '(created_at>?'),
+            ({'bbox': '37,-123,38,-122'}, 'pickup_time', '(pickup_latitude>?'),
+            # Trip length ranges are only index-backed with sort_by=trip_length
+            ({'min_trip_km': '5'}, 'trip_length_km', '(trip_length_km>?'),
+            ({'status': 'pickup', 'pickup_from': '2024-01-01'}, 'pickup_time', '(status=? AND pickup_time>?'),
+            ({'driver_email': self.driver.email, 'pickup_from': '2024-01-01'}, 'pickup_time',
+             '(id_driver_id=? AND pickup_time>?'),
+        ]
+        for params, ordering, search in combinations:
+            query = QueryDict(mutable=True)
+            query.update(params)
+            queryset = RideFilterSet(query).filter_queryset(Ride.objects.active())
+            plan = queryset.order_by(ordering).explain()
+            with self.subTest(params=params):
+                self.assertRegex(plan, r'SEARCH ride USING (COVERING )?INDEX \w+ ' + re.escape(search))
+                self.assertNotIn('SCAN ride', plan)
+
+        # Unfiltered lists walk the ordering index and stop at the page size
+        plan = Ride.objects.active().order_by('pickup_time').explain()
+        self.assertRegex(plan, r'SCAN ride USING INDEX ride_pickup__\w+')
+
+
+class RideAdminTests(RideFixturesMixin, TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser(
+            username='admin@test.com',
+            email='admin@test.com',
+            password='testpass123',
+            first_name='Admin',
+            last_name='User',
+            phone_number='1234567890'
+        )
+        self.client.force_login(self.admin_user)
+        cache.clear()
+
+    def create_rides(self, count):
+        start = Ride.objects.count()
+        for i in range(start, start + count):
+            rider = User.objects.create_user(
+                username=f'rider{i}@test.com',
+                email=f'rider{i}@test.com',
+                password='testpass123',
+                first_name='Rider',
+                last_name='User',
+                phone_number='1234567890'
+            )
+            self.make_ride(id_rider=rider)
+
+    def changelist_queries(self):
+        url = reverse('admin:rides_ride_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'status__exact': 'pickup'})
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries]
+
+    def test_changelist_query_count_is_constant(self):
+        self.create_rides(2)
+        few = self.changelist_queries()
+        self.create_rides(8)
+        cache.clear()
+        many = self.changelist_queries()
+
+        self.assertEqual(len(few), len(many))
+        # A single, filtered count: no unfiltered COUNT(*) for the full result
+        self.assertEqual(len([sql for sql in many if 'COUNT(' in sql]), 1)
+
+    def test_change_form_shows_recent_events_without_user_choices(self):
+        self.create_rides(1)
+        ride = Ride.objects.get()
+        RideEvent.objects.create(id_ride=ride, description='Recent event')
+        old = RideEvent.objects.create(id_ride=ride, description='Old event')
+        RideEvent.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=2))
+
+        response = self.client.get(reverse('admin:rides_ride_change', args=[ride.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Recent event')
+        self.assertNotContains(response, 'Old event')
+        # Raw id inputs instead of a dropdown of every user
+        self.assertContains(response, 'vForeignKeyRawIdAdminField', count=2)
+        self.assertNotContains(response, '<option value="%d"' % self.admin_user.pk)
+
+    @override_settings(HEATMAP_ZOOM_LEVELS=[10])
+    def test_admin_writes_keep_counters_and_tiles(self):
+        """Edits and deletes in the admin move counters and tiles like the API"""
+        self.create_rides(2)
+        rebuild_fleet_counters()
+        rebuild_heatmap()
+        ride, other = Ride.objects.order_by('pk')
+        pickup_time = timezone.localtime(ride.pickup_time)
+
+        response = self.client.post(reverse('admin:rides_ride_change', args=[ride.pk]), {
+            'status': 'dropoff',
+            'id_rider': ride.id_rider_id,
+            'id_driver': ride.id_driver_id,
+            'pickup_latitude': 40.7128,
+            'pickup_longitude': -74.0060,
+            'dropoff_latitude': ride.dropoff_latitude,
+            'dropoff_longitude': ride.dropoff_longitude,
+            'pickup_time_0': pickup_time.strftime('%Y-%m-%d'),
+            'pickup_time_1': pickup_time.strftime('%H:%M:%S'),
+            'ride_events-TOTAL_FORMS': 0,
+            'ride_events-INITIAL_FORMS': 0,
+        })
+        self.assertEqual(response.status_code, 302)
+        totals = get_fleet_counters()['totals']
+        self.assertEqual((totals['pickup'], totals['dropoff']), (1, 1))
+        self.assertEqual(get_heatmap(10)['total'], 2)
+        self.assertEqual(len(get_heatmap(10)['tiles']), 2)
+
+        response = self.client.post(reverse('admin:rides_ride_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [ride.pk, other.pk],
+            'post': 'yes',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Ride.objects.exists())
+        self.assertEqual(get_fleet_counters()['totals'], {'en-route': 0, 'pickup': 0, 'dropoff': 0})
+        self.assertEqual(get_heatmap(10)['total'], 0)
+
+
+class IdempotencyKeyTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.client.force_authenticate(self.admin_user)
+        self.payload = self.ride_payload()
+
+    def create(self, key, payload=None):
+        return self.client.post(
+            reverse('ride-list'), payload or self.payload, format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_response_without_writing(self):
+        first = self.create('retry-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.create('retry-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Ride.objects.count(), 1)
+        self.assertFalse(any('"ride"' in query['sql'] for query in queries))
+
+        url = reverse('ride-detail', kwargs={'pk': first.data['id_ride']})
+        for _ in range(2):
+            response = self.client.patch(
+                url, {'status': 'dropoff'}, format='json', HTTP_IDEMPOTENCY_KEY='patch-1'
+            )
+            self.assertEqual(response.data['status'], 'dropoff')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    def test_key_reuse_and_concurrent_retry_are_rejected(self):
+        self.create('reuse-1')
+        response = self.create('reuse-1', dict(self.payload, status='dropoff'))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        # Another user's identical key is independent
+        other = User.objects.create_user(
+            username='other@test.com', email='other@test.com', password='testpass123',
+            role='admin', first_name='Other', last_name='User', phone_number='1234567891'
+        )
+        self.client.force_authenticate(other)
+        self.assertNotIn('Idempotent-Replayed', self.create('reuse-1'))
+
+        IdempotencyKey.objects.create(
+            id_user=other, key='in-flight', request_hash='',
+            expires_at=timezone.now() + timedelta(minutes=1)
+        )
+        response = self.create('in-flight')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Ride.objects.count(), 2)
+
+    def test_expired_keys_run_again_and_are_purged(self):
+        self.create('expire-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.create('expire-1')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Ride.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class UserCacheTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.client.force_authenticate(self.admin_user)
+        cache.clear()
+        self.user_cache = get_user_cache()
+        self.user_cache.clear()
+
+    def create_ride(self, id_rider=None):
+        return self.post_ride(id_rider=id_rider or self.admin_user.id)
+
+    def user_queries(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        return response, [q['sql'] for q in queries if 'FROM "user"' in q['sql']]
+
+    def test_writes_validate_users_from_cache(self):
+        hits = self.user_cache.hits
+        response, queries = self.user_queries(self.create_ride)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Rider and driver are the same user: one miss, one hit
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.user_queries(self.create_ride)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(queries, [])
+        self.assertEqual(response.data['rider']['email'], self.admin_user.email)
+        self.assertEqual(self.user_cache.hits - hits, 3)
+
+        response = self.client.get(reverse('user-cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(response.data['hit_rate'], 0)
+        self.assertIsNotNone(response.data['queries_saved_per_write'])
+
+    def test_user_writes_invalidate_cache(self):
+        unknown = self.admin_user.id + 100
+        response = self.create_ride(id_rider=unknown)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        User.objects.create_user(
+            id=unknown, username='late@test.com', email='late@test.com', password='testpass123',
+            first_name='Late', last_name='User', phone_number='1234567891'
+        )
+        self.assertEqual(self.create_ride(id_rider=unknown).status_code, status.HTTP_201_CREATED)
+
+        self.admin_user.email = 'renamed@test.com'
+        self.admin_user.save()
+        response = self.create_ride()
+        self.assertEqual(response.data['driver']['email'], 'renamed@test.com')
+
+        # Another process changing a user moves the shared version
+        self.assertGreater(self.user_cache.stats()['size'], 0)
+        bump_users_version()
+        self.user_cache.get(self.admin_user.id)
+        self.assertEqual(self.user_cache.stats()['size'], 1)
+
+    def test_cache_is_bounded(self):
+        cache_ = UserCache(max_size=2, ttl=60)
+        users = [self.admin_user.id] + [
+            User.objects.create_user(
+                username=f'user{i}@test.com', email=f'user{i}@test.com', password='testpass123',
+                first_name='U', last_name='U', phone_number=str(i)
+            ).id
+            for i in range(2)
+        ]
+        for pk in users:
+            cache_.get(pk)
+        self.assertEqual(cache_.stats()['size'], 2)
+        cache_.get(users[0])
+        self.assertEqual(cache_.misses, 4)
+
+    def test_misses_are_not_cached_and_entries_expire(self):
+        """Changes made by other processes are seen without the shared version"""
+        cache_ = UserCache(max_size=10, ttl=60)
+        unknown = self.admin_user.id + 100
+        self.assertIsNone(cache_.get(unknown))
+        self.assertEqual(cache_.stats()['size'], 0)
+        # bulk_create sends no signals, like a write made by another worker
+        User.objects.bulk_create([User(
+            id=unknown, username='other@test.com', email='other@test.com',
+            first_name='Other', last_name='User', phone_number='1'
+        )])
+        self.assertEqual(cache_.get(unknown).email, 'other@test.com')
+
+        cache_ = UserCache(max_size=10, ttl=0)
+        cache_.get(unknown)
+        User.objects.filter(pk=unknown).update(first_name='Renamed')
+        self.assertEqual(cache_.get(unknown).first_name, 'Renamed')
+
+
+FLAKY_TASK_CALLS = []
+
+
+@task('tests.flaky', max_attempts=2)
+def flaky_task(fail=True):
+    FLAKY_TASK_CALLS.append(fail)
+    if fail:
+        raise RuntimeError('Flaky failure')
+
+
+@task('tests.limited', concurrency=1)
+def limited_task():
+    pass
+
+
+STALE_RELEASES = []
+
+
+@task('tests.slow')
+def slow_task(seconds):
+    time.sleep(seconds)
+    STALE_RELEASES.append(release_stale_tasks())
+
+
+@override_settings(RIDE_DELETE_MODE='soft', TASK_RETRY_DELAY=0)
+class TaskQueueTests(RideFixturesMixin, APITestCase):
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.client.force_authenticate(self.admin_user)
+        FLAKY_TASK_CALLS.clear()
+
+    def test_soft_delete_is_purged_by_worker(self):
+        ride = self.make_ride()
+        RideEvent.objects.create(id_ride=ride, description='Event')
+        response = self.client.delete(reverse('ride-detail', kwargs={'pk': ride.pk}))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        task_row = Task.objects.get(task_type='rides.purge_ride')
+        self.assertEqual(task_row.payload, {'purge_id': response.data['id']})
+
+        out = StringIO()
+        call_command('run_tasks', '--once', stdout=out)
+        self.assertIn('ran 1 tasks', out.getvalue())
+        self.assertFalse(Ride.objects.filter(pk=ride.pk).exists())
+        self.assertFalse(RideEvent.objects.exists())
+        task_row.refresh_from_db()
+        self.assertEqual(task_row.status, Task.STATUS_DONE)
+
+    def test_failed_tasks_are_retried_then_failed(self):
+        queued = enqueue('tests.flaky')
+        self.assertEqual(run_worker(worker_id='w1', once=True), 2)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.STATUS_FAILED)
+        self.assertEqual(queued.attempts, 2)
+        self.assertEqual(queued.last_error, 'Flaky failure')
+
+        with self.assertRaises(ValueError):
+            enqueue('tests.unknown')
+
+    def test_claims_respect_concurrency_and_stale_locks(self):
+        running = enqueue('tests.limited')
+        self.assertEqual([claimed.pk for claimed in claim_tasks('w1')], [running.pk])
+        waiting = enqueue('tests.limited')
+        other = enqueue('tests.flaky', {'fail': False})
+
+        # The limited type already has its one task running
+        self.assertEqual([claimed.pk for claimed in claim_tasks('w2')], [other.pk])
+        self.assertEqual(claim_tasks('w2'), [])
+
+        # A worker that went silent gives its task back
+        Task.objects.filter(pk=running.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(release_stale_tasks(), 1)
+        claimed = claim_tasks('w3', batch_size=1)
+        self.assertEqual(len(claimed), 1)
+        self.assertIn(claimed[0].pk, {running.pk, waiting.pk})
+        self.assertEqual(claimed[0].locked_by, 'w3')
+
+    def test_released_task_is_not_run_twice(self):
+        """A batch task requeued and claimed elsewhere is skipped by its first worker"""
+        enqueue('tests.flaky', {'fail': False})
+        enqueue('tests.flaky', {'fail': False})
+        first, second = claim_tasks('w1')
+
+        Task.objects.filter(pk=second.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(release_stale_tasks(), 1)
+        self.assertEqual([claimed.pk for claimed in claim_tasks('w2')], [second.pk])
+
+        self.assertTrue(run_task(first))
+        self.assertFalse(run_task(second))
+        self.assertEqual(FLAKY_TASK_CALLS, [False])
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.locked_by), (Task.STATUS_RUNNING, 'w2'))
+
+
+
+@override_settings(TASK_LOCK_TIMEOUT=0.3)
+class TaskHeartbeatTests(TransactionTestCase):
+    def test_long_running_task_is_not_requeued(self):
+        """A task running past TASK_LOCK_TIMEOUT keeps its lock through heartbeats"""
+        STALE_RELEASES.clear()
+        queued = enqueue('tests.slow', {'seconds': 0.6})
+        self.assertEqual(run_worker(worker_id='w1', once=True), 1)
+        self.assertEqual(STALE_RELEASES, [0])
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Task.STATUS_DONE)
+        self.assertEqual(queued.attempts, 1)
+
+    def test_waiting_batch_tasks_are_not_requeued(self):
+        """Tasks claimed in a batch keep their lock while they wait behind a long one"""
+        STALE_RELEASES.clear()
+        queued = [enqueue('tests.slow', {'seconds': seconds}) for seconds in (0.6, 0)]
+        self.assertEqual(run_worker(worker_id='w1', once=True), 2)
+        self.assertEqual(STALE_RELEASES, [0, 0])
+        for row in queued:
+            row.refresh_from_db()
+            self.assertEqual((row.status, row.attempts), (Task.STATUS_DONE, 1))
+
+
+@override_settings(HEATMAP_ZOOM_LEVELS=[4, 10])
+class HeatmapTests(RideFixturesMixin, APITestCase):
+    SAN_FRANCISCO = (37.7749, -122.4194)
+    NEW_YORK = (40.7128, -74.0060)
+
+    def setUp(self):
+        self.admin_user = self.create_admin_user()
+        self.client.force_authenticate(self.admin_user)
+        self.now = timezone.now()
+
+    def create_ride(self, point, pickup_time=None):
+        response = self.post_ride(
+            pickup_latitude=point[0],
+            pickup_longitude=point[1],
+            dropoff_latitude=point[0],
+            dropoff_longitude=point[1],
+            pickup_time=(pickup_time or self.now).isoformat()
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id_ride']
+
+    def get_tiles(self, query='zoom=10'):
+        response = self.client.get(f"{reverse('ride-heatmap')}?{query}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {(tile['x'], tile['y']): tile['count'] for tile in response.data['tiles']}
+
+    def test_tiles_follow_ride_writes(self):
+        """Create, move and delete update the pickup tiles at every zoom level"""
+        self.assertEqual(tile_for(*self.SAN_FRANCISCO, 10), (163, 395))
+        sf_tile = tile_for(*self.SAN_FRANCISCO, 10)
+        ny_tile = tile_for(*self.NEW_YORK, 10)
+
+        first = self.create_ride(self.SAN_FRANCISCO)
+        self.create_ride(self.SAN_FRANCISCO)
+        self.create_ride(self.NEW_YORK)
+        self.assertEqual(self.get_tiles(), {sf_tile: 2, ny_tile: 1})
+        self.assertEqual(sum(self.get_tiles('zoom=4').values()), 3)
+
+        self.client.patch(reverse('ride-detail', kwargs={'pk': first}), {
+            'pickup_latitude': self.NEW_YORK[0], 'pickup_longitude': self.NEW_YORK[1]
+        })
+        self.assertEqual(self.get_tiles(), {sf_tile: 1, ny_tile: 2})
+
+        self.client.delete(reverse('ride-detail', kwargs={'pk': first}))
+        self.assertEqual(self.get_tiles(), {sf_tile: 1, ny_tile: 1})
+
+    def test_concurrent_updates_move_pickup_from_stored_point(self):
+        """A stale copy of the ride does not move its pickup out of the wrong tile"""
+        ride_id = self.create_ride(self.SAN_FRANCISCO)
+        stale = Ride.objects.get(pk=ride_id)
+        self.client.patch(reverse('ride-detail', kwargs={'pk': ride_id}), {
+            'pickup_latitude': self.NEW_YORK[0], 'pickup_longitude': self.NEW_YORK[1]
+        })
+
+        with patch.object(RideViewSet, 'get_object', return_value=stale):
+            self.client.patch(reverse('ride-detail', kwargs={'pk': ride_id}), {
+                'pickup_latitude': self.SAN_FRANCISCO[0], 'pickup_longitude': self.SAN_FRANCISCO[1]
+            })
+        self.assertEqual(self.get_tiles(), {tile_for(*self.SAN_FRANCISCO, 10): 1})
+
+        with patch.object(RideViewSet, 'get_object', return_value=Ride.objects.get(pk=ride_id)):
+            self.client.patch(reverse('ride-detail', kwargs={'pk': ride_id}), {
+                'pickup_latitude': self.NEW_YORK[0], 'pickup_longitude': self.NEW_YORK[1]
+            })
+            self.client.delete(reverse('ride-detail', kwargs={'pk': ride_id}))
+        self.assertEqual(self.get_tiles(), {})
+
+    def test_time_range_bbox_and_zoom(self):
+        """Only tiles of the requested hours and area are returned"""
+        self.create_ride(self.SAN_FRANCISCO, self.now - timedelta(days=2))
+        self.create_ride(self.SAN_FRANCISCO)
+        self.create_ride(self.NEW_YORK)
+
+        since = (self.now - timedelta(days=1)).isoformat().replace('+00:00', 'Z')
+        self.assertEqual(sum(self.get_tiles(f'zoom=10&pickup_from={since}').values()), 2)
+        self.assertEqual(sum(self.get_tiles(f'zoom=10&pickup_to={since}').values()), 1)
+        self.assertEqual(
+            self.get_tiles('zoom=10&bbox=37,-123,38,-122'),
+            {tile_for(*self.SAN_FRANCISCO, 10): 2}
+        )
+
+        for query in ('zoom=12', 'zoom=x', '', 'zoom=10&bbox=1,2'):
+            response = self.client.get(f"{reverse('ride-heatmap')}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_delete_takes_cascaded_pickups_out(self):
+        """Rides deleted along with their rider leave the tiles"""
+        rider = User.objects.create_user(
+            username='rider@test.com', email='rider@test.com', password='testpass123',
+            first_name='Rider', last_name='User', phone_number='1234567891'
+        )
+        self.create_ride(self.SAN_FRANCISCO)
+        for pickup_time in (self.now, self.now - timedelta(hours=2)):
+            self.assertEqual(self.post_ride(
+                id_rider=rider.id,
+                pickup_latitude=self.NEW_YORK[0],
+                pickup_longitude=self.NEW_YORK[1],
+                pickup_time=pickup_time.isoformat()
+            ).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(self.get_tiles().values()), 3)
+
+        rider.delete()
+        self.assertEqual(self.get_tiles(), {tile_for(*self.SAN_FRANCISCO, 10): 1})
+        self.assertEqual(get_heatmap(4)['total'], 1)
+
+    def test_rebuild_and_single_query_read(self):
+        """Rebuild recomputes tiles written outside the API; reads never touch rides"""
+        self.create_ride(self.SAN_FRANCISCO)
+        self.make_ride(
+            status='dropoff',
+            pickup_latitude=self.NEW_YORK[0],
+            pickup_longitude=self.NEW_YORK[1],
+            pickup_time=self.now
+        )
+        self.assertEqual(sum(self.get_tiles().values()), 1)
+
+        call_command('rebuild_heatmap', stdout=StringIO())
+        self.assertEqual(HeatmapTile.objects.count(), 4)
+        self.assertEqual(sum(self.get_tiles().values()), 2)
+        with self.assertNumQueries(1):
+            get_heatmap(10, start=self.now - timedelta(hours=1))
@@ -0,0 +1,46 @@
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Ride, RideChange
+from .pagination import bump_count_generation
+from .sharding import each_shard
+
+
+def backfill_trip_lengths(batch_size=1000, sleep=0, max_batches=None):
+    """
+    Stores the trip length of rides saved before it was kept on the row.
+    Rides are updated in pk order, one bulk UPDATE per batch. The length is
+    part of the payload, so each batch also moves updated_at, logs a change
+    for delta sync and invalidates cached counts, as a save would.
+    Returns the number of rides updated.
+    """
+    updated = batches = 0
+    for rides in each_shard(Ride.objects.filter(trip_length_km__isnull=True)):
+        last_pk = 0
+        while max_batches is None or batches < max_batches:
+            batch = list(
+                rides.filter(pk__gt=last_pk).order_by('pk').only(
+                    'pk', 'pickup_latitude', 'pickup_longitude',
+                    'dropoff_latitude', 'dropoff_longitude'
+                )[:batch_size]
+            )
+            if not batch:
+                break
+            now = timezone.now()
+            for ride in batch:
+                ride.trip_length_km = ride.calculate_trip_length()
+                ride.updated_at = now
+            with transaction.atomic(), transaction.atomic(using=rides.db):
+                Ride.objects.using(rides.db).bulk_update(batch, ['trip_length_km', 'updated_at'])
+                RideChange.objects.bulk_create([
+                    RideChange(id_ride=ride.pk, kind=RideChange.KIND_RIDE) for ride in batch
+                ])
+                bump_count_generation()
+            updated += len(batch)
+            batches += 1
+            last_pk = batch[-1].pk
+            if sleep:
+                time.sleep(sleep)
+    return updated
@@ -1,16 +1,26 @@
 # urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import RideViewSet, UserRegistrationView,CustomTokenObtainPairView
+from .views import RideViewSet, UserRegistrationView,CustomTokenObtainPairView, BulkUserProvisionView, RidePurgeStatusView
+from .views import UserCacheStatsView
 from rest_framework_simplejwt.views import TokenRefreshView
+from django.conf import settings
+from .views import async_token_obtain_pair
 
 
 router = DefaultRouter()
 router.register(r'rides', RideViewSet, basename='ride')
 
 urlpatterns = [
+    path('rides/purges/<int:pk>/', RidePurgeStatusView.as_view(), name='ride-purge-detail'),
     path('', include(router.urls)),
     path('register/', UserRegistrationView.as_view(), name='user-register'),
-    path('token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('users/bulk/', BulkUserProvisionView.as_view(), name='user-bulk-provision'),
+    path('users/cache/', UserCacheStatsView.as_view(), name='user-cache-stats'),
+    path(
+        'token/',
+        async_token_obtain_pair if settings.ASYNC_TOKEN_ENDPOINT else CustomTokenObtainPairView.as_view(),
+        name='token_obtain_pair'
+    ),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
\ No newline at end of file
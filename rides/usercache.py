@@ -0,0 +1,122 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .conditional import get_users_version
+from .models import User
+
+
+_MISSING = object()
+
+
+class UserCache:
+    """
+    Bounded LRU of users by pk, for validating ride foreign keys without a
+    SELECT per field. Unknown pks are not cached: a user created by another
+    process must be accepted at once.
+
+    Entries of a user are dropped by the User save/delete signals in this
+    process. Other processes see the users version move (bumped by the same
+    signals) when the cache backend is shared; with a per-process backend,
+    entries expire after `ttl` seconds, which bounds how long a user changed
+    or deleted elsewhere is served.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _check_version(self):
+        version = get_users_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _lookup(self, pk):
+        with self._lock:
+            self._check_version()
+            user, expires_at = self._entries.get(pk, (_MISSING, None))
+            if user is not _MISSING and expires_at <= time.monotonic():
+                del self._entries[pk]
+                user = _MISSING
+            if user is _MISSING:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(pk)
+                self.hits += 1
+            return user
+
+    def _store(self, pk, user):
+        with self._lock:
+            self._entries[pk] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(pk)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, pk):
+        """The user with `pk`, or None if there is none."""
+        user = self._lookup(pk)
+        if user is _MISSING:
+            user = User.objects.filter(pk=pk).first()
+            if user is None:
+                return None
+            self._store(pk, user)
+        # A copy per caller: instances carry per-request state (_state, related caches)
+        return copy.copy(user)
+
+    def invalidate(self, pks):
+        with self._lock:
+            for pk in pks:
+                self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def record_write(self):
+        with self._lock:
+            self.writes += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'writes': self.writes,
+                # Every hit is a SELECT on user that did not run
+                'queries_saved': self.hits,
+                'queries_saved_per_write': round(self.hits / self.writes, 2) if self.writes else None,
+            }
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    """Process-wide cache, rebuilt if USER_CACHE_SIZE or USER_CACHE_TTL changes."""
+    global _user_cache
+    max_size = getattr(settings, 'USER_CACHE_SIZE', 10000)
+    ttl = getattr(settings, 'USER_CACHE_TTL', 30)
+    with _user_cache_lock:
+        if _user_cache is None or (_user_cache.max_size, _user_cache.ttl) != (max_size, ttl):
+            _user_cache = UserCache(max_size, ttl)
+        return _user_cache
+
+
+def invalidate_users(pks):
+    get_user_cache().invalidate(pks)
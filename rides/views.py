@@ -1,20 +1,46 @@
-from django.shortcuts import render
+from django.shortcuts import get_object_or_404, render
+from django.http import Http404
 from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.exceptions import ValidationError
 from django.db.models import Prefetch, Q
 from django.utils import timezone
 from django.db.models import F
 from datetime import timedelta
 import logging
-from .models import Ride, RideEvent, User
+from .models import Ride, RideEvent, RidePurge, User
 from .serializers import RideSerializer, UserSerializer, RideEventSerializer
 from rest_framework import generics
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .serializers import CustomTokenObtainPairSerializer
+from .pagination import CustomPagination
+from .filters import RideFilterSet
+from .idempotency import idempotent
+from .tasks import enqueue
+from .usercache import get_user_cache
+from .archive import ride_event_history
+from .provisioning import provision_users
+from .passwords import PasswordHashingOverloaded, averify_password
+from .serializers import get_tokens_for_user
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import json
+from django.conf import settings
+from rest_framework.decorators import action
+from .counters import get_fleet_counters, record_ride_change, ride_counter_key
+from .heatmap import get_heatmap, record_pickup_change, ride_pickup_key
+from .filters import parse_bbox, parse_timestamp
+from django.db import DEFAULT_DB_ALIAS, transaction
+from .sync import cursor_for_timestamp, get_changes
+from .purge import soft_delete_ride
+from .sharding import ShardedQuerySet, alias_for_point, alias_for_ride, sharding_enabled
+from .serializers import RidePurgeSerializer
+from .serializers import RideEventChangeSerializer
+from django.utils.dateparse import parse_datetime
+from .conditional import list_validators, not_modified_response, ride_validators, set_validators
 from django.db.models import F
 from django.db.models.expressions import RawSQL
 
@@ -25,17 +51,52 @@ logger = logging.getLogger(__name__)
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
+@csrf_exempt
+@require_POST
+async def async_token_obtain_pair(request):
+    """
+    Async twin of CustomTokenObtainPairView for ASGI deployments.
+    The password check is awaited on the bounded hashing pool, so the event
+    loop keeps serving other requests while PBKDF2 runs.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'detail': 'JSON parse error.'}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+
+    errors = {
+        field: ['This field is required.']
+        for field in ('email', 'password') if not data.get(field)
+    }
+    if errors:
+        return JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+
+    user = await User.objects.filter(email=data['email']).afirst()
+    try:
+        valid = user is not None and await averify_password(user, data['password'])
+    except PasswordHashingOverloaded as e:
+        response = JsonResponse({'detail': str(e.detail)}, status=e.status_code)
+        response['Retry-After'] = '1'
+        return response
+
+    if not valid:
+        return JsonResponse(
+            {'detail': 'No active account found with the given credentials'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    if not user.is_active:
+        return JsonResponse({'detail': 'User account is disabled.'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    return JsonResponse(get_tokens_for_user(user))
+
 class IsAdminUser(IsAuthenticated):
     """Custom permission to only allow admin users"""
     def has_permission(self, request, view):
         return super().has_permission(request, view) and request.user.role == 'admin'
 
-class CustomPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
 class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -43,6 +104,48 @@ class UserRegistrationView(generics.CreateAPIView):
 
 
 
+class BulkUserProvisionView(generics.GenericAPIView):
+    """
+    Creates many users in one request for fleet onboarding.
+    Accepts a list of users (or {"users": [...]}) and reports per-row errors.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        rows = request.data.get('users') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list):
+            raise ValidationError({'users': 'Expected a list of users.'})
+
+        max_rows = getattr(settings, 'USER_PROVISIONING_MAX_ROWS', 1000)
+        if len(rows) > max_rows:
+            raise ValidationError({
+                'users': f'At most {max_rows} users per request; use the import_users command for larger files.'
+            })
+
+        # Threads, not processes: forking a web worker is unsafe
+        result = provision_users(rows, processes=False)
+        response_status = status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(result, status=response_status)
+
+
+class UserCacheStatsView(generics.GenericAPIView):
+    """
+    Hit rate of the user cache used to validate ride riders and drivers, and
+    the user queries it saved per ride write. Counters are per process.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_user_cache().stats())
+
+
+class RidePurgeStatusView(generics.RetrieveAPIView):
+    """Progress of the background removal of a deleted ride."""
+    queryset = RidePurge.objects.all()
+    serializer_class = RidePurgeSerializer
+    permission_classes = [IsAdminUser]
+
+
 class RideViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing Ride operations.
@@ -53,6 +156,39 @@ class RideViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdminUser]
     pagination_class = CustomPagination
 
+    def get_recent_events_since(self):
+        """
+        Start of the recent-events window, fixed for the whole request so the
+        prefetch and the cache validators agree.
+        """
+        if not hasattr(self, '_recent_events_since'):
+            self._recent_events_since = timezone.now() - timedelta(hours=24)
+        return self._recent_events_since
+
+    def get_validator_variant(self):
+        # Query parameters change the payload (filters, page, distance, history)
+        return sorted(self.request.query_params.lists())
+
+    def list(self, request, *args, **kwargs):
+        """
+        List rides. Responses carry an ETag that changes with any ride write;
+        a matching If-None-Match gets 304 without querying or serializing rides.
+        """
+        etag = list_validators(self.get_recent_events_since(), self.get_validator_variant())
+        not_modified = not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(self.get_serializer(queryset, many=True).data)
+        return set_validators(response, etag)
+
     def get_queryset(self):
         """
         Returns an optimized queryset for rides with related data.
@@ -60,10 +196,10 @@ class RideViewSet(viewsets.ModelViewSet):
         """
         try:
             # Base queryset with related fields - Query 1
-            queryset = Ride.objects.select_related('id_rider', 'id_driver')
+            queryset = Ride.objects.active().select_related('id_rider', 'id_driver')
             
             # Prefetch today's ride events - Query 2
-            twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
+            twenty_four_hours_ago = self.get_recent_events_since()
             recent_events_prefetch = Prefetch(
                 'ride_events',
                 queryset=RideEvent.objects.filter(created_at__gte=twenty_four_hours_ago),
@@ -72,20 +208,10 @@ class RideViewSet(viewsets.ModelViewSet):
             queryset = queryset.prefetch_related(recent_events_prefetch)
 
             # Apply filters
-            status_filter = self.request.query_params.get('status')
-            rider_email = self.request.query_params.get('rider_email')
+            queryset = RideFilterSet(self.request.query_params).filter_queryset(queryset)
             latitude = self.request.query_params.get('latitude')
             longitude = self.request.query_params.get('longitude')
-            
-            if status_filter:
-                if status_filter not in dict(Ride.RIDE_STATUS_CHOICES):
-                    raise ValidationError({
-                        'status': f'Invalid status. Must be one of: {", ".join(dict(Ride.RIDE_STATUS_CHOICES).keys())}'
-                    })
-                queryset = queryset.filter(status=status_filter)
-            
-            if rider_email:
-                queryset = queryset.filter(id_rider__email=rider_email)
+            point = None
 
             # Apply sorting
             sort_by = self.request.query_params.get('sort_by', 'pickup_time')
@@ -110,17 +236,52 @@ class RideViewSet(viewsets.ModelViewSet):
                     queryset = queryset.annotate(
                         distance=RawSQL(distance_formula, params=[lat, lon, lat])
                     ).order_by('distance')
+                    point = (lat, lon)
                 except (ValueError, TypeError):
                     raise ValidationError({'coordinates': 'Invalid coordinate format'})
+            elif sort_by == 'trip_length':
+                queryset = queryset.order_by('trip_length_km')
             else:
                 queryset = queryset.order_by('pickup_time')
 
-            return queryset
+            return self.route_to_shards(queryset, point)
 
         except Exception as e:
             logger.error(f"Error in get_queryset: {str(e)}")
             raise
 
+    def route_to_shards(self, queryset, point=None):
+        """
+        With sharded rides, a single ride is read from its own shard and lists
+        are gathered from every shard, nearest shards first for `point`.
+        """
+        if not sharding_enabled():
+            return queryset
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if lookup is not None:
+            alias = alias_for_ride(lookup)
+            return queryset.using(alias) if alias else queryset.none()
+        return ShardedQuerySet(queryset, point=point)
+
+    def lock_ride(self, ride):
+        """
+        Re-reads `ride` with its row locked; call inside the write transaction.
+        Concurrent writes of a ride then take turns, and each one moves the
+        counters and heatmap tiles from the values the previous one stored.
+        """
+        rides = Ride.objects.active().using(ride._state.db).select_for_update(of=('self',))
+        return get_object_or_404(rides, pk=ride.pk)
+
+    def alias_for_new_ride(self, data):
+        """
+        Database a ride created from `data` is written to. Ride writes open a
+        transaction there as well as on the default database, which holds
+        counters, the change feed and tasks, so both sides roll back together.
+        """
+        if not sharding_enabled():
+            return DEFAULT_DB_ALIAS
+        return alias_for_point(data['pickup_latitude'], data['pickup_longitude'])
+
     def get_serializer_context(self):
         """
         Add coordinates to serializer context for distance calculations.
@@ -132,31 +293,150 @@ class RideViewSet(viewsets.ModelViewSet):
         })
         return context
 
+    def wants_full_history(self):
+        return self.request.query_params.get('history') == 'full'
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Retrieve a ride.
+        With `?history=full`, includes every event, archived ones included.
+        Honours If-None-Match with a 304.
+        """
+        instance = self.get_object()
+        etag = ride_validators(
+            instance, self.get_recent_events_since(), self.get_validator_variant()
+        )
+        not_modified = not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        data = self.get_serializer(instance).data
+        if self.wants_full_history():
+            data['ride_events'] = RideEventSerializer(
+                ride_event_history(instance, include_archive=True),
+                many=True
+            ).data
+        return set_validators(Response(data), etag)
+
+    @action(detail=True, methods=['get'])
+    def events(self, request, pk=None):
+        """
+        Paginated export of a ride's events.
+        Live events only by default; `?history=full` unions the archive.
+        """
+        ride = self.get_object()
+        events = ride_event_history(ride, include_archive=self.wants_full_history())
+        page = self.paginate_queryset(events)
+        serializer = RideEventSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        Delta sync feed.
+        Pass the `cursor` from the previous response (or `updated_since` for
+        the first sync) to get rides changed, events created and rides deleted
+        since then. Keep polling while `has_more` is true.
+        """
+        cursor = request.query_params.get('cursor')
+        updated_since = request.query_params.get('updated_since')
+        limit = request.query_params.get('limit')
+
+        try:
+            limit = min(int(limit), 1000) if limit else None
+            if limit is not None and limit < 1:
+                raise ValueError
+        except ValueError:
+            raise ValidationError({'limit': 'Must be a positive integer'})
+
+        if cursor is not None:
+            try:
+                cursor = int(cursor)
+            except ValueError:
+                raise ValidationError({'cursor': 'Invalid cursor'})
+        elif updated_since:
+            since = parse_datetime(updated_since)
+            if since is None:
+                raise ValidationError({'updated_since': 'Must be an ISO 8601 datetime'})
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            cursor = cursor_for_timestamp(since)
+        else:
+            raise ValidationError({'cursor': 'Provide either cursor or updated_since'})
+
+        changes = get_changes(cursor, limit)
+        return Response({
+            'cursor': changes['cursor'],
+            'has_more': changes['has_more'],
+            'rides': self.get_serializer(changes['rides'], many=True).data,
+            'events': RideEventChangeSerializer(changes['events'], many=True).data,
+            'deleted': changes['deleted'],
+        })
+
+    @action(detail=False, methods=['get'])
+    def counters(self, request):
+        """
+        Live ride counts per status, read from the maintained counters.
+        Pass `driver` (comma-separated ids) for per-driver counts.
+        """
+        driver_ids = []
+        drivers = request.query_params.get('driver')
+        if drivers:
+            try:
+                driver_ids = [int(driver_id) for driver_id in drivers.split(',')]
+            except ValueError:
+                raise ValidationError({'driver': 'Must be a comma-separated list of user ids'})
+        return Response(get_fleet_counters(driver_ids))
+
+    @action(detail=False, methods=['get'])
+    def heatmap(self, request):
+        """
+        Pickup counts per slippy-map tile at `zoom`, read from the maintained
+        tiles. `pickup_from`/`pickup_to` select whole hours; `bbox` limits
+        the tiles returned.
+        """
+        params = request.query_params
+        try:
+            zoom = int(params.get('zoom', ''))
+        except ValueError:
+            raise ValidationError({'zoom': 'Must be an integer'})
+
+        parsed = {}
+        for name, parse in (('pickup_from', parse_timestamp), ('pickup_to', parse_timestamp), ('bbox', parse_bbox)):
+            if params.get(name):
+                try:
+                    parsed[name] = parse(params[name])
+                except ValueError as e:
+                    raise ValidationError({name: str(e)})
+
+        try:
+            heatmap = get_heatmap(
+                zoom,
+                start=parsed.get('pickup_from'),
+                end=parsed.get('pickup_to'),
+                bbox=parsed.get('bbox'),
+            )
+        except ValueError as e:
+            raise ValidationError({'zoom': str(e)})
+        return Response(heatmap)
+
+    @idempotent
     def create(self, request, *args, **kwargs):
         """
         Create a new ride with validated data.
-        Calculates distance if coordinates are provided.
+        The response's distance_to_pickup comes from the `latitude` and
+        `longitude` query parameters; nothing is saved a second time for it.
         """
         try:
             serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
+            using = self.alias_for_new_ride(serializer.validated_data)
             
-            # Create the ride instance
-            ride = serializer.save()
-            
-            # Calculate initial distance if coordinates provided
-            latitude = request.query_params.get('latitude')
-            longitude = request.query_params.get('longitude')
-            if latitude and longitude:
-                try:
-                    distance = ride.calculate_distance_to_point(
-                        float(latitude),
-                        float(longitude)
-                    )
-                    ride.distance_to_pickup = distance
-                    ride.save()
-                except (ValueError, TypeError):
-                    pass  # Skip distance calculation if coordinates are invalid
+            # Create the ride instance and count it in the same transaction
+            with transaction.atomic(), transaction.atomic(using=using):
+                ride = serializer.save()
+                record_ride_change(new=ride_counter_key(ride))
+                record_pickup_change(new=ride_pickup_key(ride))
             
             return Response(
                 self.get_serializer(ride).data,
@@ -175,47 +455,31 @@ class RideViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @idempotent
     def update(self, request, *args, **kwargs):
         """
         Update a ride instance.
-        Recalculates distance if coordinates are updated.
+        The stored trip length follows coordinate changes on save.
         """
         try:
             partial = kwargs.pop('partial', False)
             instance = self.get_object()
-            serializer = self.get_serializer(
-                instance,
-                data=request.data,
-                partial=partial
-            )
-            serializer.is_valid(raise_exception=True)
-            
-            # Check if location-related fields are being updated
-            location_fields = {
-                'pickup_latitude', 'pickup_longitude',
-                'dropoff_latitude', 'dropoff_longitude'
-            }
             
-            if any(field in request.data for field in location_fields):
-                # Save the updated instance
-                instance = serializer.save()
-                
-                # Recalculate distance if coordinates are provided
-                latitude = request.query_params.get('latitude')
-                longitude = request.query_params.get('longitude')
-                if latitude and longitude:
-                    try:
-                        distance = instance.calculate_distance_to_point(
-                            float(latitude),
-                            float(longitude)
-                        )
-                        instance.distance_to_pickup = distance
-                        instance.save()
-                    except (ValueError, TypeError):
-                        pass
-            else:
+            # Save the updated instance and move it between counters
+            with transaction.atomic(), transaction.atomic(using=instance._state.db):
+                instance = self.lock_ride(instance)
+                serializer = self.get_serializer(
+                    instance,
+                    data=request.data,
+                    partial=partial
+                )
+                serializer.is_valid(raise_exception=True)
+                old_counter_key = ride_counter_key(instance)
+                old_pickup_key = ride_pickup_key(instance)
                 instance = serializer.save()
-            
+                record_ride_change(old_counter_key, ride_counter_key(instance))
+                record_pickup_change(old_pickup_key, ride_pickup_key(instance))
+
             return Response(self.get_serializer(instance).data)
             
         except ValidationError as e:
@@ -223,6 +487,8 @@ class RideViewSet(viewsets.ModelViewSet):
                 {'error': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        except Http404:
+            raise
         except Exception as e:
             logger.error(f"Error updating ride: {str(e)}")
             return Response(
@@ -230,14 +496,37 @@ class RideViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @idempotent
     def destroy(self, request, *args, **kwargs):
         """
         Delete a ride instance.
+        With RIDE_DELETE_MODE='soft', the ride is hidden at once and its events
+        are removed by the background purger; responds 202 with a status URL.
         """
         try:
             instance = self.get_object()
-            instance.delete()
+            using = instance._state.db
+            if getattr(settings, 'RIDE_DELETE_MODE', 'inline') == 'soft':
+                with transaction.atomic(), transaction.atomic(using=using):
+                    locked = self.lock_ride(instance)
+                    record_ride_change(old=ride_counter_key(locked))
+                    record_pickup_change(old=ride_pickup_key(locked))
+                    purge = soft_delete_ride(locked)
+                    # Committed with the soft delete; a run_tasks worker purges it
+                    enqueue('rides.purge_ride', {'purge_id': purge.pk})
+                return Response(
+                    RidePurgeSerializer(purge, context=self.get_serializer_context()).data,
+                    status=status.HTTP_202_ACCEPTED
+                )
+
+            with transaction.atomic(), transaction.atomic(using=using):
+                locked = self.lock_ride(instance)
+                record_ride_change(old=ride_counter_key(locked))
+                record_pickup_change(old=ride_pickup_key(locked))
+                locked.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
+        except Http404:
+            raise
         except Exception as e:
             logger.error(f"Error deleting ride: {str(e)}")
             return Response(
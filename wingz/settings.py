@@ -1,5 +1,6 @@
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -121,7 +122,6 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-from rest_framework_simplejwt.settings import api_settings
 from datetime import timedelta
 
 # Simple JWT settings
@@ -129,7 +129,7 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=360),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
-    'USER_ID_FIELD': 'id_user',
+    'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
@@ -154,6 +154,92 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
+# Ride list counts: 'exact', 'cached' (invalidated on writes) or 'estimated'
+# (PostgreSQL planner statistics above the threshold, cached exact below it).
+# Caching needs a shared cache backend (CACHES) to see every worker's writes;
+# counts read from a per-process cache are reported with count_is_exact false.
+RIDE_COUNT_STRATEGY = os.getenv('RIDE_COUNT_STRATEGY', 'exact')
+RIDE_COUNT_CACHE_TIMEOUT = int(os.getenv('RIDE_COUNT_CACHE_TIMEOUT', 60))
+RIDE_COUNT_ESTIMATE_THRESHOLD = int(os.getenv('RIDE_COUNT_ESTIMATE_THRESHOLD', 100000))
+
+# Ride events older than this are moved to ride_event_archive by
+# `manage.py archive_ride_events`, in batches with a pause in between.
+RIDE_EVENT_RETENTION_DAYS = int(os.getenv('RIDE_EVENT_RETENTION_DAYS', 90))
+RIDE_EVENT_ARCHIVE_BATCH_SIZE = int(os.getenv('RIDE_EVENT_ARCHIVE_BATCH_SIZE', 1000))
+RIDE_EVENT_ARCHIVE_SLEEP = float(os.getenv('RIDE_EVENT_ARCHIVE_SLEEP', 0.1))
+
+# Bulk user provisioning (`manage.py import_users`, POST /api/users/bulk/).
+# Workers are the command's hashing processes, every core by default. The
+# endpoint hashes on its own thread pool (a quarter of the cores by default,
+# apart from the login pool) and sheds passwords beyond MAX_PENDING with a 503.
+USER_PROVISIONING_WORKERS = int(os.getenv('USER_PROVISIONING_WORKERS', 0)) or None
+USER_PROVISIONING_CHUNK_SIZE = int(os.getenv('USER_PROVISIONING_CHUNK_SIZE', 1000))
+USER_PROVISIONING_MAX_ROWS = int(os.getenv('USER_PROVISIONING_MAX_ROWS', 200))
+USER_PROVISIONING_THREADS = int(os.getenv('USER_PROVISIONING_THREADS', 0)) or None
+USER_PROVISIONING_MAX_PENDING = int(os.getenv('USER_PROVISIONING_MAX_PENDING', 400))
+
+# Login password checks: 'inline' or 'pool' (bounded thread pool; PBKDF2
+# releases the GIL). Calls beyond MAX_PENDING are shed with a 503.
+# ASYNC_TOKEN_ENDPOINT serves /api/token/ from an async view for ASGI workers.
+PASSWORD_HASHING_MODE = os.getenv('PASSWORD_HASHING_MODE', 'inline')
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', 0)) or None
+PASSWORD_HASHING_MAX_PENDING = int(os.getenv('PASSWORD_HASHING_MAX_PENDING', 64))
+ASYNC_TOKEN_ENDPOINT = os.getenv('ASYNC_TOKEN_ENDPOINT', 'False') == 'True'
+
+# Delta sync feed (GET /api/rides/changes/). Changes younger than the settle
+# window are held back so late-committing transactions are never skipped.
+DELTA_SYNC_PAGE_SIZE = int(os.getenv('DELTA_SYNC_PAGE_SIZE', 500))
+DELTA_SYNC_SETTLE_SECONDS = float(os.getenv('DELTA_SYNC_SETTLE_SECONDS', 2))
+
+# Ride deletion: 'inline' cascades inside the request; 'soft' hides the ride
+# and leaves the events to `manage.py purge_rides`, in batches.
+RIDE_DELETE_MODE = os.getenv('RIDE_DELETE_MODE', 'inline')
+RIDE_PURGE_BATCH_SIZE = int(os.getenv('RIDE_PURGE_BATCH_SIZE', 1000))
+RIDE_PURGE_SLEEP = float(os.getenv('RIDE_PURGE_SLEEP', 0))
+
+# Historical data loads (`manage.py load_history`): rows per transaction
+HISTORY_LOAD_CHUNK_SIZE = int(os.getenv('HISTORY_LOAD_CHUNK_SIZE', 5000))
+
+# Region sharding of rides and their events, as JSON:
+# {"region": {"database": "alias", "bbox": [min_lat, min_lon, max_lat, max_lon]}}
+# Pickups outside every bbox go to the region without one (else the first).
+# Shard aliases missing from DATABASES get a local SQLite file. Empty: no sharding.
+RIDE_SHARDS = json.loads(os.getenv('RIDE_SHARDS', '{}'))
+for _shard in RIDE_SHARDS.values():
+    DATABASES.setdefault(_shard['database'], {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f"{_shard['database']}.sqlite3",
+    })
+
+DATABASE_ROUTERS = ['rides.routers.RideShardRouter']
+
+# Idempotency-Key on ride writes: seconds a response is replayed for, and
+# seconds after which a request that never finished frees its key
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_KEY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_KEY_LOCK_SECONDS', 60))
+
+# Users kept per process to validate ride riders and drivers (LRU), and
+# seconds an entry is trusted for (changes made by other workers are only
+# seen by then unless the cache backend is shared)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 30))
+
+# Background tasks (`manage.py run_tasks`): tasks claimed per poll, attempts,
+# first retry delay in seconds (doubled per attempt), seconds before a silent
+# worker's tasks are requeued, and per-type concurrency limits as JSON
+# ({"rides.purge_ride": 4})
+TASK_BATCH_SIZE = int(os.getenv('TASK_BATCH_SIZE', 10))
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 5))
+TASK_RETRY_DELAY = float(os.getenv('TASK_RETRY_DELAY', 10))
+TASK_LOCK_TIMEOUT = int(os.getenv('TASK_LOCK_TIMEOUT', 300))
+TASK_CONCURRENCY = json.loads(os.getenv('TASK_CONCURRENCY', '{}'))
+
+# Zoom levels of the pickup heatmap tiles kept up to date on ride writes
+# (comma-separated); every level costs one counter write per ride
+HEATMAP_ZOOM_LEVELS = [
+    int(zoom) for zoom in os.getenv('HEATMAP_ZOOM_LEVELS', '6,8,10,12,14,16').split(',')
+]
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",  # For React/Frontend on localhost
     "http://127.0.0.1:3000",  # Alternative localhost
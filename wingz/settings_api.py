@@ -0,0 +1,51 @@
+"""
+API-only settings profile.
+
+Pure API nodes never serve the admin, sessions, flash messages, static files
+or HTML templates, so this profile drops them to keep worker boot short.
+Select it with DJANGO_SETTINGS_MODULE=wingz.settings_api; the admin URLs are
+only mounted when django.contrib.admin is installed.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+
+API_ONLY = True
+
+INSTALLED_APPS = [
+    app for app in INSTALLED_APPS
+    if app not in (
+        'django.contrib.admin',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+    )
+]
+
+# JWT authentication is handled by DRF, so session, CSRF and auth middleware
+# have nothing to do on these nodes.
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE
+    if middleware not in (
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    )
+]
+
+TEMPLATES = []
+
+# JSON only: the browsable API is what pulls in the template engine.
+# The router inspects every view's `schema` while building URLs, which would
+# import drf_spectacular (and the admin through it) at boot. API nodes never
+# serve a schema, so use DRF's base inspector; generate the OpenAPI schema
+# with the full `wingz.settings` profile.
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+    'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.inspectors.ViewInspector',
+}
@@ -1,8 +1,13 @@
 
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path,include
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/',include('rides.urls')),
 ]
+
+# The API-only settings profile drops the admin; import it only when installed
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))